@@ -1,26 +1,69 @@
-import collections
+import argparse
+import math
+import os
+import secrets
 import select
+import signal
 import socket
 import sys
 import time
 
 from enum import Enum, auto
+from tron_model import Arena
+from tron_model import InterestGrid
+from tron_model import PlayerModel
+from tron_model import spawn_positions
+from tron_profiler import SamplingProfiler
+from tron_profiler import TickWatchdog
+from tron_record import MatchRecorder
+from tron_record import apply_move
+from tron_record import read_rounds
 
 FPS = 40
 HOST = '0.0.0.0'
 PORT = 65432
+ANNOUNCE_PORT = 65433
+ANNOUNCE_INTERVAL = 1.0
 
 WIDTH = 1000
 HEIGHT = 1000
 NUM_PLAYERS = 3
 
-SPEED = (0.1, 0.3, 0.7, 0.9, 1.0, 1.1, 1.3, 1.7, 2.5, 4.1)
-SPEED_INITIAL = 4
+# With --interest, cycles outside the radius are sent every
+# INTEREST_FAR_EVERY ticks, or less often so that a client gets at most
+# about INTEREST_FAR_PER_TICK distant cycles per tick.
+INTEREST_FAR_EVERY = 4
+INTEREST_FAR_PER_TICK = 8
+
+RESUME_WAIT = 5.0               # for the RESUME line of a new connection
+
+# In lockstep mode an input takes effect LOCKSTEP_DELAY ticks after it
+# arrived. Clients learn of it right away and simulate a tick once they
+# know all its inputs. Without inputs a "K tick" every LOCKSTEP_DELAY
+# ticks tells them how far they may go.
+LOCKSTEP_DELAY = 4
+
+# Every PING_INTERVAL seconds each player gets "PING t rtt jitter offset"
+# and answers "PONG t t_arrived t_replied". t is the server's clock, the
+# client's times are on its own clock, rtt, jitter and offset are the
+# estimates so far for this player. The log shows them every
+# METRICS_INTERVAL seconds.
+PING_INTERVAL = 1.0
+METRICS_INTERVAL = 10.0
+
+# When ticks keep overrunning their budget, --degrade rate sends positions
+# only every DEGRADED_EVERY ticks and --degrade spectators sends them to
+# players who only watch every SPECTATOR_EVERY ticks.
+DEGRADED_EVERY = 2
+SPECTATOR_EVERY = 8
+
+PROFILE_WINDOW = 10.0           # seconds, for a profile started by SIGUSR1
 
 class TronServerConnection:
     def __init__(self, host, port, num_players):
         self.HOST = host
         self.PORT = port
+        self.announce_sock = None
 
         self.num_players = num_players
         self.conn = [None] * self.num_players
@@ -28,6 +71,21 @@ class TronServerConnection:
         self.buff = [""] * self.num_players
         self.line = [None] * self.num_players
 
+        # A player whose connection drops during a round keeps the slot
+        # until the round ends and can take it over again with its token.
+        self.token = [None] * self.num_players
+        self.lost = [False] * self.num_players
+        self.keep_slots = False
+        self.pending = []               # [conn, buff, since] to resume
+
+        # Per connection, in seconds: smoothed round trip time, its mean
+        # deviation and the client's clock minus the server's
+        self.rtt = [None] * self.num_players
+        self.jitter = [None] * self.num_players
+        self.offset = [None] * self.num_players
+        self.last_ping = [0] * self.num_players
+        self.ping_open = [False] * self.num_players
+
     def start(self):
         try:
             self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
@@ -36,6 +94,12 @@ class TronServerConnection:
             self.sock.bind((self.HOST, self.PORT))
             self.sock.listen(2 * self.num_players)
 
+            self.announce_sock = socket.socket(socket.AF_INET,
+                                               socket.SOCK_DGRAM)
+            self.announce_sock.setsockopt(socket.SOL_SOCKET,
+                                          socket.SO_BROADCAST, 1)
+            self.announce_sock.setblocking(False)
+
             print(f"TRON server running on {self.HOST}:{self.PORT}")
             print(f"Waiting for {self.num_players} players...")
             return True
@@ -47,11 +111,92 @@ class TronServerConnection:
     def num_joined(self):
         return sum(x is not None for x in self.name)
 
+    def announce(self, msg):
+        if self.announce_sock is None:
+            return
+        # The copies to localhost reach clients on this machine even if
+        # there is no network the broadcast could go out on. Clients share
+        # the port, and of a datagram to 127.0.0.1 only one of them gets
+        # a copy; one to the loopback broadcast address goes to all where
+        # the loopback interface has one, as on Linux.
+        for addr in ("<broadcast>", "127.255.255.255", "127.0.0.1"):
+            try:
+                self.announce_sock.sendto(msg.encode("utf-8"),
+                                          (addr, ANNOUNCE_PORT))
+            except OSError:
+                pass
+
     def disconnect_player(self, player_index):
         self.conn[player_index] = None
-        self.name[player_index] = None
         self.buff[player_index] = ""
         self.line[player_index] = None
+        self.rtt[player_index] = None
+        self.jitter[player_index] = None
+        self.offset[player_index] = None
+        self.ping_open[player_index] = False
+        if self.keep_slots and self.name[player_index] is not None:
+            self.lost[player_index] = True
+            return
+        self.name[player_index] = None
+        self.token[player_index] = None
+        self.lost[player_index] = False
+
+    def new_token(self, player_index):
+        self.token[player_index] = secrets.token_hex(8)
+        return self.token[player_index]
+
+    def release_lost(self):
+        self.keep_slots = False
+        for i in range(self.num_players):
+            if self.lost[i]:
+                print(f"Player {i + 1} did not come back")
+                self.disconnect_player(i)
+        for conn, _, _ in self.pending:
+            conn.close()
+        self.pending = []
+
+    # While slots are kept, new connections may only resume one of them:
+    # after the banner they have to send "RESUME token". Returns the index
+    # of the resumed slot or -1.
+    def accept_resume(self):
+        if any(self.lost):
+            try:
+                readable, _, _ = select.select([self.sock], [], [], 0)
+                if self.sock in readable:
+                    conn, addr = self.sock.accept()
+                    conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY,
+                                    1)
+                    conn.setblocking(False)
+                    conn.sendall(b"TRON\n")
+                    self.pending.append([conn, "", time.time()])
+            except OSError as e:
+                print(f"Error accepting connection: {type(e).__name__} – "
+                      f"{e}")
+
+        for entry in list(self.pending):
+            conn, buff, since = entry
+            try:
+                data = conn.recv(64)
+            except BlockingIOError:
+                data = None
+            except OSError:
+                data = b""
+            if data is not None:
+                buff = entry[1] = buff + data.decode("utf-8", "replace")
+            if data == b"" or "\n" in buff \
+                    or time.time() - since > RESUME_WAIT:
+                self.pending.remove(entry)
+                line = buff.split("\n", 1)[0].split()
+                if len(line) == 2 and line[0] == "RESUME" \
+                        and line[1] in self.token:
+                    i = self.token.index(line[1])
+                    if self.lost[i]:
+                        self.conn[i] = conn
+                        self.lost[i] = False
+                        print(f"Player {i + 1} resumed")
+                        return i
+                conn.close()
+        return -1
 
     def accept_new_connection(self):
         try:
@@ -133,6 +278,7 @@ class TronServerConnection:
                     self.disconnect_player(player_index)
                     return False
                 self.buff[player_index] += data.decode("utf-8")
+                self.take_pongs(player_index)
                 return True
         except (ConnectionResetError, BrokenPipeError, OSError) as e:
             print(f"Error reading from Player {player_index + 1}: "
@@ -146,6 +292,9 @@ class TronServerConnection:
             return ""
         self.read_from_client(player_index)
 
+        # Moves are never "P", the rest of a PONG is still on its way
+        if self.buff[player_index].startswith("P"):
+            return ""
         if len(self.buff[player_index]) > 0:
             ch = self.buff[player_index][0]
             self.buff[player_index] = self.buff[player_index][1:]
@@ -164,6 +313,67 @@ class TronServerConnection:
 
         return ""
 
+    def ping(self, now):
+        for i in range(self.num_players):
+            if self.conn[i] is None or self.name[i] is None:
+                continue
+            if self.ping_open[i]:
+                self.read_from_client(i)
+            if now - self.last_ping[i] >= PING_INTERVAL:
+                self.last_ping[i] = now
+                self.ping_open[i] = True
+                stats = " ".join("-" if v is None else f"{v:.6f}" for v in
+                                 (self.rtt[i], self.jitter[i],
+                                  self.offset[i]))
+                self.send_to_client(i, f"PING {now:.6f} {stats}\n")
+
+    # Sleeps until the given time, but takes PONGs as they come in, so
+    # that the round trip does not include the rest of the tick.
+    def wait(self, until):
+        while (timeout := until - time.time()) > 0:
+            waiting = [conn for conn, ping_open in zip(self.conn,
+                                                       self.ping_open)
+                       if conn is not None and ping_open]
+            if len(waiting) == 0:
+                time.sleep(timeout)
+                return
+            readable, _, _ = select.select(waiting, [], [], timeout)
+            for conn in readable:
+                self.read_from_client(self.conn.index(conn))
+
+    # A PONG can come in between moves at any time. It is taken out of
+    # the input as soon as it is complete.
+    def take_pongs(self, player_index):
+        buff = self.buff[player_index]
+        while (k := buff.find("PONG ")) >= 0 \
+                and (e := buff.find("\n", k)) >= 0:
+            self.pong(player_index, buff[k:e].split())
+            buff = buff[:k] + buff[e + 1:]
+        self.buff[player_index] = buff
+
+    # As in NTP: the time the client held the PING until its next frame
+    # is not part of the round trip, and the offset assumes the way there
+    # takes as long as the way back. Smoothing as for TCP's
+    # retransmission timer.
+    def pong(self, i, fields):
+        now = time.monotonic()
+        try:
+            sent, arrived, replied = map(float, fields[1:4])
+        except ValueError:
+            return
+        self.ping_open[i] = False
+        # The client only guesses when the PING arrived, it can not have
+        # held it for longer than the round trip
+        held = min(replied - arrived, now - sent)
+        rtt = (now - sent) - held
+        offset = ((replied - held - sent) + (replied - now)) / 2
+        if self.rtt[i] is None:
+            self.rtt[i], self.jitter[i], self.offset[i] = rtt, rtt / 2, offset
+        else:
+            self.jitter[i] += (abs(rtt - self.rtt[i]) - self.jitter[i]) / 4
+            self.rtt[i] += (rtt - self.rtt[i]) / 8
+            self.offset[i] += (offset - self.offset[i]) / 8
+
 
 class TronServer:
 
@@ -176,20 +386,48 @@ class TronServer:
         GAME_STARTED = auto()
         WAITING_FOR_END = auto()
 
-    def __init__(self, host, port, width, height, num_players):
-        assert num_players <= 4
-
+    def __init__(self, host, port, width, height, num_players,
+                 recorder = None, replay = None, replay_speed = 1,
+                 interest = None, max_trail = None, lockstep = False,
+                 degrade = ()):
         self.host = host
         self.port = port
         self.width = width
         self.height = height
         self.num_players = num_players
+        self.max_trail = max_trail
         self.ready_to_go = None
         self.confirmed_end = None
+        self.score = [0] * self.num_players
 
         self.arena = None
         self.player = [None] * self.num_players
         self.dt = 0
+        self.name = socket.gethostname().split(".")[0] or "tron"
+        self.last_announce = 0
+        self.last_metrics = time.monotonic()
+
+        self.recorder = recorder
+
+        self.replay = replay            # list of RecordedRound
+        self.replay_speed = replay_speed
+        self.replay_index = -1
+        self.replay_tick = 0
+
+        self.interest = None
+        if interest is not None:
+            self.interest = InterestGrid(interest)
+        self.far_every = max(INTEREST_FAR_EVERY,
+                             math.ceil(num_players / INTEREST_FAR_PER_TICK))
+        self.position_tick = 0
+
+        self.lockstep = lockstep
+        self.tick = 0
+        self.scheduled = {}             # tick -> [(player_index, move)]
+        self.lockstep_log = []          # (tick, player_index, move)
+
+        self.watchdog = TickWatchdog()
+        self.degrade = degrade          # actions under overload
 
         self.state = TronServer.State.INITIAL
         self.last_state = None
@@ -233,16 +471,45 @@ class TronServer:
     def new_round(self):
         self.ready_to_go = [False] * self.num_players
         self.confirmed_end = [False] * self.num_players
+        self.position_tick = 0
+        self.tick = 0
+        self.scheduled = {}
+        self.lockstep_log = []
+
+        if self.replay is not None:
+            self.replay_index = (self.replay_index + 1) % len(self.replay)
+            self.replay_tick = 0
+            self.arena = self.replay[self.replay_index].new_arena()
+            self.player = self.arena.player
+            return
 
-        start_config = [
-            (self.width // 3 * 1, self.height // 2, 1, 0),
-            (self.width // 3 * 2, self.height // 2, -1, 0),
-            (self.width // 2, self.height // 3 * 1, 0, 1),
-            (self.width // 2, self.height // 3 * 2, 0, -2)
-        ]
+        start_config = spawn_positions(self.width, self.height,
+                                       self.num_players)
         for i in range(self.num_players):
             self.player[i] = PlayerModel(*start_config[i])
-        self.arena = Arena(self.width, self.width, self.player)
+        self.arena = Arena(self.width, self.height, self.player,
+                           self.max_trail)
+        if self.recorder is not None:
+            self.recorder.start_round(self.arena, self.conn.name)
+
+    def player_names(self):
+        if self.replay is not None:
+            return self.replay[self.replay_index].names
+        return self.conn.name
+
+    def all_players_joined(self):
+        # A replay starts as soon as somebody is watching
+        if self.replay is not None:
+            return self.conn.num_joined() > 0
+        return self.conn.num_joined() == self.num_players
+
+    def tick_duration(self):
+        if self.replay is not None \
+                and self.state == TronServer.State.GAME_STARTED:
+            ticks = self.replay[self.replay_index].ticks
+            if self.replay_tick < len(ticks):
+                return ticks[self.replay_tick][0] / self.replay_speed
+        return 1.0 / FPS
 
     def num_ready_to_go(self):
         return sum(x is not False for x in self.ready_to_go)
@@ -252,6 +519,8 @@ class TronServer:
 
     def run(self, dt):
         self.dt = dt
+        budget = self.tick_duration()
+        self.watchdog.begin_tick()
         if self.state != self.last_state:
             self.last_state = self.state
             print(f"{self.get_state_msg()}")
@@ -262,6 +531,53 @@ class TronServer:
         else:
             print("No handler for state:", state)
 
+        self.announce()
+        self.measure_network()
+        self.watchdog.mark("other")
+        if (msg := self.watchdog.end_tick(budget)) is not None:
+            print(f"\n{msg}")
+
+    def announce(self):
+        if self.conn is None:
+            return
+        now = time.time()
+        if now - self.last_announce < ANNOUNCE_INTERVAL:
+            return
+        self.last_announce = now
+
+        free = self.num_players - self.conn.num_joined()
+        self.conn.announce(f"TRON {self.name} {self.port} "
+                           f"{self.width} {self.height} {free} "
+                           f"{self.state.name}\n")
+
+    def wait(self, until):
+        if self.conn is None:
+            time.sleep(max(0, until - time.time()))
+        else:
+            self.conn.wait(until)
+
+    def measure_network(self):
+        if self.conn is None:
+            return
+        now = time.monotonic()
+        self.conn.ping(now)
+        if now - self.last_metrics < METRICS_INTERVAL:
+            return
+        self.last_metrics = now
+
+        lines = []
+        for i in range(self.num_players):
+            if self.conn.rtt[i] is None:
+                continue
+            rtt, jitter = self.conn.rtt[i], self.conn.jitter[i]
+            offset = self.conn.offset[i]
+            lines.append(f"Player {i + 1} {self.conn.name[i]}: "
+                         f"rtt {rtt * 1000:.1f} ms, "
+                         f"jitter {jitter * 1000:.1f} ms, "
+                         f"clock offset {offset * 1000:+.1f} ms")
+        if len(lines) > 0:
+            print("\n" + "\n".join(lines))
+
     def get_state_msg(self):
         return f"state: {self.state}: " + self.state_msg[self.state]
 
@@ -286,7 +602,7 @@ class TronServer:
 
         self.conn.update_connections()
 
-        if self.conn.num_joined() == self.num_players:
+        if self.all_players_joined():
             self.state = TronServer.State.ALL_PLAYERS_CONNECTED
             return True
 
@@ -298,8 +614,16 @@ class TronServer:
             if self.conn.name[player_index] is not None:
                 continue
             if (name := self.conn.readline_from_client(player_index)) != "":
+                if name.startswith("RESUME "):
+                    # The round this token was for is over
+                    self.conn.conn[player_index].close()
+                    self.conn.disconnect_player(player_index)
+                    continue
                 self.conn.name[player_index] = name
-                self.conn.send_to_client(player_index, f"ID {player_index}\n")
+                self.score[player_index] = 0
+                token = self.conn.new_token(player_index)
+                self.conn.send_to_client(player_index,
+                                         f"ID {player_index} {token}\n")
                 print("List of players is now:")
                 for i in range(self.num_players):
                     if self.conn.name[i] is not None:
@@ -310,11 +634,14 @@ class TronServer:
         assert self.state == TronServer.State.ALL_PLAYERS_CONNECTED
 
         self.new_round()
-        self.conn.broadcast(f"ARENA {self.width} {self.height} "
-                            f"{self.num_players}\n")
+        msg = f"ARENA {self.width} {self.height} {self.num_players}"
+        if self.arena.max_trail is not None:
+            msg += f" {self.arena.max_trail:g}"
+        self.conn.broadcast(msg + "\n")
+        names = self.player_names()
         for player_index in range(self.num_players):
             self.conn.broadcast(f"NAME {player_index} "
-                                f"{self.conn.name[player_index]}\n")
+                                f"{names[player_index]}\n")
         self.conn.broadcast(f"GO\n")
 
         self.state = TronServer.State.WAITING_FOR_GO
@@ -333,6 +660,9 @@ class TronServer:
 
         if self.num_ready_to_go() >= self.conn.num_joined():
             self.conn.broadcast(f"START\n")
+            if self.lockstep:
+                self.conn.broadcast(self.lockstep_message())
+            self.conn.keep_slots = True
             self.state = TronServer.State.GAME_STARTED
             return True
         return False
@@ -340,22 +670,58 @@ class TronServer:
     def handle_game_started(self):
         assert self.state == TronServer.State.GAME_STARTED
 
+        if (player_index := self.conn.accept_resume()) >= 0:
+            msg = self.arena.gen_snapshot(self.player_names(), self.score)
+            if self.lockstep:
+                msg += self.lockstep_message()
+            self.conn.send_to_client(player_index, msg)
+
+        inputs = []
         for player_index in range(self.num_players):
             if (ch := self.conn.getchar_from_client(player_index)) != "":
-                if ch == "L":
-                    self.player[player_index].rotate_left()
-                elif ch == "R":
-                    self.player[player_index].rotate_right()
-                elif ch == "U":
-                    self.player[player_index].accelerate()
-                elif ch == "D":
-                    self.player[player_index].decelerate()
+                if ch in "LRUD":
+                    inputs.append((player_index, ch))
+
+        # In a replay the clients only watch
+        if self.replay is not None:
+            self.dt, inputs = \
+                    self.replay[self.replay_index].ticks[self.replay_tick]
+            self.replay_tick += 1
+
+        if self.lockstep:
+            inputs = self.schedule_inputs(inputs)
+            self.dt = 1.0 / FPS
+
+        self.watchdog.mark("input")
+
+        for player_index, ch in inputs:
+            apply_move(self.player[player_index], ch)
 
         self.arena.move_player(self.dt)
+        if self.recorder is not None:
+            self.recorder.tick(self.dt, inputs)
+        self.tick += 1
+        self.watchdog.mark("move")
+        if self.lockstep and self.tick % LOCKSTEP_DELAY == 0:
+            self.conn.broadcast(f"K {self.tick}\n", newline = False)
+        stamp = time.monotonic()
         while True:
-            msg, more = self.arena.gen_message()
-            self.conn.broadcast(msg, newline = False)
+            msg, more = self.arena.gen_message(stamp)
+            self.watchdog.mark("gen")
+            if msg[0] in "PT" and self.lockstep:
+                pass                    # clients simulate these themselves
+            elif msg[0] == "P":
+                self.send_positions(msg, stamp)
+            else:
+                self.conn.broadcast(msg, newline = False)
+            self.watchdog.mark("broadcast")
             if msg[0] == "E":
+                winner = int(msg.split()[1])
+                if winner >= 0:
+                    self.score[winner] += 1
+                if self.recorder is not None:
+                    self.recorder.end_round(winner)
+                self.conn.release_lost()
                 self.state = TronServer.State.WAITING_FOR_END
                 return True
             if not more:
@@ -363,6 +729,67 @@ class TronServer:
 
         return False
 
+    # Everything to start the simulation of the round in a client: the
+    # fixed step, the delay of inputs, the current tick and all inputs so
+    # far as triples of tick, player and move.
+    def lockstep_message(self):
+        msg = [f"LOCKSTEP {1.0 / FPS!r} {LOCKSTEP_DELAY} {self.tick}"]
+        msg.extend(f"{t} {i} {ch}" for t, i, ch in self.lockstep_log)
+        return " ".join(msg) + "\n"
+
+    def schedule_inputs(self, inputs):
+        if len(inputs) > 0:
+            tick = self.tick + LOCKSTEP_DELAY
+            self.scheduled[tick] = inputs
+            self.lockstep_log.extend((tick, i, ch) for i, ch in inputs)
+            self.conn.broadcast(f"I {tick} "
+                                + " ".join(f"{i} {ch}" for i, ch in inputs)
+                                + "\n", newline = False)
+        return self.scheduled.pop(self.tick, [])
+
+    def send_positions(self, msg, stamp):
+        if self.degraded("rate") and self.tick % DEGRADED_EVERY != 0:
+            return
+        if self.interest is not None:
+            self.broadcast_positions(msg, stamp)
+        elif self.degraded("spectators"):
+            print(f"\rBroadcast: {msg.strip()}", end="")
+            for i in range(self.num_players):
+                if self.wants_positions(i):
+                    self.conn.send_to_client(i, msg)
+        else:
+            self.conn.broadcast(msg, newline = False)
+
+    def degraded(self, action):
+        return self.watchdog.overloaded and action in self.degrade
+
+    # Players whose cycle is gone, and everybody in a replay, only watch
+    def wants_positions(self, i):
+        if self.conn.conn[i] is None:
+            return False
+        if not self.degraded("spectators") or self.tick % SPECTATOR_EVERY == 0:
+            return True
+        return self.replay is None and self.player[i].alive
+
+    # Area of interest: a client gets the cycles near its own every tick
+    # and the others every far_every ticks, staggered by player so that
+    # each tick carries a share of them. The first tick has all cycles.
+    def broadcast_positions(self, msg, stamp):
+        print(f"\rBroadcast: {msg.strip()}", end="")
+        self.interest.update(self.player)
+        tick = self.position_tick
+        self.position_tick += 1
+        for i in range(self.num_players):
+            if not self.wants_positions(i):
+                continue
+            near = self.interest.near(self.player[i].x, self.player[i].y)
+            ids = [j for j, p in enumerate(self.player)
+                   if p.alive and (tick == 0 or j in near
+                                   or (tick + j) % self.far_every == 0)]
+            if not self.conn.send_to_client(
+                    i, self.arena.gen_partial_message(ids, stamp)):
+                print(f"Could not send to Player {i + 1}")
+
     def handle_waiting_for_end(self):
         assert self.state == TronServer.State.WAITING_FOR_END
 
@@ -374,7 +801,7 @@ class TronServer:
         self.conn.update_connections()
 
         if self.num_confirmed_end() >= self.conn.num_joined():
-            if self.conn.num_joined() == self.num_players:
+            if self.all_players_joined():
                 self.state = TronServer.State.ALL_PLAYERS_CONNECTED
             else:
                 self.state = TronServer.State.WAITING_FOR_PLAYERS
@@ -383,156 +810,75 @@ class TronServer:
 
 #---------------------------------------------------------------------------
 
-def on_segment(p, q, r):
-    return min(p[0], r[0]) <= q[0] <= max(p[0], r[0]) and \
-           min(p[1], r[1]) <= q[1] <= max(p[1], r[1])
-
-def orientation(p, q, r):
-    val = (q[1] - p[1]) * (r[0] - q[0]) - \
-          (q[0] - p[0]) * (r[1] - q[1])
-    if abs(val) < 1e-9:
-        return 0
-    return 1 if val > 0 else 2
-
-def segments_intersect(p1, q1, p2, q2):
-    o1 = orientation(p1, q1, p2)
-    o2 = orientation(p1, q1, q2)
-    o3 = orientation(p2, q2, p1)
-    o4 = orientation(p2, q2, q1)
-
-    if o1 != o2 and o3 != o4:
-        return True
-
-    if o1 == 0 and on_segment(p1, p2, q1): return True
-    if o2 == 0 and on_segment(p1, q2, q1): return True
-    if o3 == 0 and on_segment(p2, p1, q2): return True
-    if o4 == 0 and on_segment(p2, q1, q2): return True
-    return False
-
-
-class Arena:
-    def __init__(self, width, height, player):
-        self.width = width
-        self.height = height
-        self.running = True
-        self.player = player
-        self.num_alive = len(self.player)
-        self.path = []
-        self.msg_queue = collections.deque()
-        # for debugging
-        self.last_pos = []
-        for i, p in enumerate(self.player):
-            p.set_arena(self, i)
-            self.path.append([(p.x, p.y), (p.x, p.y)])
-            self.last_pos.append([p.x, p.y])
-
-    def extend_path(self, player_id, x, y):
-        self.path[player_id].append((x, y))
-
-    def collission(self, player_id, x0, y0, x, y):
-        if x <= 0 or y <= 0 or x >= self.width - 1 or y >= self.height - 1:
-            return True
-        for path_index, path in enumerate(self.path):
-            skip_last = 3 if path_index == player_id else 1
-            for i in range(len(path) - skip_last):
-                if segments_intersect((x0, y0), (x, y), path[i], path[i+1]):
-                    return True
-        return False
-
-    def move_player(self, dt):
-        kill = []
-        for i, p in enumerate(self.player):
-            if not p.alive:
-                continue
-            x0, y0 = self.path[i][-1]
-            p.move(dt)
-            self.path[i][-1] = (p.x, p.y)
-            if self.collission(i, x0, y0, p.x, p.y):
-                kill.append((i, p))
-                p.x = max(p.x, 0)
-                p.x = min(p.x, self.width - 1)
-                p.y = max(p.y, 0)
-                p.y = min(p.y, self.width - 1)
-        for i, p in kill:
-            p.alive = False
-            self.path[i] = []
-            self.collision = True
-            self.num_alive -= 1
-            self.msg_queue.append(f"D {i}\n")
-
-    def gen_message(self):
-        if len(self.msg_queue):
-            return (self.msg_queue.popleft(), True)
-        elif self.num_alive > 1:
-            msg = "P"
-            for i, p in enumerate(self.player):
-                msg += f" {p.x:.2f} {p.y:.2f}"
-
-                if p.x != self.last_pos[i][0] and p.y != self.last_pos[i][1]:
-                    raise RuntimeError(f"Player {i}: last pos "
-                                       f"{self.last_pos[i]} "
-                                       f"new pos {p.x} {p.y}")
-                self.last_pos[i][0] = p.x
-                self.last_pos[i][1] = p.y
-            return (msg + "\n", False)
-        elif self.num_alive <= 1:
-            self.running = False
-            for i, p in enumerate(self.player):
-                if p.alive:
-                    return (f"E {i}\n", False)
-            return (f"E {-1}\n", False)
-        else:
-            return (None, False)
-
-class PlayerModel:
-    def __init__(self, x, y, dx, dy):
-        self.x = x
-        self.y = y
-        self.dx = dx
-        self.dy = dy
-        self.speed = SPEED_INITIAL
-        self.alive = True
-        self.arena = None
-        self.player_id = None
-
-    def set_arena(self, arena, player_id):
-        self.arena = arena
-        self.player_id = player_id
-
-    def rotate_left(self):
-        self.dx, self.dy = self.dy, -self.dx
-        self.arena.extend_path(self.player_id, self.x, self.y)
-
-    def rotate_right(self):
-        self.dx, self.dy = -self.dy, self.dx
-        self.arena.extend_path(self.player_id, self.x, self.y)
-
-    def accelerate(self):
-        if self.speed < len(SPEED) - 1:
-            self.speed += 1
-
-    def decelerate(self):
-        if self.speed > 0:
-            self.speed -= 1
-
-    def move(self, dt):
-        if not self.alive:
-            return
-
-        self.x += self.dx * SPEED[self.speed] * dt * 60
-        self.y += self.dy * SPEED[self.speed] * dt * 60
-
-#---------------------------------------------------------------------------
-
 def main(argv):
-    width, height, num_players = WIDTH, HEIGHT, NUM_PLAYERS
-
-    if len(argv) > 2:
-        width, height = int(argv[1]), int(argv[2])
-    if len(argv) > 3:
-        num_players = int(argv[3])
-
-    tron_server = TronServer(HOST, PORT, width, height, num_players)
+    parser = argparse.ArgumentParser(prog=argv[0],
+                                     description="TRON lightcycle server.")
+    parser.add_argument("width", type=int, nargs="?", default=WIDTH)
+    parser.add_argument("height", type=int, nargs="?", default=HEIGHT)
+    parser.add_argument("num_players", type=int, nargs="?",
+                        default=NUM_PLAYERS)
+    parser.add_argument("--record", metavar="FILE",
+                        help="append every round to a match recording")
+    parser.add_argument("--replay", metavar="FILE",
+                        help="stream the rounds of a recording to clients "
+                             "instead of playing")
+    parser.add_argument("--speed", type=float, default=1,
+                        help="replay speed, e.g. 1, 4 or 16 (default 1)")
+    parser.add_argument("--interest", type=float, metavar="RADIUS",
+                        help="send cycles farther than RADIUS from a "
+                             "client's own at a reduced rate")
+    parser.add_argument("--lockstep", action="store_true",
+                        help="send only inputs, clients simulate the "
+                             "round themselves")
+    parser.add_argument("--trail", type=float, metavar="LENGTH",
+                        help="bounded trails: the end of a trail "
+                             "disappears once it is longer than LENGTH")
+    parser.add_argument("--profile-dir", metavar="DIR", default=".",
+                        help="where SIGUSR1 profiles go (default .)")
+    parser.add_argument("--degrade", action="append", default=[],
+                        choices=["rate", "spectators"],
+                        help="under overload send fewer positions: "
+                             "to everybody (rate) or to players who only "
+                             "watch (spectators); can be given twice")
+    args = parser.parse_args(argv[1:])
+
+    width, height, num_players = args.width, args.height, args.num_players
+    if args.trail is not None and args.trail <= 0:
+        parser.error("--trail must be positive")
+    if args.lockstep and args.replay is not None:
+        parser.error("--lockstep can not be used with --replay")
+
+    recorder = None
+    if args.record is not None:
+        recorder = MatchRecorder(args.record)
+        print(f"Recording rounds to {args.record}")
+
+    replay = None
+    if args.replay is not None:
+        replay = [rnd for rnd in read_rounds(args.replay)
+                  if rnd.winner is not None]
+        if len(replay) == 0:
+            print(f"No complete rounds in {args.replay}")
+            return
+        replay = [rnd for rnd in replay
+                  if rnd.num_players() == replay[0].num_players()]
+        width, height = replay[0].width, replay[0].height
+        num_players = replay[0].num_players()
+        print(f"Replaying {len(replay)} rounds from {args.replay} "
+              f"at {args.speed}x")
+
+    # A profile of the running server, without restarting it
+    if hasattr(signal, "SIGUSR1"):
+        profiler = SamplingProfiler(PROFILE_WINDOW,
+                                    directory=args.profile_dir)
+        signal.signal(signal.SIGUSR1, lambda signum, frame:
+                      profiler.toggle())
+        print(f"kill -USR1 {os.getpid()} profiles the next "
+              f"{PROFILE_WINDOW:g} s")
+
+    tron_server = TronServer(HOST, PORT, width, height, num_players,
+                             recorder, replay, args.speed, args.interest,
+                             args.trail, args.lockstep, args.degrade)
 
     last_time = time.time()
     while True:
@@ -542,6 +888,6 @@ def main(argv):
 
         tron_server.run(dt)
 
-        time.sleep(max(0, 1.0 / FPS - (time.time() - now)))
+        tron_server.wait(now + tron_server.tick_duration())
 
 main(sys.argv)
@@ -0,0 +1,51 @@
+import random
+
+from tron_model import Arena
+from tron_model import PlayerModel
+from tron_model import segments_intersect
+from tron_model import spawn_positions
+
+# Same test as Arena.collission, against every segment of every path
+def brute_force_collission(arena, player_id, x0, y0, x, y):
+    if x <= 0 or y <= 0 or x >= arena.width - 1 or y >= arena.height - 1:
+        return True
+    for j, path in enumerate(arena.path):
+        skip_last = 3 if j == player_id else 1
+        for i in range(len(path) - skip_last):
+            if segments_intersect((x0, y0), (x, y), path[i], path[i + 1]):
+                return True
+    return False
+
+class CheckedArena(Arena):
+    def collission(self, player_id, x0, y0, x, y):
+        hit = super().collission(player_id, x0, y0, x, y)
+        assert hit == brute_force_collission(self, player_id, x0, y0, x, y)
+        return hit
+
+def play(num_players, max_trail, seed, width=1000, height=1000):
+    rng = random.Random(seed)
+    player = [PlayerModel(*spawn) for spawn
+              in spawn_positions(width, height, num_players)]
+    arena = CheckedArena(width, height, player, max_trail)
+    for tick in range(3000):
+        for p in player:
+            if p.alive and rng.random() < 0.05:
+                rng.choice((p.rotate_left, p.rotate_right))()
+        arena.move_player(1 / 60)
+        if arena.num_alive <= 1:
+            break
+    return arena
+
+# Trimming the front of a path must take it out of the spatial hash too
+def test_bounded_trail_matches_brute_force():
+    for num_players, max_trail in ((2, 100), (5, 37.5), (16, 37.5)):
+        for seed in range(4):
+            play(num_players, max_trail, seed)
+
+def test_bounded_trail_hash_is_clean():
+    arena = play(16, 37.5, 0)
+    for entries in arena.cells.values():
+        for player_id, i in entries:
+            if arena.player[player_id].alive:
+                assert 0 <= i - arena.tail[player_id] \
+                        < len(arena.path[player_id]) - 1
@@ -1,10 +1,17 @@
+import time
+STARTED = time.perf_counter()
+
+import collections
+import colorsys
 import math
 import pygame
-import serial
 import sys
+import threading
 from tron_client import TronClient
 from tron_client import ServerScanner
-import serial.tools.list_ports
+from tron_profiler import FrameProfiler
+from tron_serial import open_controller
+from tron_text import TextCache
 import getpass
 
 C_PLAYER = [
@@ -14,13 +21,27 @@ C_PLAYER = [
     (0, 255, 128)    # turquoise green (Player 4)
 ]
 
+# Players beyond the four above get hues spaced by the golden angle, so
+# that consecutive players always look different.
+def player_color(i):
+    if i < len(C_PLAYER):
+        return C_PLAYER[i]
+    hue = (i - len(C_PLAYER)) * 0.618034 % 1.0
+    return tuple(round(c * 255) for c in colorsys.hsv_to_rgb(hue, 0.8, 1.0))
+
 C_ARENA = (50, 50, 50)
 C_DEAD = (55, 10, 10)
 C_GRID = (200, 200, 200)
+C_BORDER = (255, 0, 0)
+
+GRID_SIZE = 50
+TILE_SIZE = 5 * GRID_SIZE
+TRAIL_WIDTH = 3
 
 class Tron2D:
 
     def __init__(self, fps, width, height):
+        self.init_started = time.perf_counter()
         self.fps = fps
         self.width, self.height = width, height
 
@@ -29,75 +50,197 @@ class Tron2D:
         self.port = 65432
         self.edit = 0
         self.server_scanner = ServerScanner()
-        self.server_scanner.start_scan()
         self.serverlist_i = 0
         self.serverlist_i0 = 0
 
         self.winner = None
 
-        ser_dev = next(
-            (p.device for p in serial.tools.list_ports.comports()
-                if p.device.startswith("/dev/cu.usbserial")),
-            None
-        )
-        self.ser = None
-        if ser_dev is not None:
-            try:
-                self.ser = serial.Serial(ser_dev, 9600, timeout=0)
-                self.ser.write(b'X')
-            except:
-                print(f"can not open serial device {ser_dev}")
+        self.controller = None
 
         self.tron_client = TronClient(self)
 
         pygame.init()
         pygame.display.set_caption("TRON: Lightcycle 2D")
 
-        fonts = pygame.font.get_fonts()
-        for name in sorted(fonts):
-            print(name)
-        
-        mono_fonts = ["andalemono", "consolas", "couriernew", "monospace"]
-        normal_fonts = ["helvetica", "timesnewroman", "monospace"]
-
-        self.title_font = pygame.font.SysFont(normal_fonts, 48)
-        self.score_font = pygame.font.SysFont(mono_fonts, 20)
-        self.state_font = pygame.font.SysFont(mono_fonts, 24, italic=True)
-        self.winner_font = pygame.font.SysFont(normal_fonts, 60)
-        self.input_font = pygame.font.SysFont(mono_fonts, 32)
-        self.hint_font = pygame.font.SysFont(mono_fonts, 18)
-        self.list_font = pygame.font.SysFont(mono_fonts, 18)
+        self.set_fonts(self.load_fonts(system_fonts=False))
+        self.system_fonts = None        # set by a background thread
+        self.text_cache = TextCache()
+        self.profiler = FrameProfiler()
 
         self.screen = pygame.display.set_mode((self.width, self.height))
         self.clock = pygame.time.Clock()
 
-        self.s_arena = None
-        self.s_world = None
-        self.s_grid = None
+        self.tiles = None
+        self.s_view = None
+        self.first_frame = True
+        self.init_done = time.perf_counter()
 
     def __del__(self):
         pygame.quit()
 
+    def load_fonts(self, system_fonts = True):
+        # The first call of pygame.font.SysFont scans all installed fonts,
+        # which can take seconds. The built-in font is used until a
+        # background thread has loaded the system fonts.
+        def font(names, size, italic = False):
+            if system_fonts:
+                return pygame.font.SysFont(names, size, italic=italic)
+            f = pygame.font.Font(None, size)
+            f.set_italic(italic)
+            return f
+
+        mono_fonts = ["andalemono", "consolas", "couriernew", "monospace"]
+        normal_fonts = ["helvetica", "timesnewroman", "monospace"]
+
+        return {
+            "title_font": font(normal_fonts, 48),
+            "score_font": font(mono_fonts, 20),
+            "state_font": font(mono_fonts, 24, italic=True),
+            "winner_font": font(normal_fonts, 60),
+            "input_font": font(mono_fonts, 32),
+            "hint_font": font(mono_fonts, 18),
+            "list_font": font(mono_fonts, 18),
+        }
+
+    def set_fonts(self, fonts):
+        for name, font in fonts.items():
+            setattr(self, name, font)
+
+    def load_system_fonts(self):
+        start = time.perf_counter()
+        self.system_fonts = self.load_fonts()
+        print(f"System fonts loaded in "
+              f"{(time.perf_counter() - start) * 1000:.0f}ms")
+
+    def deferred_init(self):
+        self.load_system_fonts()
+        self.controller = open_controller()
+
+    def first_frame_done(self):
+        now = time.perf_counter()
+        print(f"Startup: imports {(self.init_started - STARTED) * 1000:.0f}ms"
+              f", init {(self.init_done - self.init_started) * 1000:.0f}ms"
+              f", first frame {(now - self.init_done) * 1000:.0f}ms"
+              f", total {(now - STARTED) * 1000:.0f}ms")
+
+        # Deferred until the connect screen is shown
+        threading.Thread(target=self.deferred_init, daemon=True).start()
+
     def new_arena(self):
         print("new arena")
 
         arena = self.tron_client.arena
-        self.s_arena = pygame.Surface((arena.width, arena.height))
-        self.s_world = pygame.Surface((arena.width * 2, arena.height * 2))
-        self.arena_viewport = pygame.Rect(0, 0, arena.width, arena.height)
-        self.arena_padding = (arena.width // 2, arena.height // 2)
-
-        self.s_grid = pygame.Surface((arena.width, arena.height))
-        self.s_grid.fill(C_ARENA)
-        for x in range(0, arena.width, 50):
-            pygame.draw.line(self.s_grid, C_GRID, (x, 0), (x, arena.height))
-        for y in range(0, arena.height, 50):
-            pygame.draw.line(self.s_grid, C_GRID, (0, y), (arena.width, y))
-
-        self.screen_crop = None
+
         w, h = min(self.width, arena.width), min(self.height, arena.height)
         self.screen_viewport = pygame.Rect(0, 0, w, h)
 
+        # Any rotation of the screen viewport fits into a square with the
+        # viewport's diagonal as side length.
+        d = math.ceil(math.hypot(w, h)) + 2
+        self.s_view = pygame.Surface((d, d))
+
+        # Grid and finished trails live in tiles that are rendered when
+        # they first become visible. Keep enough tiles for the view and
+        # some slack while turning; the least recently used go first.
+        n = d // TILE_SIZE + 2
+        self.max_tiles = 2 * n * n
+        self.tiles = collections.OrderedDict()
+
+        self.trail_player = None
+        self.trail_drawn = None
+        self.update_trails()
+
+    def tile_range(self, x0, y0, x1, y1):
+        arena = self.tron_client.arena
+        tx0 = max(0, int(x0) // TILE_SIZE)
+        ty0 = max(0, int(y0) // TILE_SIZE)
+        tx1 = min((arena.width - 1) // TILE_SIZE, int(x1) // TILE_SIZE)
+        ty1 = min((arena.height - 1) // TILE_SIZE, int(y1) // TILE_SIZE)
+        return ((tx, ty) for tx in range(tx0, tx1 + 1)
+                         for ty in range(ty0, ty1 + 1))
+
+    def draw_segment(self, tile, tx, ty, pi, p0, p1):
+        ox, oy = tx * TILE_SIZE, ty * TILE_SIZE
+        pygame.draw.line(tile, player_color(pi),
+                         (p0[0] - ox, p0[1] - oy), (p1[0] - ox, p1[1] - oy),
+                         TRAIL_WIDTH)
+
+    def segment_bounds(self, p0, p1):
+        margin = TRAIL_WIDTH
+        return (min(p0[0], p1[0]) - margin, min(p0[1], p1[1]) - margin,
+                max(p0[0], p1[0]) + margin, max(p0[1], p1[1]) + margin)
+
+    def render_tile(self, tx, ty):
+        arena = self.tron_client.arena
+        ox, oy = tx * TILE_SIZE, ty * TILE_SIZE
+
+        tile = pygame.Surface((TILE_SIZE, TILE_SIZE))
+        arena_rect = pygame.Rect(-ox, -oy, arena.width, arena.height)
+        tile.fill(C_ARENA, arena_rect)
+        for x in range(ox, min(ox + TILE_SIZE, arena.width), GRID_SIZE):
+            pygame.draw.line(tile, C_GRID, (x - ox, -oy),
+                             (x - ox, arena.height - oy))
+        for y in range(oy, min(oy + TILE_SIZE, arena.height), GRID_SIZE):
+            pygame.draw.line(tile, C_GRID, (-ox, y - oy),
+                             (arena.width - ox, y - oy))
+        pygame.draw.rect(tile, C_BORDER, arena_rect, 1)
+
+        for pi, p in enumerate(self.trail_player):
+            if p is None or p.path is None:
+                continue
+            for i in range(self.trail_drawn[pi]):
+                p0, p1 = p.path[i], p.path[i + 1]
+                x0, y0, x1, y1 = self.segment_bounds(p0, p1)
+                if x0 < ox + TILE_SIZE and x1 >= ox \
+                        and y0 < oy + TILE_SIZE and y1 >= oy:
+                    self.draw_segment(tile, tx, ty, pi, p0, p1)
+        return tile
+
+    def get_tile(self, tx, ty):
+        tile = self.tiles.get((tx, ty))
+        if tile is None:
+            tile = self.render_tile(tx, ty)
+            self.tiles[(tx, ty)] = tile
+            if len(self.tiles) > self.max_tiles:
+                self.tiles.popitem(last=False)
+        else:
+            self.tiles.move_to_end((tx, ty))
+        return tile
+
+    def redraw_trails(self):
+        arena = self.tron_client.arena
+
+        self.tiles.clear()
+        self.trail_player = list(arena.player or [])
+        self.trail_drawn = [0] * len(self.trail_player)
+
+    def update_trails(self):
+        # Tiles keep the grid and all finished trail segments; only the
+        # segment a cycle is extending gets drawn per frame. Redraw from
+        # scratch when a player died or a new round created new players.
+        arena = self.tron_client.arena
+        player = arena.player or []
+        if self.trail_player is None \
+                or len(player) != len(self.trail_player) \
+                or any(p is not q for p, q in zip(player, self.trail_player)):
+            self.redraw_trails()
+
+        # Bounded trails change at both ends, show_arena draws them
+        if arena.max_trail is not None:
+            return
+
+        for pi, p in enumerate(player):
+            if p is None or p.path is None:
+                continue
+            for i in range(self.trail_drawn[pi], len(p.path) - 2):
+                p0, p1 = p.path[i], p.path[i + 1]
+                bounds = self.segment_bounds(p0, p1)
+                for tx, ty in self.tile_range(*bounds):
+                    tile = self.tiles.get((tx, ty))
+                    if tile is not None:
+                        self.draw_segment(tile, tx, ty, pi, p0, p1)
+            self.trail_drawn[pi] = max(self.trail_drawn[pi], len(p.path) - 2)
+
     def focus_coords(self):
         assert self.tron_client.arena is not None
 
@@ -122,31 +265,33 @@ class Tron2D:
         color = (255, 255, 255)
         if winner >= 0:
             msg = f"{arena.name[winner]} won"
-            color = C_PLAYER[winner]
+            color = player_color(winner)
         print(msg)
         self.winner = self.winner_font.render(msg, True, color)
 
     def show_connect(self):
-        title_text = self.title_font.render("TRON: Lightcycle", True,
-                                            (255, 255, 255))
+        title_text = self.text_cache.get(self.title_font, "TRON: Lightcycle",
+                                         (255, 255, 255))
         title_rect = title_text.get_rect(center=(self.width // 2, 80))
         self.screen.blit(title_text, title_rect)
 
-        prompt_name = self.input_font.render("Name:", True, (100, 200, 100))
-        input_name = self.input_font.render(self.name
-            + ("‸" if self.edit == 0 else ""), True, (155, 255, 155))
+        prompt_name = self.text_cache.get(self.input_font, "Name:",
+                                          (100, 200, 100))
+        input_name = self.text_cache.get(self.input_font, self.name
+            + ("‸" if self.edit == 0 else ""), (155, 255, 155))
         self.screen.blit(prompt_name, (self.width // 5, 180))
         self.screen.blit(input_name,   (self.width // 5 + 150, 180))
 
-        prompt_server = self.input_font.render("Server:", True, (100, 200, 100))
-        input_server = self.input_font.render(self.host
-            + ("‸" if self.edit == 1 else ""), True, (155, 255, 155))
+        prompt_server = self.text_cache.get(self.input_font, "Server:",
+                                            (100, 200, 100))
+        input_server = self.text_cache.get(self.input_font, self.host
+            + ("‸" if self.edit == 1 else ""), (155, 255, 155))
         self.screen.blit(prompt_server, (self.width // 5, 230))
         self.screen.blit(input_server,   (self.width // 5 + 150, 230))
 
         hint = ("^Q: Quit  |  TAB: switch field  |  ^F: find server  "
                 "|  RETURN: connect")
-        hint_text = self.hint_font.render(hint, True, (150, 150, 150))
+        hint_text = self.text_cache.get(self.hint_font, hint, (150, 150, 150))
         hint_rect = hint_text.get_rect(center=(self.width // 2,
                                                self.height - 80))
         self.screen.blit(hint_text, hint_rect)
@@ -155,8 +300,8 @@ class Tron2D:
         return self.server_scanner.get_found()
 
     def show_serverlist(self):
-        title_text = self.title_font.render(
-                "TRON servers in local network", True, (255, 255, 255))
+        title_text = self.text_cache.get(self.title_font,
+                "TRON servers in local network", (255, 255, 255))
         title_rect = title_text.get_rect(center=(self.width // 2, 80))
         self.screen.blit(title_text, title_rect)
 
@@ -186,18 +331,23 @@ class Tron2D:
         for i0, addr in enumerate(server_list):
             i = self.serverlist_i0 + i0
             color = (0, 255, 255) if i == self.serverlist_i else (180, 180, 180)
-            entry = self.list_font.render(f"({i}) " + addr, True, color)
+            text = f"({i}) " + addr
+            info = self.server_scanner.get_info(addr)
+            if info is not None:
+                text += f"  {info['name']}  {info['free']} free"
+            entry = self.text_cache.get(self.list_font, text, color)
             self.screen.blit(entry, (lx, ly + i0 * 40))
 
         hint = "ESC: Cancle  |  RETURN: select  |  ↑↓:  up / down"
-        hint_text = self.hint_font.render(hint, True, (150, 150, 150))
+        hint_text = self.text_cache.get(self.hint_font, hint, (150, 150, 150))
         hint_rect = hint_text.get_rect(center=(self.width // 2,
                                                self.height - 80))
         self.screen.blit(hint_text, hint_rect)
 
     def show_state(self):
         state = self.tron_client.get_state_msg()
-        state_text = self.state_font.render(state, True, (150, 150, 150))
+        state_text = self.text_cache.get(self.state_font, state,
+                                         (150, 150, 150))
         state_rect = state_text.get_rect(center=(self.width // 2,
                                                  self.height - 40))
         self.screen.blit(state_text, state_rect)
@@ -213,13 +363,13 @@ class Tron2D:
         for i, p in enumerate(arena.player):
             color = (100, 150, 50)
             if arena.ready[i]:
-                color = C_PLAYER[i]
+                color = player_color(i)
             text = f"{arena.name[i]}: {arena.score[i]}"
             if arena.I_am_player is not None and i == arena.I_am_player:
                 text = "> " + text
             else:
                 text = "  " + text
-            label = self.score_font.render(text, True, color)
+            label = self.text_cache.get(self.score_font, text, color)
             self.screen.blit(label, (padding, y))
             y += label.get_height() + 5
 
@@ -228,76 +378,108 @@ class Tron2D:
                                                        self.height // 2))
             self.screen.blit(self.winner, winner_rect)
 
+    def show_profiler(self):
+        if not self.profiler.enabled:
+            return
+
+        padding = 10
+        labels = [self.text_cache.get(self.hint_font, line, (255, 255, 0))
+                  for line in self.profiler.get_text(self.tron_client)]
+        if len(labels) == 0:
+            return
+        w = max(label.get_width() for label in labels)
+        h = sum(label.get_height() for label in labels)
+        x0 = self.width - w - 2 * padding
+        pygame.draw.rect(self.screen, (0, 0, 0),
+                         (x0, 0, w + 2 * padding, h + 2 * padding))
+        y = padding
+        for label in labels:
+            self.screen.blit(label, (x0 + padding, y))
+            y += label.get_height()
+
     def show_arena(self):
         assert self.tron_client.arena is not None
 
         arena = self.tron_client.arena
 
-        self.s_arena.blit(self.s_grid, (0, 0))
+        self.update_trails()
 
-        border_color = (255, 0, 0)
-        border_rec = pygame.Rect(0, 0, arena.width, arena.height) 
-        pygame.draw.rect(self.s_arena, border_color, border_rec, 1)
+        x, y, angle = self.focus_coords()
+        angle %= 360
+
+        # Crop only the part of the arena that can end up on screen, i.e.
+        # the bounding box of the rotated screen viewport. For multiples of
+        # 90° that is the (possibly transposed) viewport itself.
+        w, h = self.screen_viewport.size
+        if angle == 90 or angle == 270:
+            w, h = h, w
+        elif angle % 90 != 0:
+            c = abs(math.cos(math.radians(angle)))
+            s = abs(math.sin(math.radians(angle)))
+            d = self.s_view.get_width()
+            w, h = (min(math.ceil(w * c + h * s) + 2, d),
+                    min(math.ceil(w * s + h * c) + 2, d))
+        view = self.s_view.subsurface((0, 0, w, h))
+
+        ox, oy = round(x) - w // 2, round(y) - h // 2
+        view.fill((0, 0, 0))
+        for tx, ty in self.tile_range(ox, oy, ox + w, oy + h):
+            view.blit(self.get_tile(tx, ty),
+                      (tx * TILE_SIZE - ox, ty * TILE_SIZE - oy))
 
         for pi, p in enumerate(arena.player):
             if p is None or p.path is None:
                 continue
-            for i in range(len(p.path) - 1):
-                x0, y0 = p.path[i]
-                x1, y1 = p.path[i + 1]
-                pygame.draw.line(self.s_arena, C_PLAYER[pi],
-                                 (x0, y0), (x1, y1), 3)
-
-        x, y, angle = self.focus_coords()
-
-        self.s_world.blit(self.s_arena, self.arena_padding)
-        self.arena_viewport.center = (x + self.arena_padding[0],
-                                      y + self.arena_padding[1])
-
-        self.screen_crop = self.s_world.subsurface(self.arena_viewport)
-        rotated = pygame.transform.rotate(self.screen_crop, angle)
-        self.screen_viewport.center = rotated.get_rect().center
-        rotated = rotated.subsurface(self.screen_viewport)
-        self.screen.blit(rotated, (0,0))
+            if arena.max_trail is not None:
+                pygame.draw.lines(view, player_color(pi), False,
+                                  [(x - ox, y - oy) for x, y in p.path],
+                                  TRAIL_WIDTH)
+            x0, y0 = p.path[-2]
+            x1, y1 = p.path[-1]
+            pygame.draw.line(view, player_color(pi),
+                             (x0 - ox, y0 - oy), (x1 - ox, y1 - oy),
+                             TRAIL_WIDTH)
+
+        if angle != 0:
+            view = pygame.transform.rotate(view, angle)
+        self.screen_viewport.center = view.get_rect().center
+        self.screen.blit(view.subsurface(self.screen_viewport), (0, 0))
+
+    def handle_controller(self):
+        if self.controller is None:
+            return
+        moves = {"A": "L", "B": "R", "U": "U", "D": "D"}
+        for t, event in self.controller.get_events():
+            self.profiler.input_latency(time.monotonic() - t)
+            if self.tron_client.game_is_on():
+                self.tron_client.send_move(moves[event])
+        if not self.controller.running:
+            self.controller = None
 
     def run(self):
         in_select_server = False
         while True:
+            self.profiler.begin_frame()
+            if self.system_fonts is not None:
+                self.set_fonts(self.system_fonts)
+                self.system_fonts = None
             self.tron_client.run()
+            self.profiler.mark("client")
             self.screen.fill((0, 0, 0))
-            if self.tron_client.not_connected() or self.s_arena is None:
+            if self.tron_client.not_connected() or self.tiles is None:
                 if in_select_server:
                     self.show_serverlist()
                 else:
                     self.show_connect()
             else:
                 self.show_arena()
+                self.profiler.mark("arena")
                 self.show_score()
             self.show_state()
+            self.show_profiler()
+            self.profiler.mark("hud")
 
-            if self.ser is not None and self.ser.in_waiting > 0:
-                ch = self.ser.read(1)
-                print(f"get form serial {ch}")
-                if ch == b"A":
-                    if self.tron_client.game_is_on():
-                        self.tron_client.send_move("L")
-                elif ch == b"B":
-                    if self.tron_client.game_is_on():
-                        self.tron_client.send_move("R")
-                elif ch == b"X":
-                    while self.ser.in_waiting < 4:
-                        pass
-                    val = int(self.ser.read(4).decode('utf-8'))
-                    print(f"val = {val}")
-                    if not hasattr(self, "oldXSerVal"):
-                        self.oldXSerVal = val
-                    if val > self.oldXSerVal:
-                        if self.tron_client.game_is_on():
-                            self.tron_client.send_move("U")
-                    elif val < self.oldXSerVal:
-                        if self.tron_client.game_is_on():
-                            self.tron_client.send_move("D")
-                    self.ser.write(b'X')
+            self.handle_controller()
 
             for event in pygame.event.get():
                 mods = pygame.key.get_mods()
@@ -306,12 +488,19 @@ class Tron2D:
                 elif event.type == pygame.KEYDOWN:
                     if event.key == pygame.K_q and (mods & pygame.KMOD_CTRL):
                         return
+                    elif event.key == pygame.K_F3:
+                        self.profiler.toggle()
                     elif self.tron_client.not_connected():
                         if in_select_server:
                             if event.key == pygame.K_RETURN:
                                 l = self.get_serverlist()
-                                self.serverlist_i %= len(l)
-                                self.host = l[self.serverlist_i]
+                                if len(l) != 0:
+                                    self.serverlist_i %= len(l)
+                                    self.host = l[self.serverlist_i]
+                                    info = self.server_scanner.get_info(
+                                            self.host)
+                                    if info is not None:
+                                        self.port = info["port"]
                                 in_select_server = False
                             elif event.key == pygame.K_ESCAPE:
                                 in_select_server = False
@@ -327,6 +516,7 @@ class Tron2D:
                                 self.edit = (self.edit + 1) % 2
                             elif event.key == pygame.K_f \
                                     and (mods & pygame.KMOD_CTRL):
+                                self.server_scanner.start_scan()
                                 in_select_server = True
                             elif event.key == pygame.K_BACKSPACE:
                                 if self.edit == 0:
@@ -356,7 +546,12 @@ class Tron2D:
                     elif self.tron_client.received_go():
                         self.tron_client.ready_to_go = True
 
+            self.profiler.mark("input")
             pygame.display.flip()
+            self.profiler.mark("flip")
+            if self.first_frame:
+                self.first_frame = False
+                self.first_frame_done()
             self.clock.tick(self.fps)
 
 def main(argv):
@@ -0,0 +1,248 @@
+import argparse
+import collections
+import ctypes
+import importlib.util
+import os
+import random
+import sys
+import time
+
+# Rendering goes to an EGL pbuffer, no window or display is needed. With
+# Mesa, LIBGL_ALWAYS_SOFTWARE=1 selects the llvmpipe software rasterizer.
+os.environ.setdefault("PYOPENGL_PLATFORM", "egl")
+os.environ.setdefault("EGL_PLATFORM", "surfaceless")
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+
+from OpenGL import EGL
+from OpenGL.GL import *
+
+from tron_client import Arena
+from tron_record import read_rounds
+from tron_record import simulate
+
+STAGES = ["walls", "side views", "main view", "minimap", "overlays"]
+
+def load_tron3d():
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                        "tron-3d.py")
+    spec = importlib.util.spec_from_file_location("tron3d", path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+def create_context(width, height):
+    display = EGL.eglGetDisplay(EGL.EGL_DEFAULT_DISPLAY)
+    major, minor = EGL.EGLint(), EGL.EGLint()
+    if not EGL.eglInitialize(display, ctypes.pointer(major),
+                             ctypes.pointer(minor)):
+        raise RuntimeError("Can not initialize EGL")
+
+    attributes = [EGL.EGL_SURFACE_TYPE, EGL.EGL_PBUFFER_BIT,
+                  EGL.EGL_RED_SIZE, 8, EGL.EGL_GREEN_SIZE, 8,
+                  EGL.EGL_BLUE_SIZE, 8, EGL.EGL_DEPTH_SIZE, 24,
+                  EGL.EGL_RENDERABLE_TYPE, EGL.EGL_OPENGL_BIT, EGL.EGL_NONE]
+    config = EGL.EGLConfig()
+    num_configs = EGL.EGLint()
+    EGL.eglChooseConfig(display,
+                        (EGL.EGLint * len(attributes))(*attributes),
+                        ctypes.pointer(config), 1,
+                        ctypes.pointer(num_configs))
+    if num_configs.value == 0:
+        raise RuntimeError("No EGL config for an OpenGL pbuffer")
+
+    attributes = [EGL.EGL_WIDTH, width, EGL.EGL_HEIGHT, height, EGL.EGL_NONE]
+    surface = EGL.eglCreatePbufferSurface(
+            display, config, (EGL.EGLint * len(attributes))(*attributes))
+    EGL.eglBindAPI(EGL.EGL_OPENGL_API)
+    context = EGL.eglCreateContext(display, config, EGL.EGL_NO_CONTEXT, None)
+    if not EGL.eglMakeCurrent(display, surface, surface, context):
+        raise RuntimeError("Can not make EGL context current")
+
+def recorded_ticks(recording, round_index):
+    rnd = read_rounds(recording)[round_index]
+    ticks = [msgs for _, msgs in simulate(rnd)]
+    return rnd.width, rnd.height, rnd.names, ticks
+
+# Cycles drive through the arena and turn at random, which gives long
+# trails without any collision handling.
+def synthetic_ticks(width, height, num_players, seed):
+    rng = random.Random(seed)
+    speed = 5
+    cycles = []
+    for i in range(num_players):
+        x = rng.uniform(0.1, 0.9) * width
+        y = rng.uniform(0.1, 0.9) * height
+        dx, dy = rng.choice([(1, 0), (-1, 0), (0, 1), (0, -1)])
+        cycles.append([x, y, dx, dy, rng.randint(5, 40)])
+    msgs = [f"T {i} {x:.2f} {y:.2f} {dx} {dy}\n"
+            for i, (x, y, dx, dy, _) in enumerate(cycles)]
+    while True:
+        msg = "P 0"
+        for i, c in enumerate(cycles):
+            x, y, dx, dy, straight = c
+            if straight == 0 or not (speed <= x + dx * speed <= width - speed
+                                     and speed <= y + dy * speed
+                                     <= height - speed):
+                dx, dy = (-dy, dx) if rng.random() < 0.5 else (dy, -dx)
+                if not (0 <= x + dx * speed <= width
+                        and 0 <= y + dy * speed <= height):
+                    dx, dy = -dx, -dy
+                straight = rng.randint(5, 40)
+                msgs.append(f"T {i} {x:.2f} {y:.2f} {dx} {dy}\n")
+            x, y = x + dx * speed, y + dy * speed
+            c[:] = x, y, dx, dy, straight - 1
+            msg += f" {x:.2f} {y:.2f}"
+        yield msgs + [msg + "\n"]
+        msgs = []
+
+def feed(arena, msgs):
+    for msg in msgs:
+        line = msg.split()
+        if line[0] == "P":
+            arena.set_position(line[2:])
+        elif line[0] == "T":
+            arena.turn_player(line[1:])
+        elif line[0] == "D":
+            arena.del_player(int(line[1]))
+        elif line[0] == "E":
+            return False
+    return True
+
+def segments(arena):
+    return sum(len(p.path) - 1 for p in arena.player
+               if p is not None and p.path is not None)
+
+def make_bench_class(tron3d):
+
+    class Bench(tron3d.Tron3D):
+
+        # Every stage is bracketed by glFinish, so its time includes the
+        # rasterization it caused and not only the submission.
+
+        def init_3d(self):
+            self.init_gl()
+
+        def timed(self, stage, method, *args):
+            glFinish()
+            start = time.perf_counter()
+            method(*args)
+            glFinish()
+            self.timing[stage] += time.perf_counter() - start
+
+        def update_walls(self):
+            self.timed("walls", super().update_walls)
+
+        def render_side_camera_to_texture(self, side):
+            self.timed("side views", super().render_side_camera_to_texture,
+                       side)
+
+        def show_frame(self):
+            self.timing = collections.defaultdict(float)
+            self.timed("main view", self.show_arena_3d)
+            self.timing["main view"] -= self.timing["walls"] \
+                                        + self.timing["side views"]
+            self.timed("minimap", self.show_minimap)
+            self.timed("overlays", self.draw_score_overlay)
+            self.timed("overlays", self.draw_state_overlay)
+            return self.timing
+
+    return Bench
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q / 100 * len(values)))]
+
+def main(argv):
+    parser = argparse.ArgumentParser(
+            prog=argv[0],
+            description="Render frames of the 3D client offscreen and "
+                        "report how long each stage takes.")
+    parser.add_argument("recording", nargs="?",
+                        help="take the arena from a recording of "
+                             "new-tron-server.py --record, otherwise it "
+                             "is synthetic")
+    parser.add_argument("--round", type=int, default=0,
+                        help="round of the recording (default 0)")
+    parser.add_argument("-n", "--frames", type=int, default=300,
+                        help="frames to render (default 300)")
+    parser.add_argument("--size", default="800x600",
+                        help="window size (default 800x600)")
+    parser.add_argument("--arena", default="1000x1000",
+                        help="synthetic arena size (default 1000x1000)")
+    parser.add_argument("--players", type=int, default=4,
+                        help="synthetic players (default 4)")
+    parser.add_argument("--segments", type=int, default=500,
+                        help="synthetic trail segments per player before "
+                             "the first frame (default 500)")
+    parser.add_argument("--sideview-every", type=int, default=2,
+                        help="render each side view every n frames "
+                             "(default 2)")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args(argv[1:])
+
+    width, height = (int(x) for x in args.size.split("x"))
+    create_context(width, height)
+    print(f"{glGetString(GL_RENDERER).decode()}, "
+          f"OpenGL {glGetString(GL_VERSION).decode()}")
+
+    arena = Arena()
+    if args.recording is not None:
+        arena_width, arena_height, names, ticks = \
+                recorded_ticks(args.recording, args.round)
+        warmup = max(0, len(ticks) - args.frames)
+        ticks = iter(ticks)
+    else:
+        arena_width, arena_height = (int(x) for x in args.arena.split("x"))
+        names = [f"player{i}" for i in range(args.players)]
+        ticks = synthetic_ticks(arena_width, arena_height, args.players,
+                                args.seed)
+        warmup = None
+
+    arena.set_dim(arena_width, arena_height, len(names))
+    for i, name in enumerate(names):
+        arena.add_player(i, name)
+    arena.I_am_player = 0
+
+    # Without a recording, play until the trails have the requested length
+    running = True
+    if warmup is None:
+        while segments(arena) < args.segments * len(names):
+            feed(arena, next(ticks))
+    else:
+        for i in range(warmup):
+            running = feed(arena, next(ticks))
+
+    tron3d = load_tron3d()
+    bench = make_bench_class(tron3d)(60, width, height,
+                                     sideview_every=args.sideview_every,
+                                     adaptive=False)
+    bench.tron_client.arena = arena
+    bench.set_mode(tron3d.Tron3D.Mode.IN_3D)
+    bench.new_arena()
+    print(f"arena {arena_width}x{arena_height}, {len(names)} players, "
+          f"{segments(arena)} trail segments")
+
+    # The first frame compiles shaders and uploads the complete trails
+    bench.show_frame()
+
+    timings = []
+    start = time.perf_counter()
+    for frame in range(args.frames):
+        if running:
+            running = feed(arena, next(ticks, ["E -1\n"]))
+        timings.append(bench.show_frame())
+    elapsed = time.perf_counter() - start
+
+    print(f"{args.frames} frames, {segments(arena)} trail segments at "
+          f"the end, {args.frames / elapsed:.1f} frames/s")
+    print(f"{'stage':12s} {'mean':>8s} {'p50':>8s} {'p95':>8s} {'max':>8s}")
+    totals = [sum(t.values()) for t in timings]
+    for stage, values in [(s, [t[s] for t in timings]) for s in STAGES] \
+                         + [("total", totals)]:
+        print(f"{stage:12s} "
+              f"{sum(values) / len(values) * 1000:7.2f}ms "
+              f"{percentile(values, 50) * 1000:7.2f}ms "
+              f"{percentile(values, 95) * 1000:7.2f}ms "
+              f"{max(values) * 1000:7.2f}ms")
+
+main(sys.argv)
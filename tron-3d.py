@@ -1,16 +1,21 @@
+import time
+STARTED = time.perf_counter()
+
+import colorsys
+import ctypes
 import math
 import pygame
-import serial
-import serial.tools.list_ports
 import sys
 import getpass
+import threading
 
-from OpenGL.GL import *
-from OpenGL.GLU import *
 from enum import Enum, auto
 from pygame.locals import *
 from tron_client import ServerScanner
 from tron_client import TronClient
+from tron_profiler import FrameProfiler
+from tron_serial import open_controller
+from tron_text import TextCache
 
 C_PLAYER = [
     (111, 226, 226), # cyan (Player 1)
@@ -39,6 +44,19 @@ C_WALL = [
     rgba255(  0, 255, 128, 0.5)
 ]
 
+# Players beyond the four above get hues spaced by the golden angle, so
+# that consecutive players always look different.
+def player_color(i, alpha=1):
+    if i < len(C_PLAYER):
+        return C_PLAYER[i]
+    hue = (i - len(C_PLAYER)) * 0.618034 % 1.0
+    return colorsys.hsv_to_rgb(hue, 0.8, 1.0) + (alpha,)
+
+def wall_color(i):
+    if i < len(C_WALL):
+        return C_WALL[i]
+    return player_color(i, 0.5)
+
 C_BLACK = rgb255(0, 0, 0)
 C_ARENA = rgb255(50, 50, 50)
 C_GRID = rgb255(200, 200, 200)
@@ -46,6 +64,30 @@ C_GRID = rgb255(200, 200, 200)
 GRID_Z = 1
 CYCLE_Z = 10
 
+WALL_VERTICES = 24                      # 6 quads per segment
+WALL_STRIDE = 6 * 4                     # normal and position as float32
+WALL_CHUNK = 16                         # segments per bounding box
+WALL_HEIGHT = 90
+WALL_THICKNESS = 4
+
+MINIMAP_WIDTH, MINIMAP_HEIGHT = 200, 150
+MINIMAP_MAX_TEX_SIZE = 2048
+MINIMAP_REFRESH = 2                     # minimap pixels a cycle may move
+
+SIDEVIEW_TEX_SIZE = 512
+SIDEVIEW_MIN_SIZE = 128
+SIDEVIEW_MAX_EVERY = 8
+
+def import_gl():
+    # PyOpenGL and numpy take a good part of the startup time, and the
+    # connect screen does not need them
+    global numpy, gl, glu, compileProgram, compileShader
+    import numpy
+    import OpenGL.GL as gl
+    import OpenGL.GLU as glu
+    from OpenGL.GL.shaders import compileProgram
+    from OpenGL.GL.shaders import compileShader
+
 def set_camera(x, y, dx, dy, cam_z, look = 0):
     if look == -1:
         dx, dy = -dy, dx
@@ -56,36 +98,60 @@ def set_camera(x, y, dx, dy, cam_z, look = 0):
     target_y = y + dy * 10000
     target_z = cam_z
 
-    gluLookAt(
+    glu.gluLookAt(
             x, y, cam_z,
             target_x, target_y, target_z,
               0, 0, 1)
 
-def setup_directional_light(light_id=GL_LIGHT0,
+def setup_directional_light(light_id,
                              light_direction = (0.0, -1.0, -1.0),
                              ambient = (0.4, 0.4, 0.4, 1.0),
                              diffuse = (0.3, 0.3, 0.3, 1.0),
                              specular = (1.0, 1.0, 1.0, 1.0)):
 
-    glEnable(GL_LIGHTING)
-    glEnable(light_id)
-
-    glLightfv(light_id, GL_POSITION, light_direction)
-    glLightfv(light_id, GL_AMBIENT, ambient)
-    glLightfv(light_id, GL_DIFFUSE, diffuse)
-    glLightfv(light_id, GL_SPECULAR, specular)
-
-    glEnable(GL_COLOR_MATERIAL)
-    glColorMaterial(GL_FRONT_AND_BACK, GL_AMBIENT_AND_DIFFUSE)
-    glMaterialfv(GL_FRONT_AND_BACK, GL_SPECULAR, (1.0, 1.0, 1.0, 1.0))
-    glMaterialf(GL_FRONT_AND_BACK, GL_SHININESS, 80.0)
-
-def draw_lightwall(x0, y0, x1, y1, color, height=90, thickness=4):
+    gl.glEnable(gl.GL_LIGHTING)
+    gl.glEnable(light_id)
+
+    gl.glLightfv(light_id, gl.GL_POSITION, light_direction)
+    gl.glLightfv(light_id, gl.GL_AMBIENT, ambient)
+    gl.glLightfv(light_id, gl.GL_DIFFUSE, diffuse)
+    gl.glLightfv(light_id, gl.GL_SPECULAR, specular)
+
+    gl.glEnable(gl.GL_COLOR_MATERIAL)
+    gl.glColorMaterial(gl.GL_FRONT_AND_BACK, gl.GL_AMBIENT_AND_DIFFUSE)
+    gl.glMaterialfv(gl.GL_FRONT_AND_BACK, gl.GL_SPECULAR, (1.0, 1.0, 1.0, 1.0))
+    gl.glMaterialf(gl.GL_FRONT_AND_BACK, gl.GL_SHININESS, 80.0)
+
+def view_frustum():
+    # Clip planes (a, b, c, d) of the current projection and modelview
+    # matrix; a point is inside if a*x + b*y + c*z + d >= 0 for all of them.
+    modelview = numpy.array(
+            gl.glGetFloatv(gl.GL_MODELVIEW_MATRIX)).reshape(4, 4)
+    projection = numpy.array(
+            gl.glGetFloatv(gl.GL_PROJECTION_MATRIX)).reshape(4, 4)
+    m = projection.T @ modelview.T
+    return numpy.array([m[3] + m[0], m[3] - m[0],
+                        m[3] + m[1], m[3] - m[1],
+                        m[3] + m[2], m[3] - m[2]])
+
+def boxes_visible(frustum, boxes):
+    # boxes is an array of rows (x0, y0, z0, x1, y1, z1). A box is culled if
+    # its corner farthest along the normal of some plane is outside.
+    a, b, c, d = frustum.T
+    lo, hi = boxes[:, None, 0:3], boxes[:, None, 3:6]
+    x = numpy.where(a >= 0, hi[..., 0], lo[..., 0])
+    y = numpy.where(b >= 0, hi[..., 1], lo[..., 1])
+    z = numpy.where(c >= 0, hi[..., 2], lo[..., 2])
+    return ((a * x + b * y + c * z + d) >= 0).all(axis=1)
+
+def lightwall_vertices(x0, y0, x1, y1, height=WALL_HEIGHT,
+                       thickness=WALL_THICKNESS):
+    # Six quads (24 vertices) with normal and position per vertex
     dx = x1 - x0
     dy = y1 - y0
     length = math.sqrt(dx * dx + dy * dy)
     if length == 0:
-        return
+        return [(0.0,) * 6] * WALL_VERTICES
 
     dx /= length
     dy /= length
@@ -96,65 +162,320 @@ def draw_lightwall(x0, y0, x1, y1, color, height=90, thickness=4):
     z0 = GRID_Z + 10 
     z1 = z0 + height
 
-    glColor4f(*color)
-
-    glBegin(GL_QUADS)
-
-    # Right side when viewed from the front
-    glNormal3f(dx, dy, 0.0)
-    glVertex3f(x0 + nx, y0 + ny, z0)
-    glVertex3f(x1 + nx, y1 + ny, z0)
-    glVertex3f(x1 + nx, y1 + ny, z1)
-    glVertex3f(x0 + nx, y0 + ny, z1)
-
-    # Left side when viewed from the front
-    glNormal3f(-dx, -dy, 0.0)
-    glVertex3f(x1 - nx, y1 - ny, z0)
-    glVertex3f(x0 - nx, y0 - ny, z0)
-    glVertex3f(x0 - nx, y0 - ny, z1)
-    glVertex3f(x1 - nx, y1 - ny, z1)
-
-    # Back when viewed from the back
-    glNormal3f(-dy, dx, 0.0)
-    glVertex3f(x0 - nx, y0 - ny, z1)
-    glVertex3f(x0 + nx, y0 + ny, z1)
-    glVertex3f(x0 + nx, y0 + ny, z0)
-    glVertex3f(x0 - nx, y0 - ny, z0)
-
-    # Front side when viewed from the front
-    glNormal3f(dy, -dx, 0.0)
-    glVertex3f(x1 + nx, y1 + ny, z1)
-    glVertex3f(x1 - nx, y1 - ny, z1)
-    glVertex3f(x1 - nx, y1 - ny, z0)
-    glVertex3f(x1 + nx, y1 + ny, z0)
+    return [
+        # Right side when viewed from the front
+        (dx, dy, 0.0, x0 + nx, y0 + ny, z0),
+        (dx, dy, 0.0, x1 + nx, y1 + ny, z0),
+        (dx, dy, 0.0, x1 + nx, y1 + ny, z1),
+        (dx, dy, 0.0, x0 + nx, y0 + ny, z1),
+
+        # Left side when viewed from the front
+        (-dx, -dy, 0.0, x1 - nx, y1 - ny, z0),
+        (-dx, -dy, 0.0, x0 - nx, y0 - ny, z0),
+        (-dx, -dy, 0.0, x0 - nx, y0 - ny, z1),
+        (-dx, -dy, 0.0, x1 - nx, y1 - ny, z1),
+
+        # Back when viewed from the back
+        (-dy, dx, 0.0, x0 - nx, y0 - ny, z1),
+        (-dy, dx, 0.0, x0 + nx, y0 + ny, z1),
+        (-dy, dx, 0.0, x0 + nx, y0 + ny, z0),
+        (-dy, dx, 0.0, x0 - nx, y0 - ny, z0),
+
+        # Front side when viewed from the front
+        (dy, -dx, 0.0, x1 + nx, y1 + ny, z1),
+        (dy, -dx, 0.0, x1 - nx, y1 - ny, z1),
+        (dy, -dx, 0.0, x1 - nx, y1 - ny, z0),
+        (dy, -dx, 0.0, x1 + nx, y1 + ny, z0),
+
+        # Top
+        (0.0, 0.0, 1.0, x0 - nx, y0 - ny, z1),
+        (0.0, 0.0, 1.0, x0 + nx, y0 + ny, z1),
+        (0.0, 0.0, 1.0, x1 + nx, y1 + ny, z1),
+        (0.0, 0.0, 1.0, x1 - nx, y1 - ny, z1),
+
+        # Bottom
+        (0.0, 0.0, -1.0, x1 - nx, y1 - ny, z0),
+        (0.0, 0.0, -1.0, x1 + nx, y1 + ny, z0),
+        (0.0, 0.0, -1.0, x0 + nx, y0 + ny, z0),
+        (0.0, 0.0, -1.0, x0 - nx, y0 - ny, z0),
+    ]
+
+class WallBuffer:
+
+    # Lightwall geometry of one player in a vertex buffer object. Finished
+    # segments are uploaded once, afterwards only the segment the cycle is
+    # extending gets rewritten. For culling, every WALL_CHUNK consecutive
+    # segments share a bounding box and only chunks in the view frustum
+    # are drawn. The path itself is kept in a second buffer as a line
+    # strip for the minimap. When the end of a bounded trail moves, the
+    # segments that are gone are shifted out and everything is uploaded.
+
+    def __init__(self):
+        self.vbo = gl.glGenBuffers(1)
+        self.line_vbo = gl.glGenBuffers(1)
+        self.data = None
+        self.points = None
+        self.bounds = None
+        self.capacity = 0               # segments
+        self.player = None
+        self.done = 0                   # finished segments in buffer
+        self.count = 0                  # segments in buffer
+        self.tail = 0                   # Player.tail of the buffer
+        self.front = None               # first point of the path
+
+    def reserve(self, n):
+        if n <= self.capacity:
+            return False
+        capacity = max(64, 2 * self.capacity, n)
+        data = numpy.zeros((capacity * WALL_VERTICES, 6), dtype=numpy.float32)
+        points = numpy.zeros((capacity + 1, 2), dtype=numpy.float32)
+        bounds = numpy.zeros((capacity // WALL_CHUNK + 1, 6))
+        if self.data is not None:
+            data[:len(self.data)] = self.data
+            points[:len(self.points)] = self.points
+            bounds[:len(self.bounds)] = self.bounds
+        self.data = data
+        self.points = points
+        self.bounds = bounds
+        self.capacity = capacity
+
+        gl.glBindBuffer(gl.GL_ARRAY_BUFFER, self.vbo)
+        gl.glBufferData(gl.GL_ARRAY_BUFFER, data.nbytes, None,
+                        gl.GL_DYNAMIC_DRAW)
+        gl.glBindBuffer(gl.GL_ARRAY_BUFFER, self.line_vbo)
+        gl.glBufferData(gl.GL_ARRAY_BUFFER, points.nbytes, None,
+                        gl.GL_DYNAMIC_DRAW)
+        gl.glBindBuffer(gl.GL_ARRAY_BUFFER, 0)
+        return True
+
+    def update(self, p):
+        if p is not self.player:
+            self.player = p
+            self.done = 0
+            self.count = 0
+            self.tail = 0
+            self.front = None
+        if p is None or p.path is None:
+            return
 
-    # Top
-    glNormal3f(0.0, 0.0, 1.0)
-    glVertex3f(x0 - nx, y0 - ny, z1)
-    glVertex3f(x0 + nx, y0 + ny, z1)
-    glVertex3f(x1 + nx, y1 + ny, z1)
-    glVertex3f(x1 - nx, y1 - ny, z1)
+        path = p.path
+        n = len(path) - 1
+        first = 0 if self.reserve(n) else self.done
+        if p.tail != self.tail or path[0] != self.front:
+            k = min(p.tail - self.tail, self.count)
+            if k > 0:
+                self.data[:-k * WALL_VERTICES] = self.data[k * WALL_VERTICES:]
+            self.done = max(0, self.done - k)
+            self.data[:WALL_VERTICES] = lightwall_vertices(*path[0], *path[1])
+            self.tail, self.front = p.tail, path[0]
+            first = 0
+        for i in range(self.done, n):
+            self.data[i * WALL_VERTICES:(i + 1) * WALL_VERTICES] = \
+                    lightwall_vertices(*path[i], *path[i + 1])
+        self.points[first:n + 1] = path[first:n + 1]
+        self.update_bounds(path, first, n)
+        self.done = n - 1
+        self.count = n
+
+        upload = self.data[first * WALL_VERTICES:n * WALL_VERTICES]
+        gl.glBindBuffer(gl.GL_ARRAY_BUFFER, self.vbo)
+        gl.glBufferSubData(gl.GL_ARRAY_BUFFER,
+                           first * WALL_VERTICES * WALL_STRIDE,
+                           upload.nbytes, upload)
+        upload = self.points[first:n + 1]
+        gl.glBindBuffer(gl.GL_ARRAY_BUFFER, self.line_vbo)
+        gl.glBufferSubData(gl.GL_ARRAY_BUFFER, first * 8, upload.nbytes,
+                           upload)
+        gl.glBindBuffer(gl.GL_ARRAY_BUFFER, 0)
+
+    def update_bounds(self, path, first, n):
+        r = WALL_THICKNESS / 2
+        z0 = GRID_Z + 10
+        for k in range(first // WALL_CHUNK, (n - 1) // WALL_CHUNK + 1):
+            points = path[k * WALL_CHUNK:min(n, (k + 1) * WALL_CHUNK) + 1]
+            xs = [x for x, _ in points]
+            ys = [y for _, y in points]
+            self.bounds[k] = (min(xs) - r, min(ys) - r, z0,
+                              max(xs) + r, max(ys) + r, z0 + WALL_HEIGHT)
+
+    def visible_ranges(self, frustum):
+        # Runs of visible chunks as (first segment, number of segments)
+        chunks = (self.count - 1) // WALL_CHUNK + 1
+        visible = boxes_visible(frustum, self.bounds[:chunks])
+        ranges = []
+        k = 0
+        while k < chunks:
+            if not visible[k]:
+                k += 1
+                continue
+            first = k
+            while k < chunks and visible[k]:
+                k += 1
+            ranges.append((first * WALL_CHUNK,
+                           min(self.count, k * WALL_CHUNK)
+                           - first * WALL_CHUNK))
+        return ranges
+
+    def draw(self, color, frustum = None):
+        if self.count == 0:
+            return
+        if frustum is None:
+            ranges = [(0, self.count)]
+        else:
+            ranges = self.visible_ranges(frustum)
+            if len(ranges) == 0:
+                return
+
+        gl.glColor4f(*color)
+        gl.glBindBuffer(gl.GL_ARRAY_BUFFER, self.vbo)
+        gl.glEnableClientState(gl.GL_NORMAL_ARRAY)
+        gl.glEnableClientState(gl.GL_VERTEX_ARRAY)
+        gl.glNormalPointer(gl.GL_FLOAT, WALL_STRIDE, ctypes.c_void_p(0))
+        gl.glVertexPointer(3, gl.GL_FLOAT, WALL_STRIDE, ctypes.c_void_p(12))
+        for first, count in ranges:
+            gl.glDrawArrays(gl.GL_QUADS, first * WALL_VERTICES,
+                            count * WALL_VERTICES)
+        gl.glDisableClientState(gl.GL_VERTEX_ARRAY)
+        gl.glDisableClientState(gl.GL_NORMAL_ARRAY)
+        gl.glBindBuffer(gl.GL_ARRAY_BUFFER, 0)
+
+    def draw_path(self, color):
+        if self.count == 0:
+            return
 
-    # Bottom
-    glNormal3f(0.0, 0.0, -1.0)
-    glVertex3f(x1 - nx, y1 - ny, z0)
-    glVertex3f(x1 + nx, y1 + ny, z0)
-    glVertex3f(x0 + nx, y0 + ny, z0)
-    glVertex3f(x0 - nx, y0 - ny, z0)
+        gl.glColor4f(*color)
+        gl.glBindBuffer(gl.GL_ARRAY_BUFFER, self.line_vbo)
+        gl.glEnableClientState(gl.GL_VERTEX_ARRAY)
+        gl.glVertexPointer(2, gl.GL_FLOAT, 0, ctypes.c_void_p(0))
+        gl.glDrawArrays(gl.GL_LINE_STRIP, 0, self.count + 1)
+        gl.glDisableClientState(gl.GL_VERTEX_ARRAY)
+        gl.glBindBuffer(gl.GL_ARRAY_BUFFER, 0)
 
-    glEnd()
+    def delete(self):
+        gl.glDeleteBuffers(2, [self.vbo, self.line_vbo])
 
-def draw_lightcycle(x, y, dx, dy, color):
-    glPushMatrix()
+class MinimapTexture:
+
+    # All trails of the arena rendered top down into a texture, about one
+    # texel per minimap pixel. The texture is only redrawn after a cycle
+    # moved MINIMAP_REFRESH pixels, in between the minimap is a single
+    # textured quad.
+
+    def __init__(self, width, height, scale):
+        self.width, self.height = width, height
+        self.scale = min(scale, MINIMAP_MAX_TEX_SIZE / max(width, height))
+        self.tex_width = max(1, math.ceil(width * self.scale))
+        self.tex_height = max(1, math.ceil(height * self.scale))
+        self.heads = None
+
+        self.tex = gl.glGenTextures(1)
+        gl.glBindTexture(gl.GL_TEXTURE_2D, self.tex)
+        gl.glTexImage2D(gl.GL_TEXTURE_2D, 0, gl.GL_RGBA,
+                        self.tex_width, self.tex_height, 0,
+                        gl.GL_RGBA, gl.GL_UNSIGNED_BYTE, None)
+        gl.glTexParameteri(gl.GL_TEXTURE_2D, gl.GL_TEXTURE_MIN_FILTER,
+                           gl.GL_NEAREST)
+        gl.glTexParameteri(gl.GL_TEXTURE_2D, gl.GL_TEXTURE_MAG_FILTER,
+                           gl.GL_NEAREST)
+        gl.glTexParameteri(gl.GL_TEXTURE_2D, gl.GL_TEXTURE_WRAP_S,
+                           gl.GL_CLAMP_TO_EDGE)
+        gl.glTexParameteri(gl.GL_TEXTURE_2D, gl.GL_TEXTURE_WRAP_T,
+                           gl.GL_CLAMP_TO_EDGE)
+        gl.glBindTexture(gl.GL_TEXTURE_2D, 0)
+
+        self.fbo = gl.glGenFramebuffers(1)
+        gl.glBindFramebuffer(gl.GL_FRAMEBUFFER, self.fbo)
+        gl.glFramebufferTexture2D(gl.GL_FRAMEBUFFER, gl.GL_COLOR_ATTACHMENT0,
+                                  gl.GL_TEXTURE_2D, self.tex, 0)
+        gl.glBindFramebuffer(gl.GL_FRAMEBUFFER, 0)
+
+    def needs_refresh(self, players):
+        heads = [None if p is None else (p.path, p.x, p.y) for p in players]
+        if self.heads is None or len(heads) != len(self.heads):
+            return True
+        limit = MINIMAP_REFRESH / self.scale
+        for old, new in zip(self.heads, heads):
+            if old is None or new is None:
+                if old is not new:
+                    return True
+            elif old[0] is not new[0] or abs(new[1] - old[1]) > limit \
+                    or abs(new[2] - old[2]) > limit:
+                return True
+        return False
+
+    def refresh(self, players, walls):
+        self.heads = [None if p is None else (p.path, p.x, p.y)
+                      for p in players]
+
+        gl.glBindFramebuffer(gl.GL_FRAMEBUFFER, self.fbo)
+        gl.glViewport(0, 0, self.tex_width, self.tex_height)
+        gl.glClearColor(0, 0, 0, 0)
+        gl.glClear(gl.GL_COLOR_BUFFER_BIT)
+        gl.glClearColor(*C_BLACK, 1.0)
+
+        # World coordinates map to texel centers, so lines on the grid of
+        # the arena fill exactly one texel
+        x0, y0, x1, y1 = self.rect()
+        gl.glMatrixMode(gl.GL_PROJECTION)
+        gl.glLoadIdentity()
+        glu.gluOrtho2D(x0, x1, y0, y1)
+        gl.glMatrixMode(gl.GL_MODELVIEW)
+        gl.glLoadIdentity()
+
+        # Keep the colors as they are, blending happens when drawn
+        gl.glDisable(gl.GL_LIGHTING)
+        gl.glDisable(gl.GL_DEPTH_TEST)
+        gl.glDisable(gl.GL_BLEND)
+        for pi, p in enumerate(players):
+            if p is not None and p.path is not None:
+                walls[pi].draw_path(player_color(pi))
+        gl.glEnable(gl.GL_BLEND)
+        gl.glEnable(gl.GL_DEPTH_TEST)
+        gl.glEnable(gl.GL_LIGHTING)
+
+        gl.glBindFramebuffer(gl.GL_FRAMEBUFFER, 0)
+
+    def rect(self):
+        return (-0.5 / self.scale, -0.5 / self.scale,
+                (self.tex_width - 0.5) / self.scale,
+                (self.tex_height - 0.5) / self.scale)
+
+    def draw(self):
+        x0, y0, x1, y1 = self.rect()
+
+        gl.glEnable(gl.GL_TEXTURE_2D)
+        gl.glBindTexture(gl.GL_TEXTURE_2D, self.tex)
+        gl.glColor4f(1, 1, 1, 1)
+        gl.glBegin(gl.GL_QUADS)
+        gl.glTexCoord2f(0, 0); gl.glVertex2f(x0, y0)
+        gl.glTexCoord2f(1, 0); gl.glVertex2f(x1, y0)
+        gl.glTexCoord2f(1, 1); gl.glVertex2f(x1, y1)
+        gl.glTexCoord2f(0, 1); gl.glVertex2f(x0, y1)
+        gl.glEnd()
+        gl.glBindTexture(gl.GL_TEXTURE_2D, 0)
+        gl.glDisable(gl.GL_TEXTURE_2D)
+
+    def delete(self):
+        gl.glDeleteFramebuffers(1, [self.fbo])
+        gl.glDeleteTextures(1, [self.tex])
+
+CYCLE_WIDTH  = 20
+CYCLE_LENGTH = 40
+CYCLE_HEIGHT = 20
+
+def lightcycle_visible(frustum, x, y):
+    r = CYCLE_LENGTH / 2
+    box = numpy.array([[x - r, y - r, CYCLE_Z,
+                        x + r, y + r, CYCLE_Z + CYCLE_HEIGHT]])
+    return boxes_visible(frustum, box)[0]
 
-    CYCLE_WIDTH  = 20
-    CYCLE_LENGTH = 40
-    CYCLE_HEIGHT = 20
+def draw_lightcycle(x, y, dx, dy, color):
+    gl.glPushMatrix()
 
     # Position and orientation
-    glTranslatef(x, y, CYCLE_Z)
+    gl.glTranslatef(x, y, CYCLE_Z)
     angle = math.degrees(math.atan2(-dx, dy))
-    glRotatef(angle, 0, 0, 1)
+    gl.glRotatef(angle, 0, 0, 1)
 
     w0 = CYCLE_WIDTH / 2
     w1 = w0 / 2
@@ -162,100 +483,174 @@ def draw_lightcycle(x, y, dx, dy, color):
     h0 = CYCLE_HEIGHT
     h1 = h0 / 3
 
-    glBegin(GL_QUADS)
-    glColor4f(*color)
+    gl.glBegin(gl.GL_QUADS)
+    gl.glColor4f(*color)
 
     # Bottom
-    glNormal3f(0.0, 0.0, 1.0)
-    glVertex3f(-w1,  l, 0)
-    glVertex3f( w1,  l, 0)
-    glVertex3f( w0, -l, 0)
-    glVertex3f(-w0, -l, 0)
+    gl.glNormal3f(0.0, 0.0, 1.0)
+    gl.glVertex3f(-w1,  l, 0)
+    gl.glVertex3f( w1,  l, 0)
+    gl.glVertex3f( w0, -l, 0)
+    gl.glVertex3f(-w0, -l, 0)
 
     # Top
-    glNormal3f(-0.0, 0.316, 0.949)  # ≈ 18.43° Neigung nach vorne
-    glVertex3f(-w0, -l, h0)
-    glVertex3f( w0, -l, h0)
-    glVertex3f( w1,  l, h1)
-    glVertex3f(-w1,  l, h1)
+    gl.glNormal3f(-0.0, 0.316, 0.949)  # ≈ 18.43° Neigung nach vorne
+    gl.glVertex3f(-w0, -l, h0)
+    gl.glVertex3f( w0, -l, h0)
+    gl.glVertex3f( w1,  l, h1)
+    gl.glVertex3f(-w1,  l, h1)
 
     # Left
-    glNormal3f(0.992, -0.124, 0.0)  # leicht nach innen geneigt
-    glVertex3f(-w0, -l, h0)
-    glVertex3f(-w1,  l, h1)
-    glVertex3f(-w1,  l, 0)
-    glVertex3f(-w0, -l, 0)
+    gl.glNormal3f(0.992, -0.124, 0.0)  # leicht nach innen geneigt
+    gl.glVertex3f(-w0, -l, h0)
+    gl.glVertex3f(-w1,  l, h1)
+    gl.glVertex3f(-w1,  l, 0)
+    gl.glVertex3f(-w0, -l, 0)
 
     # Right
-    glNormal3f(0.992, 0.124, 0.0)  # leicht nach innen geneigt
-    glVertex3f( w0, -l, 0)
-    glVertex3f( w1,  l, 0)
-    glVertex3f( w1,  l, h1)
-    glVertex3f( w0, -l, h0)
+    gl.glNormal3f(0.992, 0.124, 0.0)  # leicht nach innen geneigt
+    gl.glVertex3f( w0, -l, 0)
+    gl.glVertex3f( w1,  l, 0)
+    gl.glVertex3f( w1,  l, h1)
+    gl.glVertex3f( w0, -l, h0)
 
     # Back
-    glNormal3f(0.0, -1.0, 0.0)
-    glVertex3f(-w0, -l, 0)
-    glVertex3f( w0, -l, 0)
-    glVertex3f( w0, -l, h0)
-    glVertex3f(-w0, -l, h0)
+    gl.glNormal3f(0.0, -1.0, 0.0)
+    gl.glVertex3f(-w0, -l, 0)
+    gl.glVertex3f( w0, -l, 0)
+    gl.glVertex3f( w0, -l, h0)
+    gl.glVertex3f(-w0, -l, h0)
 
     # Front
-    glNormal3f(0.0, -1.0, 0.0)  # bleibt gleich wegen senkrechter Fläche
-    glVertex3f(-w1, l, h1)
-    glVertex3f( w1, l, h1)
-    glVertex3f( w1, l, 0)
-    glVertex3f(-w1, l, 0)
-
-    glEnd()
-    glPopMatrix()
-
-def _build_grid(width, height):
-    glEnable(GL_POLYGON_OFFSET_FILL)
-    glPolygonOffset(1.0, 1.0)
-
-    tile_size = 50
-
-    glColor3f(*C_ARENA)
-    glNormal3f(0.0, 0.0, 1.0)
-    for x in range(0, width, tile_size):
-        for y in range(0, height, tile_size):
-            glBegin(GL_QUADS)
-            glVertex3f(x, y, 0)
-            glVertex3f(x + tile_size, y, 0)
-            glVertex3f(x + tile_size, y + tile_size, 0)
-            glVertex3f(x, y + tile_size, 0)
-            glEnd()
-
-    glDisable(GL_LIGHTING)
-    glColor3f(*C_GRID)
-    glLineWidth(2.5)
-
-    glBegin(GL_LINES)
-    for x in range(0, width + 1, tile_size):
-        glVertex3f(x, 0, GRID_Z)
-        glVertex3f(x, height, GRID_Z)
-
-    for y in range(0, height + 1, tile_size):
-        glVertex3f(0, y, GRID_Z)
-        glVertex3f(width, y, GRID_Z)
-    glEnd()
-
-    glEnable(GL_LIGHTING)  # !!! Re-enable lighting after drawing lines
-
-def open_serial():
-    ser_dev = next(
-        (p.device for p in serial.tools.list_ports.comports()
-            if p.device.startswith("/dev/cu.usbserial")),
-        None
-    )
-    try:
-        ser = serial.Serial(ser_dev, 9600, timeout=0)
-        ser.write(b'X')
-        return ser
-    except:
-        print(f"can not open serial device {ser_dev}")
-    return None
+    gl.glNormal3f(0.0, -1.0, 0.0)  # bleibt gleich wegen senkrechter Fläche
+    gl.glVertex3f(-w1, l, h1)
+    gl.glVertex3f( w1, l, h1)
+    gl.glVertex3f( w1, l, 0)
+    gl.glVertex3f(-w1, l, 0)
+
+    gl.glEnd()
+    gl.glPopMatrix()
+
+# The arena floor is a single quad. Its grid lines are computed per
+# fragment with a constant width in pixels, so the cost does not depend
+# on the arena size. Lighting of the floor is the fixed function lighting
+# of the four directional lights, evaluated once per vertex.
+
+GRID_TILE_SIZE = 50
+GRID_LINE_WIDTH = 2.5
+GRID_MARGIN = 4
+
+FLOOR_VERTEX_SHADER = """
+#version 120
+
+varying vec2 pos;
+varying vec4 floor_color;
+
+void main()
+{
+    vec3 n = normalize(gl_NormalMatrix * gl_Normal);
+    vec4 color = gl_Color * gl_LightModel.ambient;
+    for (int i = 0; i < 4; ++i) {
+        vec3 l = normalize(gl_LightSource[i].position.xyz);
+        vec3 h = normalize(gl_LightSource[i].halfVector.xyz);
+        color += gl_Color * gl_LightSource[i].ambient
+               + gl_Color * gl_LightSource[i].diffuse * max(dot(n, l), 0.0);
+        if (dot(n, l) > 0.0) {
+            color += gl_FrontMaterial.specular * gl_LightSource[i].specular
+                   * pow(max(dot(n, h), 0.0), gl_FrontMaterial.shininess);
+        }
+    }
+    floor_color = vec4(color.rgb, gl_Color.a);
+    pos = gl_Vertex.xy;
+    gl_Position = ftransform();
+}
+"""
+
+FLOOR_FRAGMENT_SHADER = """
+#version 120
+
+uniform vec2 size;
+uniform float tile_size;
+uniform float line_width;
+uniform vec3 grid_color;
+
+varying vec2 pos;
+varying vec4 floor_color;
+
+void main()
+{
+    vec2 fw = max(fwidth(pos), vec2(1e-6));
+    vec2 d = abs(fract(pos / tile_size + 0.5) - 0.5) * tile_size;
+    vec2 pixels = d / fw;
+    float line = 1.0 - clamp(min(pixels.x, pixels.y) - line_width / 2.0
+                             + 0.5, 0.0, 1.0);
+
+    // Towards the horizon tiles shrink to a few pixels, there the lines
+    // fade into their average coverage instead of flickering.
+    vec2 coverage = min(line_width * fw / tile_size, vec2(1.0));
+    float fade = clamp(4.0 * max(fw.x, fw.y) / tile_size - 0.5, 0.0, 1.0);
+    line = mix(line, max(coverage.x, coverage.y), fade);
+
+    // The quad has a small margin for the outer half of the border lines
+    bool outside = any(lessThan(pos, vec2(0.0)))
+                || any(greaterThan(pos, size));
+    if (outside && line == 0.0) {
+        discard;
+    }
+    vec4 color = outside ? vec4(grid_color, 0.0) : floor_color;
+    gl_FragColor = mix(color, vec4(grid_color, 1.0), line);
+}
+"""
+
+def build_floor_program():
+    program = compileProgram(
+            compileShader(FLOOR_VERTEX_SHADER, gl.GL_VERTEX_SHADER),
+            compileShader(FLOOR_FRAGMENT_SHADER, gl.GL_FRAGMENT_SHADER))
+    gl.glUseProgram(program)
+    gl.glUniform1f(gl.glGetUniformLocation(program, "tile_size"),
+                   GRID_TILE_SIZE)
+    gl.glUniform1f(gl.glGetUniformLocation(program, "line_width"),
+                   GRID_LINE_WIDTH)
+    gl.glUniform3f(gl.glGetUniformLocation(program, "grid_color"), *C_GRID)
+    gl.glUseProgram(0)
+    return program
+
+def draw_floor(program, width, height):
+    m = GRID_MARGIN
+    gl.glUseProgram(program)
+    gl.glUniform2f(gl.glGetUniformLocation(program, "size"), width, height)
+    gl.glColor3f(*C_ARENA)
+    gl.glNormal3f(0.0, 0.0, 1.0)
+    gl.glBegin(gl.GL_QUADS)
+    gl.glVertex3f(-m, -m, 0)
+    gl.glVertex3f(width + m, -m, 0)
+    gl.glVertex3f(width + m, height + m, 0)
+    gl.glVertex3f(-m, height + m, 0)
+    gl.glEnd()
+    gl.glUseProgram(0)
+
+class TextTextureCache(TextCache):
+
+    # Keeps rendered HUD strings resident as textures: (tex_id, w, h)
+
+    def __init__(self, max_entries=64):
+        super().__init__(max_entries)
+
+    def create(self, font, text, color):
+        surface = font.render(text, True, color)
+        text_data = pygame.image.tostring(surface, "RGBA", True)
+        tw, th = surface.get_width(), surface.get_height()
+
+        tex_id = gl.glGenTextures(1)
+        gl.glBindTexture(gl.GL_TEXTURE_2D, tex_id)
+        gl.glTexImage2D(gl.GL_TEXTURE_2D, 0, gl.GL_RGBA, tw, th, 0, gl.GL_RGBA,
+                        gl.GL_UNSIGNED_BYTE, text_data)
+        gl.glTexParameteri(gl.GL_TEXTURE_2D, gl.GL_TEXTURE_MIN_FILTER,
+                           gl.GL_LINEAR)
+        return (tex_id, tw, th)
+
+    def release(self, text_texture):
+        gl.glDeleteTextures([text_texture[0]])
 
 class Tron3D:
 
@@ -263,48 +658,101 @@ class Tron3D:
         IN_2D = auto()
         IN_3D = auto()
 
-    def __init__(self, fps, width, height):
+    def __init__(self, fps, width, height, sideview_every = 2,
+                 adaptive = True):
+        self.init_started = time.perf_counter()
         self.fps = fps
         self.width, self.height = width, height
 
+        # Each side view is re-rendered every sideview_every frames, the
+        # two sides staggered. With adaptive set, resolution and then
+        # refresh rate of the side views are lowered while frames take
+        # longer than 1 / fps and raised again when there is headroom.
+        self.sideview_every_min = sideview_every
+        self.sideview_every = sideview_every
+        self.sideview_size = SIDEVIEW_TEX_SIZE
+        self.adaptive = adaptive
+        self.frame_count = 0
+        self.frame_time = 0
+        self.frames_since_adapt = 0
+
         self.name = getpass.getuser()
         self.host = "localhost"
         self.port = 65432
         self.edit = 0
         self.server_scanner = ServerScanner()
-        self.server_scanner.start_scan()
         self.serverlist_i = 0
         self.serverlist_i0 = 0
 
         self.winner = None
+        self.controller = None
 
         self.tron_client = TronClient(self)
 
         pygame.init()
         pygame.display.set_caption("TRON: Lightcycle 3D")
 
-        fonts = pygame.font.get_fonts()
-        for name in sorted(fonts):
-            print(name)
-        
-        mono_fonts = ["andalemono", "consolas", "couriernew", "monospace"]
-        normal_fonts = ["helvetica", "timesnewroman", "monospace"]
-
-        self.title_font = pygame.font.SysFont(normal_fonts, 48)
-        self.score_font = pygame.font.SysFont(mono_fonts, 20)
-        self.state_font = pygame.font.SysFont(mono_fonts, 24, italic=True)
-        self.winner_font = pygame.font.SysFont(normal_fonts, 60)
-        self.input_font = pygame.font.SysFont(mono_fonts, 32)
-        self.hint_font = pygame.font.SysFont(mono_fonts, 18)
-        self.list_font = pygame.font.SysFont(mono_fonts, 18)
+        self.set_fonts(self.load_fonts(system_fonts=False))
+        self.system_fonts = None        # set by a background thread
+        self.text_cache = TextCache()
+        self.text_textures = TextTextureCache()
+        self.profiler = FrameProfiler()
 
         self.mode = None
         self.look = 0
         self.clock = pygame.time.Clock()
+        self.first_frame = True
+        self.init_done = time.perf_counter()
 
     def __del__(self):
         pygame.quit()
 
+    def load_fonts(self, system_fonts = True):
+        # The first call of pygame.font.SysFont scans all installed fonts,
+        # which can take seconds. The built-in font is used until a
+        # background thread has loaded the system fonts.
+        def font(names, size, italic = False):
+            if system_fonts:
+                return pygame.font.SysFont(names, size, italic=italic)
+            f = pygame.font.Font(None, size)
+            f.set_italic(italic)
+            return f
+
+        mono_fonts = ["andalemono", "consolas", "couriernew", "monospace"]
+        normal_fonts = ["helvetica", "timesnewroman", "monospace"]
+
+        return {
+            "title_font": font(normal_fonts, 48),
+            "score_font": font(mono_fonts, 20),
+            "state_font": font(mono_fonts, 24, italic=True),
+            "winner_font": font(normal_fonts, 60),
+            "input_font": font(mono_fonts, 32),
+            "hint_font": font(mono_fonts, 18),
+            "list_font": font(mono_fonts, 18),
+        }
+
+    def set_fonts(self, fonts):
+        for name, font in fonts.items():
+            setattr(self, name, font)
+
+    def load_system_fonts(self):
+        start = time.perf_counter()
+        self.system_fonts = self.load_fonts()
+        print(f"System fonts loaded in "
+              f"{(time.perf_counter() - start) * 1000:.0f}ms")
+
+    def first_frame_done(self):
+        now = time.perf_counter()
+        print(f"Startup: imports {(self.init_started - STARTED) * 1000:.0f}ms"
+              f", init {(self.init_done - self.init_started) * 1000:.0f}ms"
+              f", first frame {(now - self.init_done) * 1000:.0f}ms"
+              f", total {(now - STARTED) * 1000:.0f}ms")
+
+        # Deferred until the connect screen is shown. OpenGL is imported
+        # when the first 3D frame is drawn and the controller is opened
+        # with ^P.
+        threading.Thread(target=self.load_system_fonts, daemon=True).start()
+
     def set_mode(self, mode):
         if self.mode == mode:
             return
@@ -322,70 +770,76 @@ class Tron3D:
         assert arena is not None
 
         pygame.display.set_mode((self.width, self.height), DOUBLEBUF | OPENGL)
-        glEnable(GL_DEPTH_TEST)
-        glEnable(GL_CULL_FACE)
-        glCullFace(GL_BACK)
-        glEnable(GL_BLEND)
-        glBlendFunc(GL_SRC_ALPHA, GL_ONE_MINUS_SRC_ALPHA)
-        glEnable(GL_LINE_SMOOTH)
-        glHint(GL_LINE_SMOOTH_HINT, GL_NICEST)
-
-        glClearColor(*C_BLACK, 1.0)
+        self.init_gl()
+
+    def init_gl(self):
+        import_gl()
+        # Textures and buffers of a previous GL context are gone
+        self.text_textures.clear(release=False)
+        self.walls = []
+        self.minimap = None
+        gl.glEnable(gl.GL_DEPTH_TEST)
+        gl.glEnable(gl.GL_CULL_FACE)
+        gl.glCullFace(gl.GL_BACK)
+        gl.glEnable(gl.GL_BLEND)
+        gl.glBlendFunc(gl.GL_SRC_ALPHA, gl.GL_ONE_MINUS_SRC_ALPHA)
+        gl.glEnable(gl.GL_LINE_SMOOTH)
+        gl.glHint(gl.GL_LINE_SMOOTH_HINT, gl.GL_NICEST)
+
+        gl.glClearColor(*C_BLACK, 1.0)
 
         # Set up perspective
-        glMatrixMode(GL_PROJECTION)
-        glLoadIdentity()
-        gluPerspective(45, self.width / self.height, 0.1, 2000.0)
+        gl.glMatrixMode(gl.GL_PROJECTION)
+        gl.glLoadIdentity()
+        glu.gluPerspective(45, self.width / self.height, 0.1, 2000.0)
 
-        # Get id for display list for arena and grid
-        self.grid_list_id = glGenLists(1)
+        self.floor_program = build_floor_program()
 
         # Textures for left and right view
-        self.sideview_tex_size = 512
-        self.sideview_fbo = glGenFramebuffers(2)
-        self.sideview_tex = glGenTextures(2)
-        self.sideview_depth_rb = glGenRenderbuffers(2)
+        self.sideview_tex_size = SIDEVIEW_TEX_SIZE
+        self.sideview_res = [0, 0]      # 0: needs to be rendered
+        self.sideview_fbo = gl.glGenFramebuffers(2)
+        self.sideview_tex = gl.glGenTextures(2)
+        self.sideview_depth_rb = gl.glGenRenderbuffers(2)
 
         for i in range(2):
-            glBindTexture(GL_TEXTURE_2D, self.sideview_tex[i])
-            glTexImage2D(GL_TEXTURE_2D, 0, GL_RGB,
-                         self.sideview_tex_size, self.sideview_tex_size, 0,
-                         GL_RGB, GL_UNSIGNED_BYTE, None)
-            glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MIN_FILTER, GL_LINEAR)
-            glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MAG_FILTER, GL_LINEAR)
-
-            glBindFramebuffer(GL_FRAMEBUFFER, self.sideview_fbo[i])
-            glFramebufferTexture2D(GL_FRAMEBUFFER, GL_COLOR_ATTACHMENT0,
-                                   GL_TEXTURE_2D, self.sideview_tex[i], 0)
-
-            glBindRenderbuffer(GL_RENDERBUFFER, self.sideview_depth_rb[i])
-            glRenderbufferStorage(GL_RENDERBUFFER, GL_DEPTH_COMPONENT,
-                                  self.sideview_tex_size,
-                                  self.sideview_tex_size)
-            glFramebufferRenderbuffer(GL_FRAMEBUFFER, GL_DEPTH_ATTACHMENT,
-                                      GL_RENDERBUFFER,
-                                      self.sideview_depth_rb[i])
-        glBindFramebuffer(GL_FRAMEBUFFER, 0)
+            gl.glBindTexture(gl.GL_TEXTURE_2D, self.sideview_tex[i])
+            gl.glTexImage2D(gl.GL_TEXTURE_2D, 0, gl.GL_RGB,
+                            self.sideview_tex_size, self.sideview_tex_size, 0,
+                            gl.GL_RGB, gl.GL_UNSIGNED_BYTE, None)
+            gl.glTexParameteri(gl.GL_TEXTURE_2D, gl.GL_TEXTURE_MIN_FILTER,
+                               gl.GL_LINEAR)
+            gl.glTexParameteri(gl.GL_TEXTURE_2D, gl.GL_TEXTURE_MAG_FILTER,
+                               gl.GL_LINEAR)
+
+            gl.glBindFramebuffer(gl.GL_FRAMEBUFFER, self.sideview_fbo[i])
+            gl.glFramebufferTexture2D(gl.GL_FRAMEBUFFER,
+                                      gl.GL_COLOR_ATTACHMENT0,
+                                      gl.GL_TEXTURE_2D,
+                                      self.sideview_tex[i], 0)
+
+            gl.glBindRenderbuffer(gl.GL_RENDERBUFFER,
+                                  self.sideview_depth_rb[i])
+            gl.glRenderbufferStorage(gl.GL_RENDERBUFFER, gl.GL_DEPTH_COMPONENT,
+                                     self.sideview_tex_size,
+                                     self.sideview_tex_size)
+            gl.glFramebufferRenderbuffer(gl.GL_FRAMEBUFFER,
+                                         gl.GL_DEPTH_ATTACHMENT,
+                                         gl.GL_RENDERBUFFER,
+                                         self.sideview_depth_rb[i])
+        gl.glBindFramebuffer(gl.GL_FRAMEBUFFER, 0)
 
         # Setup light
-        setup_directional_light(GL_LIGHT0, (1.0, 0.0, -1.0))
-        setup_directional_light(GL_LIGHT1, (-1.0, 0.0, 1.0))
-        setup_directional_light(GL_LIGHT2, (1.0, 0.0, 1.0))
-        setup_directional_light(GL_LIGHT3, (-1.0, 0.0, -1.0))
+        setup_directional_light(gl.GL_LIGHT0, (1.0, 0.0, -1.0))
+        setup_directional_light(gl.GL_LIGHT1, (-1.0, 0.0, 1.0))
+        setup_directional_light(gl.GL_LIGHT2, (1.0, 0.0, 1.0))
+        setup_directional_light(gl.GL_LIGHT3, (-1.0, 0.0, -1.0))
 
     def new_arena(self):
         assert self.mode == Tron3D.Mode.IN_3D
         assert self.tron_client.arena is not None
-        arena = self.tron_client.arena
         print("new arena")
 
-        # Generate display list for arena and grid
-        glMatrixMode(GL_MODELVIEW)
-        glLoadIdentity()
-        glNewList(self.grid_list_id, GL_COMPILE)
-        _build_grid(arena.width, arena.height)
-        glEndList()
-
     def focus_coords(self):
         assert self.tron_client.arena is not None
 
@@ -410,32 +864,34 @@ class Tron3D:
         color = (255, 255, 255)
         if winner >= 0:
             msg = f"{arena.name[winner]} won"
-            color = C_PLAYER[winner]
+            color = tuple(int(c * 255) for c in player_color(winner)[:3])
         print(msg)
         self.winner = self.winner_font.render(msg, True, color)
 
     def show_connect(self):
         self.set_mode(Tron3D.Mode.IN_2D)
-        title_text = self.title_font.render("TRON: Lightcycle", True,
-                                            (255, 255, 255))
+        title_text = self.text_cache.get(self.title_font, "TRON: Lightcycle",
+                                         (255, 255, 255))
         title_rect = title_text.get_rect(center=(self.width // 2, 80))
         self.screen.blit(title_text, title_rect)
 
-        prompt_name = self.input_font.render("Name:", True, (100, 200, 100))
-        input_name = self.input_font.render(self.name
-            + ("‸" if self.edit == 0 else ""), True, (155, 255, 155))
+        prompt_name = self.text_cache.get(self.input_font, "Name:",
+                                          (100, 200, 100))
+        input_name = self.text_cache.get(self.input_font, self.name
+            + ("‸" if self.edit == 0 else ""), (155, 255, 155))
         self.screen.blit(prompt_name, (self.width // 5, 180))
         self.screen.blit(input_name,   (self.width // 5 + 150, 180))
 
-        prompt_server = self.input_font.render("Server:", True, (100, 200, 100))
-        input_server = self.input_font.render(self.host
-            + ("‸" if self.edit == 1 else ""), True, (155, 255, 155))
+        prompt_server = self.text_cache.get(self.input_font, "Server:",
+                                            (100, 200, 100))
+        input_server = self.text_cache.get(self.input_font, self.host
+            + ("‸" if self.edit == 1 else ""), (155, 255, 155))
         self.screen.blit(prompt_server, (self.width // 5, 230))
         self.screen.blit(input_server,   (self.width // 5 + 150, 230))
 
         hint = ("^Q: Quit  |  TAB: switch field  |  ^F: find server  "
                 "|  RETURN: connect")
-        hint_text = self.hint_font.render(hint, True, (150, 150, 150))
+        hint_text = self.text_cache.get(self.hint_font, hint, (150, 150, 150))
         hint_rect = hint_text.get_rect(center=(self.width // 2,
                                                self.height - 80))
         self.screen.blit(hint_text, hint_rect)
@@ -446,8 +902,8 @@ class Tron3D:
     def show_serverlist(self):
         self.set_mode(Tron3D.Mode.IN_2D)
 
-        title_text = self.title_font.render(
-                "TRON servers in local network", True, (255, 255, 255))
+        title_text = self.text_cache.get(self.title_font,
+                "TRON servers in local network", (255, 255, 255))
         title_rect = title_text.get_rect(center=(self.width // 2, 80))
         self.screen.blit(title_text, title_rect)
 
@@ -477,11 +933,15 @@ class Tron3D:
         for i0, addr in enumerate(server_list):
             i = self.serverlist_i0 + i0
             color = (0, 255, 255) if i == self.serverlist_i else (180, 180, 180)
-            entry = self.list_font.render(f"({i}) " + addr, True, color)
+            text = f"({i}) " + addr
+            info = self.server_scanner.get_info(addr)
+            if info is not None:
+                text += f"  {info['name']}  {info['free']} free"
+            entry = self.text_cache.get(self.list_font, text, color)
             self.screen.blit(entry, (lx, ly + i0 * 40))
 
         hint = "ESC: Cancle  |  RETURN: select  |  ↑↓:  up / down"
-        hint_text = self.hint_font.render(hint, True, (150, 150, 150))
+        hint_text = self.text_cache.get(self.hint_font, hint, (150, 150, 150))
         hint_rect = hint_text.get_rect(center=(self.width // 2,
                                                self.height - 80))
         self.screen.blit(hint_text, hint_rect)
@@ -490,7 +950,8 @@ class Tron3D:
         self.set_mode(Tron3D.Mode.IN_2D)
 
         state = self.tron_client.get_state_msg()
-        state_text = self.state_font.render(state, True, (150, 150, 150))
+        state_text = self.text_cache.get(self.state_font, state,
+                                         (150, 150, 150))
         state_rect = state_text.get_rect(center=(self.width // 2,
                                                  self.height - 40))
         self.screen.blit(state_text, state_rect)
@@ -508,13 +969,13 @@ class Tron3D:
         for i, p in enumerate(arena.player):
             color = (100, 150, 50)
             if arena.ready[i]:
-                color = C_PLAYER[i]
+                color = tuple(int(c * 255) for c in player_color(i)[:3])
             text = f"{arena.name[i]}: {arena.score[i]}"
             if arena.I_am_player is not None and i == arena.I_am_player:
                 text = "> " + text
             else:
                 text = "  " + text
-            label = self.score_font.render(text, True, color)
+            label = self.text_cache.get(self.score_font, text, color)
             self.screen.blit(label, (padding, y))
             y += label.get_height() + 5
 
@@ -523,53 +984,50 @@ class Tron3D:
                                                        self.height // 2))
             self.screen.blit(self.winner, winner_rect)
 
+    def draw_text_texture(self, text_texture, x, y):
+        tex_id, tw, th = text_texture
+        gl.glBindTexture(gl.GL_TEXTURE_2D, tex_id)
+
+        gl.glColor3f(1, 1, 1)
+        gl.glBegin(gl.GL_QUADS)
+        gl.glTexCoord2f(0, 0); gl.glVertex2f(x, y)
+        gl.glTexCoord2f(1, 0); gl.glVertex2f(x + tw, y)
+        gl.glTexCoord2f(1, 1); gl.glVertex2f(x + tw, y + th)
+        gl.glTexCoord2f(0, 1); gl.glVertex2f(x, y + th)
+        gl.glEnd()
+
     def draw_state_overlay(self):
         state = self.tron_client.get_state_msg()
         if not state:
             return
 
-        surface = self.state_font.render(state, True, (200, 200, 200))
-        text_data = pygame.image.tostring(surface, "RGBA", True)
-        tw, th = surface.get_width(), surface.get_height()
+        text_texture = self.text_textures.get(self.state_font, state,
+                                              (200, 200, 200))
+        tw = text_texture[1]
+
+        gl.glMatrixMode(gl.GL_PROJECTION)
+        gl.glPushMatrix()
+        gl.glLoadIdentity()
+        glu.gluOrtho2D(0, self.width, 0, self.height)
+
+        gl.glMatrixMode(gl.GL_MODELVIEW)
+        gl.glPushMatrix()
+        gl.glLoadIdentity()
+
+        gl.glDisable(gl.GL_LIGHTING)
+        gl.glDisable(gl.GL_DEPTH_TEST)
+        gl.glEnable(gl.GL_TEXTURE_2D)
+
+        self.draw_text_texture(text_texture, (self.width - tw) // 2, 20)
+
+        gl.glDisable(gl.GL_TEXTURE_2D)
+        gl.glEnable(gl.GL_DEPTH_TEST)
+        gl.glEnable(gl.GL_LIGHTING)
 
-        glMatrixMode(GL_PROJECTION)
-        glPushMatrix()
-        glLoadIdentity()
-        gluOrtho2D(0, self.width, 0, self.height)
-
-        glMatrixMode(GL_MODELVIEW)
-        glPushMatrix()
-        glLoadIdentity()
-
-        glDisable(GL_LIGHTING)
-        glDisable(GL_DEPTH_TEST)
-        glEnable(GL_TEXTURE_2D)
-
-        tex_id = glGenTextures(1)
-        glBindTexture(GL_TEXTURE_2D, tex_id)
-        glTexImage2D(GL_TEXTURE_2D, 0, GL_RGBA, tw, th, 0, GL_RGBA,
-                     GL_UNSIGNED_BYTE, text_data)
-        glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MIN_FILTER, GL_LINEAR)
-
-        x = (self.width - tw) // 2
-        y = 20
-        glColor3f(1, 1, 1)
-        glBegin(GL_QUADS)
-        glTexCoord2f(0, 0); glVertex2f(x, y)
-        glTexCoord2f(1, 0); glVertex2f(x + tw, y)
-        glTexCoord2f(1, 1); glVertex2f(x + tw, y + th)
-        glTexCoord2f(0, 1); glVertex2f(x, y + th)
-        glEnd()
-
-        glDeleteTextures([tex_id])
-        glDisable(GL_TEXTURE_2D)
-        glEnable(GL_DEPTH_TEST)
-        glEnable(GL_LIGHTING)
-
-        glMatrixMode(GL_PROJECTION)
-        glPopMatrix()
-        glMatrixMode(GL_MODELVIEW)
-        glPopMatrix()
+        gl.glMatrixMode(gl.GL_PROJECTION)
+        gl.glPopMatrix()
+        gl.glMatrixMode(gl.GL_MODELVIEW)
+        gl.glPopMatrix()
     
 
     def draw_score_overlay(self):
@@ -577,54 +1035,101 @@ class Tron3D:
         if arena is None or arena.player is None:
             return
 
-        glMatrixMode(GL_PROJECTION)
-        glPushMatrix()
-        glLoadIdentity()
-        gluOrtho2D(0, self.width, 0, self.height)
+        gl.glMatrixMode(gl.GL_PROJECTION)
+        gl.glPushMatrix()
+        gl.glLoadIdentity()
+        glu.gluOrtho2D(0, self.width, 0, self.height)
 
-        glMatrixMode(GL_MODELVIEW)
-        glPushMatrix()
-        glLoadIdentity()
+        gl.glMatrixMode(gl.GL_MODELVIEW)
+        gl.glPushMatrix()
+        gl.glLoadIdentity()
 
-        glDisable(GL_LIGHTING)
-        glDisable(GL_DEPTH_TEST)
+        gl.glDisable(gl.GL_LIGHTING)
+        gl.glDisable(gl.GL_DEPTH_TEST)
+        gl.glEnable(gl.GL_TEXTURE_2D)
 
         y = self.height - 30
         for i, p in enumerate(arena.player):
             text = f"{arena.name[i]}: {arena.score[i]}"
-            color = tuple(int(c * 255) for c in C_PLAYER[i][:3])
-            surface = self.score_font.render(text, True, color)
-
-            text_data = pygame.image.tostring(surface, "RGBA", True)
-            tw, th = surface.get_width(), surface.get_height()
-
-            glEnable(GL_TEXTURE_2D)
-            tex_id = glGenTextures(1)
-            glBindTexture(GL_TEXTURE_2D, tex_id)
-            glTexImage2D(GL_TEXTURE_2D, 0, GL_RGBA, tw, th, 0, GL_RGBA,
-                         GL_UNSIGNED_BYTE, text_data)
-            glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MIN_FILTER, GL_LINEAR)
-
-            glColor3f(1, 1, 1)
-            x, y0 = 10, y
-            glBegin(GL_QUADS)
-            glTexCoord2f(0, 0); glVertex2f(x, y0)
-            glTexCoord2f(1, 0); glVertex2f(x + tw, y0)
-            glTexCoord2f(1, 1); glVertex2f(x + tw, y0 + th)
-            glTexCoord2f(0, 1); glVertex2f(x, y0 + th)
-            glEnd()
-
-            glDeleteTextures([tex_id])
-            glDisable(GL_TEXTURE_2D)
-            y -= th + 10
-
-        glEnable(GL_DEPTH_TEST)
-        glEnable(GL_LIGHTING)
-
-        glMatrixMode(GL_PROJECTION)
-        glPopMatrix()
-        glMatrixMode(GL_MODELVIEW)
-        glPopMatrix()
+            color = tuple(int(c * 255) for c in player_color(i)[:3])
+            text_texture = self.text_textures.get(self.score_font, text,
+                                                  color)
+            self.draw_text_texture(text_texture, 10, y)
+            y -= text_texture[2] + 10
+
+        gl.glDisable(gl.GL_TEXTURE_2D)
+        gl.glEnable(gl.GL_DEPTH_TEST)
+        gl.glEnable(gl.GL_LIGHTING)
+
+        gl.glMatrixMode(gl.GL_PROJECTION)
+        gl.glPopMatrix()
+        gl.glMatrixMode(gl.GL_MODELVIEW)
+        gl.glPopMatrix()
+
+    def show_profiler(self):
+        if not self.profiler.enabled:
+            return
+        text = self.profiler.get_text(self.tron_client)
+        if len(text) == 0:
+            return
+
+        padding = 10
+        color = (255, 255, 0)
+        if self.mode != Tron3D.Mode.IN_3D:
+            labels = [self.text_cache.get(self.hint_font, line, color)
+                      for line in text]
+            w = max(label.get_width() for label in labels)
+            h = sum(label.get_height() for label in labels)
+            x0 = self.width - w - 2 * padding
+            pygame.draw.rect(self.screen, (0, 0, 0),
+                             (x0, 0, w + 2 * padding, h + 2 * padding))
+            y = padding
+            for label in labels:
+                self.screen.blit(label, (x0 + padding, y))
+                y += label.get_height()
+            return
+
+        text_textures = [self.text_textures.get(self.hint_font, line, color)
+                         for line in text]
+        w = max(tw for _, tw, _ in text_textures)
+        h = sum(th for _, _, th in text_textures)
+        x0 = self.width - w - 2 * padding
+        y0 = self.height - h - 2 * padding
+
+        gl.glMatrixMode(gl.GL_PROJECTION)
+        gl.glPushMatrix()
+        gl.glLoadIdentity()
+        glu.gluOrtho2D(0, self.width, 0, self.height)
+
+        gl.glMatrixMode(gl.GL_MODELVIEW)
+        gl.glPushMatrix()
+        gl.glLoadIdentity()
+
+        gl.glDisable(gl.GL_LIGHTING)
+        gl.glDisable(gl.GL_DEPTH_TEST)
+
+        gl.glColor4f(0, 0, 0, 0.7)
+        gl.glBegin(gl.GL_QUADS)
+        gl.glVertex2f(x0, y0)
+        gl.glVertex2f(self.width, y0)
+        gl.glVertex2f(self.width, self.height)
+        gl.glVertex2f(x0, self.height)
+        gl.glEnd()
+
+        gl.glEnable(gl.GL_TEXTURE_2D)
+        y = self.height - padding
+        for text_texture in text_textures:
+            y -= text_texture[2]
+            self.draw_text_texture(text_texture, x0 + padding, y)
+
+        gl.glDisable(gl.GL_TEXTURE_2D)
+        gl.glEnable(gl.GL_DEPTH_TEST)
+        gl.glEnable(gl.GL_LIGHTING)
+
+        gl.glMatrixMode(gl.GL_PROJECTION)
+        gl.glPopMatrix()
+        gl.glMatrixMode(gl.GL_MODELVIEW)
+        gl.glPopMatrix()
 
     def show_minimap(self):
         assert self.tron_client.arena is not None
@@ -636,71 +1141,77 @@ class Tron3D:
         if p is None or p.x is None:
             return
 
-        mm_width, mm_height = 200, 150
+        mm_width, mm_height = MINIMAP_WIDTH, MINIMAP_HEIGHT
         view_width, view_height = self.width, self.height
 
+        # Texture of the trails, redrawn if the arena changed or the
+        # cycles moved far enough
+        minimap = self.minimap
+        if minimap is None or minimap.width != arena.width \
+                or minimap.height != arena.height:
+            if minimap is not None:
+                minimap.delete()
+            minimap = MinimapTexture(arena.width, arena.height,
+                                     mm_width / view_width)
+            self.minimap = minimap
+        if minimap.needs_refresh(arena.player):
+            minimap.refresh(arena.player, self.walls)
+
         x0, y0 = (view_width - mm_width) // 2, 20
-        glViewport(x0, y0, mm_width, mm_height)
+        gl.glViewport(x0, y0, mm_width, mm_height)
 
-        glMatrixMode(GL_PROJECTION)
-        glLoadIdentity()
+        gl.glMatrixMode(gl.GL_PROJECTION)
+        gl.glLoadIdentity()
         half_width, half_height = view_width // 2, view_height // 2
-        gluOrtho2D(p.x - half_width, p.x + half_width,
-                   p.y - half_height, p.y + half_height)
+        glu.gluOrtho2D(p.x - half_width, p.x + half_width,
+                       p.y - half_height, p.y + half_height)
 
-        glMatrixMode(GL_MODELVIEW)
-        glLoadIdentity()
+        gl.glMatrixMode(gl.GL_MODELVIEW)
+        gl.glLoadIdentity()
 
-        glDisable(GL_LIGHTING)
-        glDisable(GL_DEPTH_TEST)
+        gl.glDisable(gl.GL_LIGHTING)
+        gl.glDisable(gl.GL_DEPTH_TEST)
 
         # Background
-        glColor3f(0.2, 0.2, 0.2)
-        glBegin(GL_QUADS)
-        glVertex2f(p.x - half_width, p.y - half_height)
-        glVertex2f(p.x + half_width, p.y - half_height)
-        glVertex2f(p.x + half_width, p.y + half_height)
-        glVertex2f(p.x - half_width, p.y + half_height)
-        glEnd()
+        gl.glColor3f(0.2, 0.2, 0.2)
+        gl.glBegin(gl.GL_QUADS)
+        gl.glVertex2f(p.x - half_width, p.y - half_height)
+        gl.glVertex2f(p.x + half_width, p.y - half_height)
+        gl.glVertex2f(p.x + half_width, p.y + half_height)
+        gl.glVertex2f(p.x - half_width, p.y + half_height)
+        gl.glEnd()
 
         if p.dx != 0 or p.dy != 0:
-            glTranslatef(p.x, p.y, 0)
+            gl.glTranslatef(p.x, p.y, 0)
             angle = -math.degrees(math.atan2(p.dx, p.dy))
-            glRotatef(-angle, 0, 0, 1)
-            glTranslatef(-p.x, -p.y, 0)
+            gl.glRotatef(-angle, 0, 0, 1)
+            gl.glTranslatef(-p.x, -p.y, 0)
 
         # Arena border
-        glColor3f(1, 0, 0)
-        glBegin(GL_LINE_LOOP)
-        glVertex2f(0, 0)
-        glVertex2f(0, arena.width)
-        glVertex2f(arena.width, arena.height)
-        glVertex2f(arena.width, 0)
-        glEnd()
+        gl.glColor3f(1, 0, 0)
+        gl.glBegin(gl.GL_LINE_LOOP)
+        gl.glVertex2f(0, 0)
+        gl.glVertex2f(0, arena.width)
+        gl.glVertex2f(arena.width, arena.height)
+        gl.glVertex2f(arena.width, 0)
+        gl.glEnd()
 
         # Jetwall
-        for pi, p in enumerate(arena.player):
-            if p is None or p.path is None:
-                continue
-            glColor4f(*C_PLAYER[pi])
-            glBegin(GL_LINE_STRIP)
-            for a, b in p.path:
-                glVertex2f(a, b)
-            glEnd()
+        minimap.draw()
 
         # Players
+        gl.glPointSize(5)
+        gl.glBegin(gl.GL_POINTS)
         for i, p in enumerate(arena.player):
             if p is None or p.path is None:
                 continue
-            glColor4f(*C_PLAYER[pi])
-            glPointSize(5)
-            glBegin(GL_POINTS)
-            glVertex2f(p.x, p.y)
-            glEnd()
+            gl.glColor4f(*player_color(i))
+            gl.glVertex2f(p.x, p.y)
+        gl.glEnd()
 
-        glEnable(GL_DEPTH_TEST)
-        glEnable(GL_LIGHTING)
-        glViewport(0, 0, self.width, self.height)
+        gl.glEnable(gl.GL_DEPTH_TEST)
+        gl.glEnable(gl.GL_LIGHTING)
+        gl.glViewport(0, 0, self.width, self.height)
 
     def set_camera(self, look = None):
         assert self.tron_client.arena is not None
@@ -721,17 +1232,21 @@ class Tron3D:
             set_camera(-10, -10, 1, 1, 25, look)
 
     def render_side_camera_to_texture(self, side):
-        glBindFramebuffer(GL_FRAMEBUFFER, self.sideview_fbo[side])
-        glViewport(0, 0, self.sideview_tex_size, self.sideview_tex_size)
+        # Lower resolutions only use the lower left part of the texture
+        res = self.sideview_size
+        self.sideview_res[side] = res
+
+        gl.glBindFramebuffer(gl.GL_FRAMEBUFFER, self.sideview_fbo[side])
+        gl.glViewport(0, 0, res, res)
 
-        glClear(GL_COLOR_BUFFER_BIT | GL_DEPTH_BUFFER_BIT)
+        gl.glClear(gl.GL_COLOR_BUFFER_BIT | gl.GL_DEPTH_BUFFER_BIT)
 
-        glMatrixMode(GL_PROJECTION)
-        glLoadIdentity()
-        gluPerspective(45, 1.0, 0.1, 2000.0)
+        gl.glMatrixMode(gl.GL_PROJECTION)
+        gl.glLoadIdentity()
+        glu.gluPerspective(45, 1.0, 0.1, 2000.0)
 
-        glMatrixMode(GL_MODELVIEW)
-        glLoadIdentity()
+        gl.glMatrixMode(gl.GL_MODELVIEW)
+        gl.glLoadIdentity()
         if side == 0:
             self.set_camera(-1)
         else:
@@ -739,20 +1254,20 @@ class Tron3D:
 
         self.draw_frame_3d()
 
-        glBindFramebuffer(GL_FRAMEBUFFER, 0)
+        gl.glBindFramebuffer(gl.GL_FRAMEBUFFER, 0)
 
     def draw_side_view(self, side):
-        glDisable(GL_LIGHTING)
-        glDisable(GL_DEPTH_TEST)
-        glEnable(GL_TEXTURE_2D)
-        glBindTexture(GL_TEXTURE_2D, self.sideview_tex[side])
+        gl.glDisable(gl.GL_LIGHTING)
+        gl.glDisable(gl.GL_DEPTH_TEST)
+        gl.glEnable(gl.GL_TEXTURE_2D)
+        gl.glBindTexture(gl.GL_TEXTURE_2D, self.sideview_tex[side])
 
-        glMatrixMode(GL_PROJECTION)
-        glLoadIdentity()
-        gluOrtho2D(0, self.width, 0, self.height)
+        gl.glMatrixMode(gl.GL_PROJECTION)
+        gl.glLoadIdentity()
+        glu.gluOrtho2D(0, self.width, 0, self.height)
 
-        glMatrixMode(GL_MODELVIEW)
-        glLoadIdentity()
+        gl.glMatrixMode(gl.GL_MODELVIEW)
+        gl.glLoadIdentity()
 
         w, h = 200, 200
         pad_x, pad_y = 20, 20
@@ -762,18 +1277,19 @@ class Tron3D:
         y0 = pad_y
 
         skew_x = skew if side == 0 else -skew
+        t = self.sideview_res[side] / self.sideview_tex_size
 
-        glColor3f(1, 1, 1)
-        glBegin(GL_QUADS)
-        glTexCoord2f(0, 0); glVertex2f(x0 + skew_x, y0)
-        glTexCoord2f(1, 0); glVertex2f(x0 + w + skew_x, y0)
-        glTexCoord2f(1, 1); glVertex2f(x0 + w - skew_x, y0 + h)
-        glTexCoord2f(0, 1); glVertex2f(x0 - skew_x, y0 + h)
-        glEnd()
+        gl.glColor3f(1, 1, 1)
+        gl.glBegin(gl.GL_QUADS)
+        gl.glTexCoord2f(0, 0); gl.glVertex2f(x0 + skew_x, y0)
+        gl.glTexCoord2f(t, 0); gl.glVertex2f(x0 + w + skew_x, y0)
+        gl.glTexCoord2f(t, t); gl.glVertex2f(x0 + w - skew_x, y0 + h)
+        gl.glTexCoord2f(0, t); gl.glVertex2f(x0 - skew_x, y0 + h)
+        gl.glEnd()
 
-        glDisable(GL_TEXTURE_2D)
-        glEnable(GL_DEPTH_TEST)
-        glEnable(GL_LIGHTING)
+        gl.glDisable(gl.GL_TEXTURE_2D)
+        gl.glEnable(gl.GL_DEPTH_TEST)
+        gl.glEnable(gl.GL_LIGHTING)
 
     def show_arena_3d(self):
         self.set_mode(Tron3D.Mode.IN_3D)
@@ -783,42 +1299,107 @@ class Tron3D:
         if arena.width == None:
             return
 
-        glClear(GL_COLOR_BUFFER_BIT | GL_DEPTH_BUFFER_BIT)
-        self.render_side_camera_to_texture(0)
-        self.render_side_camera_to_texture(1)
-        glViewport(0, 0, self.width, self.height)
+        self.update_walls()
+
+        gl.glClear(gl.GL_COLOR_BUFFER_BIT | gl.GL_DEPTH_BUFFER_BIT)
+        self.frame_count += 1
+        every = self.sideview_every
+        for side in range(2):
+            if self.sideview_res[side] == 0 \
+                    or (self.frame_count + side * every // 2) % every == 0:
+                self.render_side_camera_to_texture(side)
+        gl.glViewport(0, 0, self.width, self.height)
 
-        glMatrixMode(GL_PROJECTION)
-        glLoadIdentity()
-        gluPerspective(45, arena.width / arena.height, 0.1, 2000.0)
+        gl.glMatrixMode(gl.GL_PROJECTION)
+        gl.glLoadIdentity()
+        glu.gluPerspective(45, arena.width / arena.height, 0.1, 2000.0)
 
-        glMatrixMode(GL_MODELVIEW)
-        glLoadIdentity()
+        gl.glMatrixMode(gl.GL_MODELVIEW)
+        gl.glLoadIdentity()
 
         self.set_camera()
         self.draw_frame_3d()
         self.draw_side_view(0)
         self.draw_side_view(1)
 
+    def adapt_sideviews(self, frame_time):
+        self.frame_time = 0.9 * self.frame_time + 0.1 * frame_time
+        self.frames_since_adapt += 1
+        if not self.adaptive or self.frames_since_adapt < self.fps:
+            return
+
+        budget = 1.0 / self.fps
+        if self.frame_time > budget:
+            if self.sideview_size > SIDEVIEW_MIN_SIZE:
+                self.sideview_size //= 2
+            elif self.sideview_every < SIDEVIEW_MAX_EVERY:
+                self.sideview_every *= 2
+            else:
+                return
+        elif self.frame_time < 0.6 * budget:
+            if self.sideview_every > self.sideview_every_min:
+                self.sideview_every //= 2
+            elif self.sideview_size < self.sideview_tex_size:
+                self.sideview_size *= 2
+            else:
+                return
+        else:
+            return
+        self.frames_since_adapt = 0
+        print(f"frame time {self.frame_time * 1000:.1f}ms: side views "
+              f"{self.sideview_size}px every {self.sideview_every} frames")
+
+    def update_walls(self):
+        arena = self.tron_client.arena
+        if arena.player is None:
+            return
+
+        while len(self.walls) < len(arena.player):
+            self.walls.append(WallBuffer())
+        for pi, p in enumerate(arena.player):
+            self.walls[pi].update(p)
+
     def draw_frame_3d(self):
         assert self.tron_client.arena is not None
         arena = self.tron_client.arena
 
-        glCallList(self.grid_list_id)
+        draw_floor(self.floor_program, arena.width, arena.height)
 
+        # Called with the camera of the main or a side view already set up
+        frustum = view_frustum()
         for pi, p in enumerate(arena.player):
             if p is None or p.path is None:
                 continue
-            draw_lightcycle(p.x, p.y, p.dx, p.dy, C_PLAYER[pi])
-            for i in range(len(p.path) - 1):
-                x0, y0 = p.path[i]
-                x1, y1 = p.path[i + 1]
-                draw_lightwall(x0, y0, x1, y1, C_WALL[pi])
+            if lightcycle_visible(frustum, p.x, p.y):
+                draw_lightcycle(p.x, p.y, p.dx, p.dy, player_color(pi))
+            self.walls[pi].draw(wall_color(pi), frustum)
+
+    def handle_controller(self):
+        if self.controller is None:
+            return
+        moves = {"A": "L", "B": "R", "U": "U", "D": "D"}
+        for t, event in self.controller.get_events():
+            self.profiler.input_latency(time.monotonic() - t)
+            if self.tron_client.game_is_on():
+                self.tron_client.send_move(moves[event])
+            elif event == "A" and self.tron_client.received_end():
+                self.tron_client.ready_to_end = True
+                self.winner = None
+            elif event == "A" and self.tron_client.received_go():
+                self.tron_client.ready_to_go = True
+        if not self.controller.running:
+            self.controller = None
 
     def run(self):
         in_select_server = False
         while True:
+            frame_start = time.perf_counter()
+            self.profiler.begin_frame()
+            if self.system_fonts is not None:
+                self.set_fonts(self.system_fonts)
+                self.system_fonts = None
             self.tron_client.run()
+            self.profiler.mark("client")
             if self.mode == Tron3D.Mode.IN_2D or self.tron_client.arena is None:
                 self.screen.fill((0, 0, 0))
 
@@ -832,46 +1413,13 @@ class Tron3D:
             else:
                 self.show_arena_3d()
                 self.show_minimap()
+                self.profiler.mark("arena")
                 self.draw_score_overlay()
                 self.draw_state_overlay()
+            self.show_profiler()
+            self.profiler.mark("hud")
 
-            try:
-                if self.ser is not None and self.ser.in_waiting > 0:
-                    ch = self.ser.read(1)
-                    print(f"get form serial {ch}")
-                    if ch == b"A" or ch == b"R":
-                        if self.tron_client.game_is_on():
-                            self.tron_client.send_move("L")
-                        elif self.tron_client.received_end():
-                            self.tron_client.ready_to_end = True
-                            self.winner = None
-                        elif self.tron_client.received_go():
-                            self.tron_client.ready_to_go = True
-                    elif ch == b"B" or ch == b"L":
-                        if self.tron_client.game_is_on():
-                            self.tron_client.send_move("R")
-                    elif ch == b"U":
-                        if self.tron_client.game_is_on():
-                            self.tron_client.send_move("U")
-                    elif ch == b"D":
-                        if self.tron_client.game_is_on():
-                            self.tron_client.send_move("D")
-                    elif ch == b"X":
-                        while self.ser.in_waiting < 4:
-                            pass
-                        val = int(self.ser.read(4).decode('utf-8'))
-                        print(f"val = {val}")
-                        if not hasattr(self, "oldXSerVal"):
-                            self.oldXSerVal = val
-                        if val > self.oldXSerVal:
-                            if self.tron_client.game_is_on():
-                                self.tron_client.send_move("U")
-                        elif val < self.oldXSerVal:
-                            if self.tron_client.game_is_on():
-                                self.tron_client.send_move("D")
-                        self.ser.write(b'X')
-            except:
-                self.ser = None
+            self.handle_controller()
 
             for event in pygame.event.get():
                 mods = pygame.key.get_mods()
@@ -881,13 +1429,21 @@ class Tron3D:
                     if event.key == pygame.K_q and (mods & pygame.KMOD_CTRL):
                         return
                     elif event.key == pygame.K_p and (mods & pygame.KMOD_CTRL):
-                        self.ser = open_serial()
+                        if self.controller is None:
+                            self.controller = open_controller()
+                    elif event.key == pygame.K_F3:
+                        self.profiler.toggle()
                     elif self.tron_client.not_connected():
                         if in_select_server:
                             if event.key == pygame.K_RETURN:
                                 l = self.get_serverlist()
-                                self.serverlist_i %= len(l)
-                                self.host = l[self.serverlist_i]
+                                if len(l) != 0:
+                                    self.serverlist_i %= len(l)
+                                    self.host = l[self.serverlist_i]
+                                    info = self.server_scanner.get_info(
+                                            self.host)
+                                    if info is not None:
+                                        self.port = info["port"]
                                 in_select_server = False
                             elif event.key == pygame.K_ESCAPE:
                                 in_select_server = False
@@ -903,6 +1459,7 @@ class Tron3D:
                                 self.edit = (self.edit + 1) % 2
                             elif event.key == pygame.K_f \
                                     and (mods & pygame.KMOD_CTRL):
+                                self.server_scanner.start_scan()
                                 in_select_server = True
                             elif event.key == pygame.K_BACKSPACE:
                                 if self.edit == 0:
@@ -938,11 +1495,19 @@ class Tron3D:
                     elif self.tron_client.received_go():
                         self.tron_client.ready_to_go = True
 
+            self.profiler.mark("input")
             pygame.display.flip()
+            self.profiler.mark("flip")
+            if self.first_frame:
+                self.first_frame = False
+                self.first_frame_done()
+            if self.mode == Tron3D.Mode.IN_3D:
+                self.adapt_sideviews(time.perf_counter() - frame_start)
             self.clock.tick(self.fps)
 
 def main(argv):
     tron3d = Tron3D(60, 800, 600)
     tron3d.run()
 
-main(sys.argv)
+if __name__ == "__main__":
+    main(sys.argv)
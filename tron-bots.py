@@ -0,0 +1,325 @@
+import argparse
+import collections
+import math
+import random
+import selectors
+import sys
+import time
+
+from tron_client import Arena
+from tron_client import TronClient
+
+PORT = 65432
+FPS = 40
+
+MOVES = "LRUD"
+MAX_LINES_PER_WAKEUP = 256
+
+def percentile(values, q):
+    if len(values) == 0:
+        return float("nan")
+    values = sorted(values)
+    k = min(len(values) - 1, max(0, math.ceil(q / 100 * len(values)) - 1))
+    return values[k]
+
+def ms(t):
+    return t * 1000
+
+class BotArena(Arena):
+
+    def __init__(self, bot):
+        super().__init__()
+        self.bot = bot
+
+    def set_position(self, pos_list):
+        super().set_position(pos_list)
+        self.bot.position_received()
+
+    def update_positions(self, update_list):
+        super().update_positions(update_list)
+        self.bot.position_received()
+
+class Bot:
+
+    def __init__(self, index, host, port, rate):
+        self.index = index
+        self.host = host
+        self.port = port
+        self.rate = rate
+        self.name = f"bot{index}"
+
+        self.client = TronClient(self)
+        self.client.arena = BotArena(self)
+        self.sock = None
+        self.reconnect_at = 0
+        self.next_move = None
+        self.go_sent = False
+
+        self.turn_sent = None
+        self.turn_dir = None
+        self.last_frame = None
+
+        self.frames = 0
+        self.rounds = 0
+        self.connects = 0
+        self.disconnects = 0
+        self.latency = collections.deque(maxlen=10000)
+        self.interval = []              # cleared by every report
+        self.interval_n = 0
+        self.interval_sum = 0.0
+        self.interval_sum2 = 0.0
+        self.interval_max = 0.0
+
+    # viewer callbacks of TronClient
+    def new_arena(self):
+        pass
+
+    def end_round(self, winner):
+        self.rounds += 1
+        self.turn_sent = None
+        self.last_frame = None
+        self.client.ready_to_end = True
+
+    def me(self):
+        arena = self.client.arena
+        if arena.I_am_player is None or arena.player is None:
+            return None
+        return arena.player[arena.I_am_player]
+
+    def position_received(self):
+        now = time.monotonic()
+        self.frames += 1
+        if self.last_frame is not None:
+            dt = now - self.last_frame
+            self.interval.append(dt)
+            self.interval_n += 1
+            self.interval_sum += dt
+            self.interval_sum2 += dt * dt
+            self.interval_max = max(self.interval_max, dt)
+        self.last_frame = now
+
+        # A turn shows up as the first frame in which our own trail
+        # changes direction.
+        p = self.me()
+        if self.turn_sent is not None and p is not None \
+                and (p.dx, p.dy) != self.turn_dir:
+            self.latency.append(now - self.turn_sent)
+            self.turn_sent = None
+
+    def send_move(self, now):
+        move = random.choice(MOVES)
+        p = self.me()
+        if move in "LR" and self.turn_sent is None and p is not None:
+            self.turn_sent = now
+            self.turn_dir = (p.dx, p.dy)
+        self.client.send_move(move)
+
+    def update_socket(self, sel):
+        conn = self.client.conn
+        sock = conn.sock if conn is not None else None
+        if sock is self.sock:
+            return
+        if self.sock is not None:
+            try:
+                sel.unregister(self.sock)
+            except (KeyError, ValueError):
+                pass
+        self.sock = sock
+        if sock is not None:
+            sel.register(sock, selectors.EVENT_READ, self)
+
+    def run_client(self, sel):
+        was_connected = not self.client.not_connected()
+        self.client.run()
+        if was_connected and self.client.not_connected():
+            self.disconnects += 1
+            self.turn_sent = None
+            self.last_frame = None
+            self.reconnect_at = time.monotonic() + 1.0
+        self.update_socket(sel)
+
+    def tick(self, sel, now):
+        client = self.client
+        if client.host is None:
+            if now < self.reconnect_at:
+                return
+            client.connect(self.host, self.port, self.name)
+            self.connects += 1
+
+        # States that make progress without anything to read
+        if client.state in (TronClient.State.NOT_CONNECTED,
+                            TronClient.State.CONNECTED,
+                            TronClient.State.ERR_SERVER_CONNECTION,
+                            TronClient.State.ERR_NOT_TRON_SERVER,
+                            TronClient.State.ERR_CONNECTION_LOST,
+                            TronClient.State.RECEIVED_END,
+                            TronClient.State.RESUMING):
+            self.run_client(sel)
+            if client.state == TronClient.State.ERR_SERVER_CONNECTION:
+                self.reconnect_at = now + 1.0
+        elif client.sim is not None:
+            # Lockstep clients simulate on their own clock
+            self.run_client(sel)
+        elif client.received_go() and not self.go_sent:
+            self.go_sent = True
+            client.ready_to_go = True
+            self.run_client(sel)
+        if not client.received_go():
+            self.go_sent = False
+
+        if client.game_is_on():
+            if self.next_move is None:
+                self.next_move = now + random.expovariate(self.rate)
+            elif now >= self.next_move:
+                self.send_move(now)
+                self.next_move = now + random.expovariate(self.rate)
+        else:
+            self.next_move = None
+
+    def readable(self, sel):
+        # Woken as the data arrived, not at the next frame
+        if self.client.conn is not None:
+            self.client.conn.last_empty = None
+        self.run_client(sel)
+        for i in range(MAX_LINES_PER_WAKEUP):
+            conn = self.client.conn
+            if conn is None or len(conn.lines) == 0:
+                break
+            self.run_client(sel)
+
+class Swarm:
+
+    def __init__(self, targets, num_bots, rate, ramp):
+        self.sel = selectors.DefaultSelector()
+        self.bots = []
+        self.ramp = ramp
+        for i in range(num_bots):
+            host, port = targets[i % len(targets)]
+            self.bots.append(Bot(i, host, port, rate))
+        self.started = None
+        self.last_report = None
+        self.last_frames = 0
+
+    def active_bots(self, now):
+        if self.ramp <= 0:
+            return self.bots
+        n = int((now - self.started) * self.ramp) + 1
+        return self.bots[:n]
+
+    def run(self, duration, report):
+        self.started = self.last_report = time.monotonic()
+        while True:
+            now = time.monotonic()
+            if duration > 0 and now - self.started >= duration:
+                break
+            for bot in self.active_bots(now):
+                bot.tick(self.sel, now)
+            for key, _ in self.sel.select(timeout=1 / FPS):
+                key.data.readable(self.sel)
+            if now - self.last_report >= report:
+                self.report(now)
+
+    def report(self, now):
+        elapsed = now - self.last_report
+        self.last_report = now
+
+        interval, latency = [], []
+        frames = 0
+        for bot in self.bots:
+            interval.extend(bot.interval)
+            bot.interval = []
+            latency.extend(bot.latency)
+            frames += bot.frames
+
+        in_game = sum(bot.client.game_is_on() for bot in self.bots)
+        connected = sum(not bot.client.not_connected() for bot in self.bots)
+        disconnects = sum(bot.disconnects for bot in self.bots)
+        fps = (frames - self.last_frames) / elapsed
+        self.last_frames = frames
+
+        jitter = float("nan")
+        if len(interval) > 1:
+            mean = sum(interval) / len(interval)
+            jitter = math.sqrt(sum((x - mean) ** 2 for x in interval)
+                               / (len(interval) - 1))
+
+        print(f"[{now - self.started:7.1f}s] "
+              f"bots {connected}/{len(self.bots)} in game {in_game}  "
+              f"frames/s {fps:8.1f}  "
+              f"tick p50 {ms(percentile(interval, 50)):6.1f}ms "
+              f"p99 {ms(percentile(interval, 99)):6.1f}ms "
+              f"jitter {ms(jitter):5.1f}ms  "
+              f"turn p50 {ms(percentile(latency, 50)):6.1f}ms "
+              f"p95 {ms(percentile(latency, 95)):6.1f}ms  "
+              f"disconnects {disconnects}", flush=True)
+
+    def summary(self, csv_file):
+        print()
+        print("bot     host                   frames rounds disc "
+              "tick mean  jitter  tick max  turn p50  turn max")
+        rows = []
+        for bot in self.bots:
+            n = bot.interval_n
+            mean = jitter = float("nan")
+            if n > 0:
+                mean = bot.interval_sum / n
+            if n > 1:
+                jitter = math.sqrt(max(0.0, (bot.interval_sum2
+                                             - n * mean * mean) / (n - 1)))
+            row = (bot.name, f"{bot.host}:{bot.port}", bot.frames,
+                   bot.rounds, bot.disconnects, ms(mean), ms(jitter),
+                   ms(bot.interval_max),
+                   ms(percentile(bot.latency, 50)),
+                   ms(max(bot.latency, default=float("nan"))))
+            rows.append(row)
+            print(f"{row[0]:7s} {row[1]:21s} {row[2]:7d} {row[3]:6d} "
+                  f"{row[4]:4d} {row[5]:8.1f}ms {row[6]:5.1f}ms "
+                  f"{row[7]:7.1f}ms {row[8]:7.1f}ms {row[9]:7.1f}ms")
+
+        if csv_file is not None:
+            with open(csv_file, "w") as f:
+                f.write("bot,server,frames,rounds,disconnects,"
+                        "tick_mean_ms,tick_jitter_ms,tick_max_ms,"
+                        "turn_p50_ms,turn_max_ms\n")
+                for row in rows:
+                    f.write(",".join(str(x) for x in row) + "\n")
+            print(f"Per-bot statistics written to {csv_file}")
+
+def parse_target(target):
+    host, _, port = target.partition(":")
+    return (host or "localhost", int(port) if port else PORT)
+
+def main(argv):
+    parser = argparse.ArgumentParser(
+            prog=argv[0],
+            description="Headless TRON bot swarm for load testing servers.")
+    parser.add_argument("servers", nargs="*", default=["localhost"],
+                        help="servers (rooms) as HOST[:PORT]; bots are "
+                             "distributed round robin, so use as many bots "
+                             "as the servers have player slots")
+    parser.add_argument("-n", "--bots", type=int, default=100,
+                        help="number of bots (default 100)")
+    parser.add_argument("-r", "--rate", type=float, default=1.0,
+                        help="moves per second and bot (default 1.0)")
+    parser.add_argument("-d", "--duration", type=float, default=0,
+                        help="seconds to run, 0 runs until ^C (default)")
+    parser.add_argument("--ramp", type=float, default=50,
+                        help="bots started per second, 0 starts all at "
+                             "once (default 50)")
+    parser.add_argument("--report", type=float, default=5,
+                        help="seconds between reports (default 5)")
+    parser.add_argument("--csv", help="write per-bot statistics to file")
+    args = parser.parse_args(argv[1:])
+
+    targets = [parse_target(t) for t in args.servers]
+    swarm = Swarm(targets, args.bots, args.rate, args.ramp)
+    print(f"Starting {args.bots} bots on {len(targets)} server(s), "
+          f"{args.rate} moves/s each")
+    try:
+        swarm.run(args.duration, args.report)
+    except KeyboardInterrupt:
+        pass
+    swarm.report(time.monotonic())
+    swarm.summary(args.csv)
+
+main(sys.argv)
@@ -0,0 +1,58 @@
+import argparse
+import sys
+import time
+
+from tron_record import read_rounds
+from tron_record import simulate
+
+def main(argv):
+    parser = argparse.ArgumentParser(
+            prog=argv[0],
+            description="Re-simulate recorded TRON rounds at unlimited "
+                        "speed. To watch a recording in a client, start "
+                        "new-tron-server.py with --replay.")
+    parser.add_argument("recording")
+    parser.add_argument("--round", type=int,
+                        help="only re-simulate this round (counting from 0)")
+    parser.add_argument("--dump", action="store_true",
+                        help="print every message the server broadcast")
+    args = parser.parse_args(argv[1:])
+
+    rounds = read_rounds(args.recording)
+    print(f"{args.recording}: {len(rounds)} rounds")
+
+    mismatches = 0
+    for i, rnd in enumerate(rounds):
+        if args.round is not None and i != args.round:
+            continue
+
+        start = time.perf_counter()
+        winner, ticks = None, 0
+        for arena, msgs in simulate(rnd):
+            ticks += 1
+            for msg in msgs:
+                if args.dump:
+                    print(msg, end="")
+                if msg[0] == "E":
+                    winner = int(msg.split()[1])
+        elapsed = time.perf_counter() - start
+
+        if rnd.winner is None:
+            result = "incomplete"
+        elif winner == rnd.winner:
+            result = "ok"
+        else:
+            result = f"MISMATCH (recorded winner {rnd.winner})"
+            mismatches += 1
+
+        names = ", ".join(rnd.names)
+        speedup = rnd.duration() / elapsed if elapsed > 0 else float("inf")
+        print(f"round {i}: {rnd.width}x{rnd.height} [{names}] "
+              f"{ticks} ticks, {rnd.duration():.1f}s game time "
+              f"in {elapsed * 1000:.1f}ms ({speedup:.0f}x), "
+              f"winner {winner}: {result}")
+
+    if mismatches > 0:
+        sys.exit(1)
+
+main(sys.argv)
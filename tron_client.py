@@ -1,71 +1,113 @@
+import codecs
+import collections
 import select
 import socket
 import time
 import random
 import threading
+import tron_model
 
 from enum import Enum, auto
+from tron_record import apply_move
 
-def get_local_subnet():
-    try:
-        s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-        s.connect(("8.8.8.8", 80))
-        local_ip = s.getsockname()[0]
-        s.close()
-        subnet = ".".join(local_ip.split(".")[:3]) + "."
-        return subnet
-    except:
-        return "192.168.0."
+ANNOUNCE_PORT = 65433
+
+RECV_SIZE = 65536
+
+RESUME_TIMEOUT = 10.0           # try this long to get back into a round
+RESUME_RETRY = 1.0
+
+TRIM_EPSILON = 1e-6              # left of a segment the server used up
 
 class ServerScanner:
 
-    def __init__(self, timeout=0.2, port=65432):
-        self.timeout = timeout
+    def __init__(self, ttl=3.0, port=ANNOUNCE_PORT):
+        self.ttl = ttl
         self.port = port
-        self.found = []
+        self.found = {}
         self.search_done = None
         self._lock = threading.Lock()
-        self.start_scan()
 
     def start_scan(self):
         with self._lock:
-            if self.search_done is None or self.search_done:
-                print("Scanning for servers in local network")
+            if self.search_done is None:
+                print("Listening for TRON servers in local network")
                 self.search_done = False
                 self._thread = threading.Thread(target=self._scan,
                                                 daemon=True)
                 self._thread.start()
 
     def _scan(self):
-        test_ips = ["127.0.0.1"]
-        base_ip = get_local_subnet()
-        test_ips.extend(base_ip + str(i) for i in range(1, 255))
-
-        print(f"Scanning {base_ip}0/24 and "
-              f"localhost on port {self.port}...")
+        try:
+            s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            if hasattr(socket, "SO_REUSEPORT"):
+                s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+            s.bind(("", self.port))
+            s.settimeout(0.5)
+        except OSError as e:
+            print(f"Can not listen on port {self.port}: "
+                  f"{type(e).__name__} – {e}")
+            self.search_completed(True)
+            return
 
-        for ip in test_ips:
-            try:
-                with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
-                    s.settimeout(self.timeout)
-                    s.connect((ip, self.port))
-                    banner = s.recv(16).decode("utf-8").strip()
-                    if banner == "TRON":
-                        self.add(ip)
-            except (socket.timeout, ConnectionRefusedError, OSError):
-                continue
-            except Exception as e:
-                print(f"Error at {ip}: {type(e).__name__} – {e}")
-        self.search_completed(True)
+        # Servers announce themselves every second, so after one TTL
+        # period the table holds every live server.
+        started = time.time()
+        done = False
+        with s:
+            while True:
+                try:
+                    data, (ip, _) = s.recvfrom(256)
+                    self.parse(ip, data.decode("utf-8"))
+                except socket.timeout:
+                    pass
+                except (OSError, UnicodeDecodeError) as e:
+                    print(f"Error in server scan: {type(e).__name__} – {e}")
+                if not done and time.time() - started >= self.ttl:
+                    done = self.search_completed(True)
+
+    def parse(self, ip, msg):
+        msg = msg.split()
+        if len(msg) != 7 or msg[0] != "TRON":
+            return
+        try:
+            info = {
+                "name": msg[1],
+                "port": int(msg[2]),
+                "width": int(msg[3]),
+                "height": int(msg[4]),
+                "free": int(msg[5]),
+                "state": msg[6],
+            }
+        except ValueError:
+            return
+        self.add(ip, info)
 
-    def add(self, ip):
+    def add(self, ip, info):
         with self._lock:
-            if ip not in self.found:
-                self.found.append(ip)
+            if ip in self.found:
+                self.found[ip] = (self.found[ip][0], time.time(), info)
+            else:
+                self.found[ip] = (time.time(), time.time(), info)
+
+    def expire(self):
+        now = time.time()
+        for ip in [ip for ip, (_, seen, _) in self.found.items()
+                   if now - seen > self.ttl]:
+            del self.found[ip]
 
     def get_found(self):
         with self._lock:
-            return list(self.found)
+            self.expire()
+            return sorted(self.found, key=lambda ip: self.found[ip][0])
+
+    def get_info(self, ip):
+        with self._lock:
+            self.expire()
+            if ip not in self.found:
+                return None
+            return dict(self.found[ip][2])
 
     def search_completed(self, done = None):
         with self._lock:
@@ -75,8 +117,17 @@ class ServerScanner:
 
 class TronClientConnection:
     def __init__(self, ip, port):
-        self.buffer = ""
+        self.buffer = ""                # incomplete last line
+        self.lines = collections.deque()
+        self.decoder = codecs.getincrementaldecoder("utf-8")()
+        self.last_empty = None          # time.monotonic() nothing was there
         self.line_ready = False
+        self.received = 0               # lines, for the profiler
+        # As measured by the server, in seconds. The offset is the own
+        # clock minus the server's.
+        self.rtt = None
+        self.jitter = None
+        self.offset = None
         self.ip = ip
         self.port = port
         self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
@@ -105,22 +156,56 @@ class TronClientConnection:
             print("Unexpected error in send():", type(e).__name__, e)
         return False
 
-    def readline(self):
+    # Reads everything that has arrived, so that a client with many
+    # players on the server does not fall behind, and splits it into
+    # lines. PINGs are answered right away, so the round trip does not
+    # include the time until the client gets to the line. The data came
+    # after the socket was last seen empty, assume halfway until now.
+    # Clients woken by the socket instead of polling it clear last_empty.
+    def receive(self):
+        arrived = None
         try:
-            readable, _, _ = select.select([self.sock], [], [], 0)
-            if self.sock in readable:
-                data = self.sock.recv(64)
+            while True:
+                readable, _, _ = select.select([self.sock], [], [], 0)
+                now = time.monotonic()
+                if self.sock not in readable:
+                    self.last_empty = now
+                    break
+                if arrived is None:
+                    since = now if self.last_empty is None \
+                            else self.last_empty
+                    arrived = (since + now) / 2
+                data = self.sock.recv(RECV_SIZE)
                 if not data:
                     print("Disconnected from server.")
-                    return None
-                self.buffer += data.decode("utf-8")
+                    return False
+                self.buffer += self.decoder.decode(data)
         except (BlockingIOError, ConnectionResetError, OSError) as e:
-            print("Error during readline:", type(e).__name__, e)
-            return None
+            print("Error during receive:", type(e).__name__, e)
+            return False
 
         if "\n" in self.buffer:
-            line, self.buffer = self.buffer.split("\n", 1)
-            return line.strip()
+            *lines, self.buffer = self.buffer.split("\n")
+            for line in lines:
+                if line.startswith("PING "):
+                    self.pong(line.split(), arrived or time.monotonic())
+                else:
+                    self.lines.append(line)
+        return True
+
+    def pong(self, fields, arrived):
+        self.send(f"PONG {fields[1]} {arrived:.6f} "
+                  f"{time.monotonic():.6f}\n")
+        if len(fields) == 5 and fields[2] != "-":
+            self.rtt, self.jitter, self.offset = map(float, fields[2:])
+
+    def readline(self):
+        if len(self.lines) == 0 and not self.receive():
+            return None
+
+        if len(self.lines) > 0:
+            self.received += 1
+            return self.lines.popleft().strip()
 
         return ""
 
@@ -137,6 +222,7 @@ class TronClient:
         RECEIVED_GO = auto()
         RECEIVED_START = auto()
         RECEIVED_END = auto()
+        RESUMING = auto()                   # reconnecting during a round
 
     def __init__(self, viewer = None):
         self.state = TronClient.State.NOT_CONNECTED
@@ -145,6 +231,20 @@ class TronClient:
         self.ready_to_end = False
         self.last_state = None
         self.viewer = viewer
+        self.last_position = None       # time.monotonic() of last P
+        self.position_stamp = None      # server's clock of the last P tick
+        self.token = None               # to resume the slot in a round
+        self.resume_until = None
+        self.resume_retry = 0
+
+        # Lockstep: the round is simulated here from the inputs
+        self.sim = None                 # tron_model.Arena
+        self.sim_dt = None
+        self.sim_delay = None
+        self.sim_tick = 0               # ticks simulated
+        self.sim_known = 0              # ticks the server has done
+        self.sim_known_time = None      # time.monotonic() sim_known came
+        self.sim_inputs = {}            # tick -> [(player_index, move)]
 
         ## NOT_CONNECTED -> CONNECTED
         self.host = None                # required
@@ -167,6 +267,7 @@ class TronClient:
             TronClient.State.RECEIVED_GO: self.handle_received_go,
             TronClient.State.RECEIVED_START: self.handle_received_start,
             TronClient.State.RECEIVED_END: self.handle_received_end,
+            TronClient.State.RESUMING: self.handle_resuming,
         }
 
         self.state_msg = {
@@ -190,6 +291,8 @@ class TronClient:
                 lambda: f"Game on!",
             TronClient.State.RECEIVED_END:
                 lambda: f"That’s it for this round!",
+            TronClient.State.RESUMING:
+                lambda: f"Connection lost, reconnecting to {self.host}",
         }
 
     def get_state_msg(self):
@@ -224,10 +327,28 @@ class TronClient:
         if self.state != TronClient.State.RECEIVED_START:
             return False
         if not self.conn.send(move):
-            self.state = TronClient.State.ERR_CONNECTION_LOST
+            self.state = self.connection_lost()
             return False
         return True
 
+    # During a round the server keeps the slot of a lost player, so try
+    # to get it back instead of giving up.
+    def connection_lost(self):
+        if self.token is None or self.state != TronClient.State.RECEIVED_START:
+            return TronClient.State.ERR_CONNECTION_LOST
+        self.conn = None
+        self.resume_until = time.monotonic() + RESUME_TIMEOUT
+        self.resume_retry = 0
+        return TronClient.State.RESUMING
+
+    # How long ago the server did the tick of the latest positions, on the
+    # own clock. Known once the server measured the clock offset.
+    def position_age(self):
+        if self.position_stamp is None or self.conn is None \
+                or self.conn.offset is None:
+            return None
+        return time.monotonic() - (self.position_stamp + self.conn.offset)
+
     def connect(self, host, port, name):
         self.host = host
         self.port = port
@@ -302,6 +423,7 @@ class TronClient:
             return False
         elif line[0] == "ID":
             self.arena.I_am_player = int(line[1])
+            self.token = line[2] if len(line) > 2 else None
             self.state = TronClient.State.WAITING_FOR_GO
             return True
         return False
@@ -316,12 +438,13 @@ class TronClient:
         line = line.split()
         if len(line) == 0:
             return False
-        print(f"{line}")
         if line[0] == "GO":
             self.state = TronClient.State.RECEIVED_GO
             return True
         elif line[0] == "ARENA":
-            self.arena.set_dim(int(line[1]), int(line[2]), int(line[3]))
+            max_trail = float(line[4]) if len(line) > 4 else None
+            self.arena.set_dim(int(line[1]), int(line[2]), int(line[3]),
+                               max_trail)
             if self.viewer is not None:
                 self.viewer.new_arena()
         elif line[0] == "NAME":
@@ -345,7 +468,6 @@ class TronClient:
         line = line.split()
         if len(line) == 0:
             return False
-        print(f"{line}")
         if line[0] == "START":
             self.state = TronClient.State.RECEIVED_START
             return True
@@ -357,28 +479,112 @@ class TronClient:
     def handle_received_start(self):
         assert self.state == TronClient.State.RECEIVED_START
 
-        MAX_POSITION_READS = 42
-        for i in range(MAX_POSITION_READS):
+        # Everything that has arrived, however many players there are
+        while True:
             line = self.conn.readline()
             if line is None:
-                self.state = TronClient.State.ERR_CONNECTION_LOST
+                self.state = self.connection_lost()
                 return True
             line = line.split()
             if len(line) == 0:
-                return False
+                break
             if line[0] == "P":
-                self.arena.set_position(line[1:])
+                self.arena.set_position(line[2:])
+                self.last_position = time.monotonic()
+                self.position_stamp = float(line[1])
+            elif line[0] == "Q":
+                self.arena.update_positions(line[2:])
+                self.last_position = time.monotonic()
+                self.position_stamp = float(line[1])
+            elif line[0] == "T":
+                self.arena.turn_player(line[1:])
+            elif line[0] == "I":
+                tick = int(line[1])
+                self.server_tick(tick - self.sim_delay)
+                self.sim_inputs.setdefault(tick, []).extend(
+                        (int(i), move)
+                        for i, move in zip(line[2::2], line[3::2]))
+            elif line[0] == "K":
+                self.server_tick(int(line[1]))
+            elif line[0] == "LOCKSTEP":
+                self.start_lockstep(line[1:])
             elif line[0] == "D":
                 self.arena.del_player(int(line[1]))
             elif line[0] == "E":
+                self.sim = None
+                self.position_stamp = None
                 self.arena.end_round(int(line[1]))
                 if self.viewer is not None:
                     self.viewer.end_round(int(line[1]))
                 self.state = TronClient.State.RECEIVED_END
                 return True
 
+        if self.sim is not None:
+            self.run_lockstep()
         return False
 
+    def start_lockstep(self, fields):
+        arena = self.arena
+        self.sim_dt = float(fields[0])
+        self.sim_delay = int(fields[1])
+        tick = int(fields[2])
+        self.sim_inputs = {}
+        for t, i, move in zip(fields[3::3], fields[4::3], fields[5::3]):
+            self.sim_inputs.setdefault(int(t), []).append((int(i), move))
+        player = [tron_model.PlayerModel(*start) for start in
+                  tron_model.spawn_positions(arena.width, arena.height,
+                                             len(arena.player))]
+        self.sim = tron_model.Arena(arena.width, arena.height, player,
+                                    arena.max_trail)
+        self.sim_tick = 0
+        self.sim_known = tick
+        self.sim_known_time = time.monotonic()
+
+        # When resuming, catch up with the server and take the exact
+        # trails from the simulation
+        self.step_lockstep(tick)
+        self.sim.msg_queue.clear()
+        for i, p in enumerate(self.sim.player):
+            if p.alive:
+                arena.add_player(i, arena.name[i])
+                arena.player[i].load_path(self.sim.path[i], (p.dx, p.dy))
+            else:
+                arena.del_player(i)
+
+    def step_lockstep(self, target):
+        while self.sim_tick < target:
+            for i, move in self.sim_inputs.pop(self.sim_tick, []):
+                apply_move(self.sim.player[i], move)
+            self.sim.move_player(self.sim_dt)
+            self.sim_tick += 1
+
+    def server_tick(self, tick):
+        if tick > self.sim_known:
+            self.sim_known = tick
+            self.sim_known_time = time.monotonic()
+
+    # Simulates as far as the server probably is by now, judging from the
+    # last tick it told about, but only ticks whose inputs are all known.
+    # Turns and positions go into the arena tick by tick, as if the server
+    # had sent them.
+    def run_lockstep(self):
+        elapsed = time.monotonic() - self.sim_known_time
+        target = self.sim_known + min(int(elapsed / self.sim_dt),
+                                      self.sim_delay)
+        while self.sim_tick < target:
+            self.step_lockstep(self.sim_tick + 1)
+            while self.sim.msg_queue:
+                line = self.sim.msg_queue.popleft().split()
+                if line[0] == "T":
+                    self.arena.turn_player(line[1:])
+                elif line[0] == "D":
+                    self.arena.del_player(int(line[1]))
+            pos_list = []
+            for p in self.sim.player:
+                pos_list += [p.x, p.y]
+            self.arena.set_position(pos_list)
+            self.last_position = time.monotonic()
+
     def handle_received_end(self):
         assert self.state == TronClient.State.RECEIVED_END
 
@@ -390,10 +596,51 @@ class TronClient:
 
             self.state = TronClient.State.WAITING_FOR_GO
             return True
+
+        # Keep answering PINGs
+        if not self.conn.receive():
+            self.state = TronClient.State.ERR_CONNECTION_LOST
+            return True
         return False
 
-def sign(x):
-    return (x > 0) - (x < 0)
+    def handle_resuming(self):
+        assert self.state == TronClient.State.RESUMING
+
+        now = time.monotonic()
+        if now > self.resume_until:
+            self.token = None
+            self.state = TronClient.State.ERR_CONNECTION_LOST
+            return True
+
+        if self.conn is None:
+            if now < self.resume_retry:
+                return False
+            self.resume_retry = now + RESUME_RETRY
+            try:
+                self.conn = TronClientConnection(self.host, self.port)
+            except OSError:
+                return False
+
+        # After the banner the server expects the token and answers with
+        # a snapshot of the round, or closes the connection.
+        line = self.conn.readline()
+        if line is None:
+            self.conn = None
+            return False
+        line = line.split()
+        if len(line) == 0:
+            return False
+        if line[0] == "TRON":
+            if not self.conn.send(f"RESUME {self.token}\n"):
+                self.conn = None
+        elif line[0] == "SNAPSHOT":
+            self.arena.load_snapshot(line[1:])
+            if self.viewer is not None:
+                self.viewer.new_arena()
+            self.last_position = time.monotonic()
+            self.state = TronClient.State.RECEIVED_START
+            return True
+        return False
 
 def angle_between(u, v):
     if u[0] == v[0] and u[1] == v[1]:
@@ -409,8 +656,10 @@ def angle_between(u, v):
         raise ValueError("Only special cases are handled")
 
 class Player:
-    def __init__(self):
+    def __init__(self, max_trail = None):
         self.path = None
+        self.max_trail = max_trail
+        self.tail = 0                   # points dropped from the front
         self.x, self.y = None, None
         self.dx, self.dy = 0, -1
         self.angle = 0
@@ -427,25 +676,54 @@ class Player:
             self.angle_turn += ANGLE_STEP
         return self.angle
 
+    # Only moves the head, the corners come with turn().
     def set_position(self, x, y):
-        self.x, self.y = x, y
         if self.path is None:
             self.path = [ (x, y), (x, y) ]
+            self.x, self.y = x, y
 
-        last_x, last_y = self.path[-1]
-        dx = sign(self.x - last_x)
-        dy = sign(self.y - last_y)
-
-        if dx == 0 and dy == 0:
-            return
+        self.x, self.y = x, y
+        self.path[-1] = (x, y)
+        if self.max_trail is not None:
+            self.trim()
 
-        if dx == self.dx and dy == self.dy:
-            self.path[-1] = (self.x, self.y)
+    # The server tells where the path bends. The first turn of a round is
+    # the start position and heading.
+    def turn(self, x, y, dx, dy):
+        if self.path is None:
+            self.path = [ (x, y), (x, y) ]
+            self.angle = angle_between((0, -1), (dx, dy))
         else:
-            self.path.append((self.x, self.y))
+            self.path[-1] = (x, y)
+            self.path.append((x, y))
             self.angle_turn += angle_between((self.dx, self.dy), (dx, dy))
-            self.dx = dx
-            self.dy = dy
+        self.x, self.y = x, y
+        self.dx, self.dy = dx, dy
+
+    # Same as tron_model.Arena.trim_path: drop segments at the front and
+    # shorten the oldest one until the trail is max_trail long. Positions
+    # come rounded, so the length is measured on the path each time
+    # instead of summed up move by move. The last segment always stays.
+    def trim(self):
+        length = sum(abs(x1 - x0) + abs(y1 - y0) for (x0, y0), (x1, y1)
+                     in zip(self.path, self.path[1:]))
+        while length > self.max_trail:
+            (x0, y0), (x1, y1) = self.path[0], self.path[1]
+            first = abs(x1 - x0) + abs(y1 - y0)
+            excess = length - self.max_trail
+            if first > excess + TRIM_EPSILON or len(self.path) == 2:
+                t = min(excess / first, 1) if first > 0 else 0
+                self.path[0] = (x0 + (x1 - x0) * t, y0 + (y1 - y0) * t)
+                break
+            del self.path[0]
+            self.tail += 1
+            length -= first
+
+    def load_path(self, path, heading):
+        self.path = list(path)
+        self.x, self.y = self.path[-1]
+        self.dx, self.dy = heading
+        self.angle = angle_between((0, -1), (self.dx, self.dy))
 
 class Arena:
 
@@ -457,9 +735,11 @@ class Arena:
         self.ready = None
         self.ready = None
         self.I_am_player = None
+        self.max_trail = None
 
-    def set_dim(self, width, height, num_players):
+    def set_dim(self, width, height, num_players, max_trail = None):
         self.width, self.height = width, height
+        self.max_trail = max_trail
         if self.player is None or len(self.player) != num_players:
             self.player = [None] * num_players
             self.name = [None] * num_players
@@ -467,7 +747,7 @@ class Arena:
             self.ready = [False] * num_players
 
     def add_player(self, player_index, player_name):
-        self.player[player_index] = Player()
+        self.player[player_index] = Player(self.max_trail)
         if self.name[player_index] != player_name:
             self.name[player_index] = player_name
             self.score[player_index] = 0
@@ -488,6 +768,40 @@ class Arena:
                 p.set_position(float(pos_list[2 * i]),
                                float(pos_list[2 * i + 1]))
 
+    def load_snapshot(self, fields):
+        width, height, n = int(fields[0]), int(fields[1]), int(fields[2])
+        max_trail = None if fields[3] == "-" else float(fields[3])
+        self.set_dim(width, height, n, max_trail)
+        k = 4
+        for i in range(n):
+            name, score, alive, dx, dy, length = fields[k:k + 6]
+            k += 6
+            path = [(float(fields[k + 2 * j]), float(fields[k + 2 * j + 1]))
+                    for j in range(int(length))]
+            k += 2 * int(length)
+            self.add_player(i, name)
+            self.score[i] = int(score)
+            self.ready[i] = True
+            if alive == "1":
+                self.player[i].load_path(path, (int(dx), int(dy)))
+            else:
+                self.del_player(i)
+
+    # A turn event "T i x y dx dy", without the T
+    def turn_player(self, fields):
+        p = self.player[int(fields[0])]
+        if p is not None:
+            p.turn(float(fields[1]), float(fields[2]),
+                   int(fields[3]), int(fields[4]))
+
+    # Positions of some players only, as triples of index, x and y
+    def update_positions(self, update_list):
+        for k in range(0, len(update_list), 3):
+            p = self.player[int(update_list[k])]
+            if p is not None:
+                p.set_position(float(update_list[k + 1]),
+                               float(update_list[k + 2]))
+
     def print(self):
         if self.player is None:
             return
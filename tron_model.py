@@ -0,0 +1,327 @@
+import collections
+import math
+
+SPEED = (0.1, 0.3, 0.7, 0.9, 1.0, 1.1, 1.3, 1.7, 2.5, 4.1)
+SPEED_INITIAL = 4
+
+CELL_SIZE = 64                  # of the spatial hash for collision tests
+
+def on_segment(p, q, r):
+    return min(p[0], r[0]) <= q[0] <= max(p[0], r[0]) and \
+           min(p[1], r[1]) <= q[1] <= max(p[1], r[1])
+
+def orientation(p, q, r):
+    val = (q[1] - p[1]) * (r[0] - q[0]) - \
+          (q[0] - p[0]) * (r[1] - q[1])
+    if abs(val) < 1e-9:
+        return 0
+    return 1 if val > 0 else 2
+
+def segments_intersect(p1, q1, p2, q2):
+    o1 = orientation(p1, q1, p2)
+    o2 = orientation(p1, q1, q2)
+    o3 = orientation(p2, q2, p1)
+    o4 = orientation(p2, q2, q1)
+
+    if o1 != o2 and o3 != o4:
+        return True
+
+    if o1 == 0 and on_segment(p1, p2, q1): return True
+    if o2 == 0 and on_segment(p1, q2, q1): return True
+    if o3 == 0 and on_segment(p2, p1, q2): return True
+    if o4 == 0 and on_segment(p2, q1, q2): return True
+    return False
+
+# Start positions and headings. Up to four players get the classic layout.
+# For more, every player gets a lane of its own: lanes are spread evenly
+# over the width and grouped into columns of k = ceil(sqrt(n)) players.
+# Within a column the start heights are staggered, neighbouring columns
+# drive in opposite directions.
+def spawn_positions(width, height, num_players):
+    if num_players <= 4:
+        return [
+            (width // 3 * 1, height // 2, 1, 0),
+            (width // 3 * 2, height // 2, -1, 0),
+            (width // 2, height // 3 * 1, 0, 1),
+            (width // 2, height // 3 * 2, 0, -1),
+        ][:num_players]
+
+    k = math.ceil(math.sqrt(num_players))
+    spawns = []
+    for i in range(num_players):
+        column, row = divmod(i, k)
+        x = (i + 0.5) * width / num_players
+        y = (row + 0.5) * height / k
+        dy = 1 if column % 2 == 0 else -1
+        # Start in the half of the arena the cycle drives away from
+        y = y / 2 if dy == 1 else height - y / 2
+        spawns.append((round(x), round(y), 0, dy))
+    return spawns
+
+class Arena:
+    def __init__(self, width, height, player, max_trail = None):
+        self.width = width
+        self.height = height
+        self.max_trail = max_trail      # None: trails grow without limit
+        self.running = True
+        self.player = player
+        self.num_alive = len(self.player)
+        # Paths are ring buffers: with max_trail, the oldest points drop
+        # out at the front while the cycle extends the path at the end.
+        self.path = []
+        self.tail = []                  # points dropped from the front
+        self.trail_length = []
+        self.msg_queue = collections.deque()
+        # Spatial hash: cell -> [(player_id, segment number), ...] where
+        # segments are numbered from the start of the round. Entries of
+        # dead players are left behind, path lookups skip them.
+        self.cells = collections.defaultdict(list)
+        self.ranges = []                # per player: cell range per segment
+        # for debugging
+        self.last_pos = []
+        for i, p in enumerate(self.player):
+            p.set_arena(self, i)
+            self.path.append(collections.deque([(p.x, p.y), (p.x, p.y)]))
+            self.tail.append(0)
+            self.trail_length.append(0)
+            self.ranges.append(collections.deque())
+            self.index_segment(i)
+            self.last_pos.append([p.x, p.y])
+            self.queue_turn(i, p.x, p.y)
+
+    def extend_path(self, player_id, x, y):
+        if not self.player[player_id].alive:
+            return
+        self.path[player_id].append((x, y))
+        self.index_segment(player_id)
+        self.queue_turn(player_id, x, y)
+
+    # Tells the clients where a path bends and where it heads from there:
+    # "T i x y dx dy". At the start of a round this is the start position.
+    def queue_turn(self, player_id, x, y):
+        p = self.player[player_id]
+        self.msg_queue.append(f"T {player_id} {x:.2f} {y:.2f} "
+                              f"{p.dx} {p.dy}\n")
+
+    def cell_range(self, x0, y0, x1, y1):
+        return (math.floor(min(x0, x1) / CELL_SIZE),
+                math.floor(min(y0, y1) / CELL_SIZE),
+                math.floor(max(x0, x1) / CELL_SIZE),
+                math.floor(max(y0, y1) / CELL_SIZE))
+
+    # Adds the cells the last segment of a path covers by now. Segments
+    # grow at their end, trim_path takes care of the front.
+    def index_segment(self, player_id):
+        path = self.path[player_id]
+        ranges = self.ranges[player_id]
+        i = self.tail[player_id] + len(path) - 2
+        cx0, cy0, cx1, cy1 = self.cell_range(*path[-2], *path[-1])
+        old = ranges[-1] if len(ranges) == len(path) - 1 else None
+        for cx in range(cx0, cx1 + 1):
+            for cy in range(cy0, cy1 + 1):
+                if old is not None and old[0] <= cx <= old[2] \
+                        and old[1] <= cy <= old[3]:
+                    continue
+                self.cells[(cx, cy)].append((player_id, i))
+        if old is None:
+            ranges.append((cx0, cy0, cx1, cy1))
+        else:
+            ranges[-1] = (cx0, cy0, cx1, cy1)
+
+    # Cuts the path at the front until it is at most max_trail long. Whole
+    # segments leave the ring buffer and the spatial hash, the oldest
+    # remaining one gets shorter and leaves the cells it no longer covers.
+    def trim_path(self, player_id):
+        path = self.path[player_id]
+        ranges = self.ranges[player_id]
+        while self.trail_length[player_id] > self.max_trail:
+            (x0, y0), (x1, y1) = path[0], path[1]
+            first = abs(x1 - x0) + abs(y1 - y0)
+            excess = self.trail_length[player_id] - self.max_trail
+            entry = (player_id, self.tail[player_id])
+            cx0, cy0, cx1, cy1 = ranges[0]
+            if first > excess:
+                t = excess / first
+                path[0] = (x0 + (x1 - x0) * t, y0 + (y1 - y0) * t)
+                self.trail_length[player_id] -= excess
+                kept = self.cell_range(*path[0], *path[1])
+                for cx in range(cx0, cx1 + 1):
+                    for cy in range(cy0, cy1 + 1):
+                        if not (kept[0] <= cx <= kept[2]
+                                and kept[1] <= cy <= kept[3]):
+                            self.cells[(cx, cy)].remove(entry)
+                ranges[0] = kept
+                break
+            ranges.popleft()
+            for cx in range(cx0, cx1 + 1):
+                for cy in range(cy0, cy1 + 1):
+                    self.cells[(cx, cy)].remove(entry)
+            path.popleft()
+            self.tail[player_id] += 1
+            self.trail_length[player_id] -= first
+
+    def collission(self, player_id, x0, y0, x, y):
+        if x <= 0 or y <= 0 or x >= self.width - 1 or y >= self.height - 1:
+            return True
+        # Only segments sharing a cell with the move are tested. The last
+        # two segments of the own path always touch the cycle.
+        cx0, cy0, cx1, cy1 = self.cell_range(x0, y0, x, y)
+        tested = set()
+        for cx in range(cx0, cx1 + 1):
+            for cy in range(cy0, cy1 + 1):
+                for entry in self.cells.get((cx, cy), ()):
+                    if entry in tested:
+                        continue
+                    tested.add(entry)
+                    path_index, i = entry
+                    path = self.path[path_index]
+                    i -= self.tail[path_index]
+                    skip_last = 3 if path_index == player_id else 1
+                    if i < 0 or i >= len(path) - skip_last:
+                        continue
+                    if segments_intersect((x0, y0), (x, y),
+                                          path[i], path[i+1]):
+                        return True
+        return False
+
+    def move_player(self, dt):
+        kill = []
+        for i, p in enumerate(self.player):
+            if not p.alive:
+                continue
+            x0, y0 = self.path[i][-1]
+            p.move(dt)
+            self.path[i][-1] = (p.x, p.y)
+            self.index_segment(i)
+            if self.max_trail is not None:
+                self.trail_length[i] += abs(p.x - x0) + abs(p.y - y0)
+                self.trim_path(i)
+            if self.collission(i, x0, y0, p.x, p.y):
+                kill.append((i, p))
+                p.x = max(p.x, 0)
+                p.x = min(p.x, self.width - 1)
+                p.y = max(p.y, 0)
+                p.y = min(p.y, self.height - 1)
+        for i, p in kill:
+            p.alive = False
+            self.path[i] = collections.deque()
+            self.collision = True
+            self.num_alive -= 1
+            self.msg_queue.append(f"D {i}\n")
+
+    # Positions are "P stamp x y ...", where stamp is the time of the tick
+    # on the server's clock.
+    def gen_message(self, stamp = 0.0):
+        if len(self.msg_queue):
+            return (self.msg_queue.popleft(), True)
+        elif self.num_alive > 1:
+            msg = ["P", f"{stamp:.4f}"]
+            for i, p in enumerate(self.player):
+                msg.append(f"{p.x:.2f} {p.y:.2f}")
+
+                if p.x != self.last_pos[i][0] and p.y != self.last_pos[i][1]:
+                    raise RuntimeError(f"Player {i}: last pos "
+                                       f"{self.last_pos[i]} "
+                                       f"new pos {p.x} {p.y}")
+                self.last_pos[i][0] = p.x
+                self.last_pos[i][1] = p.y
+            return (" ".join(msg) + "\n", False)
+        elif self.num_alive <= 1:
+            self.running = False
+            for i, p in enumerate(self.player):
+                if p.alive:
+                    return (f"E {i}\n", False)
+            return (f"E {-1}\n", False)
+        else:
+            return (None, False)
+
+    # Everything a client needs to rejoin a running round, in one line:
+    # "SNAPSHOT width height n max_trail" and per player "name score alive
+    # dx dy k" followed by the k points of its path, the head last. The
+    # heading is as in "T i x y dx dy".
+    def gen_snapshot(self, names, scores):
+        trail = "-" if self.max_trail is None else f"{self.max_trail:g}"
+        msg = [f"SNAPSHOT {self.width} {self.height} {len(self.player)} "
+               f"{trail}"]
+        for i, p in enumerate(self.player):
+            path = self.path[i] if p.alive else ()
+            msg.append(f"{names[i]} {scores[i]} {int(p.alive)} "
+                       f"{p.dx} {p.dy} {len(path)}")
+            msg.extend(f"{x:.2f} {y:.2f}" for x, y in path)
+        return " ".join(msg) + "\n"
+
+    # Position update for some players only: "Q stamp i x y j x y ...".
+    def gen_partial_message(self, player_ids, stamp = 0.0):
+        msg = ["Q", f"{stamp:.4f}"]
+        for i in player_ids:
+            p = self.player[i]
+            msg.append(f"{i} {p.x:.2f} {p.y:.2f}")
+        return " ".join(msg) + "\n"
+
+class InterestGrid:
+
+    # Spatial index over the heads of the living cycles, rebuilt every
+    # tick. near() returns the players within radius of a point, which is
+    # the area of interest of a client whose cycle is there.
+
+    def __init__(self, radius):
+        self.radius = radius
+        self.cells = collections.defaultdict(list)
+
+    def update(self, player):
+        self.cells.clear()
+        for i, p in enumerate(player):
+            if p.alive:
+                self.cells[self.cell(p.x, p.y)].append((i, p))
+
+    def cell(self, x, y):
+        return (math.floor(x / self.radius), math.floor(y / self.radius))
+
+    def near(self, x, y):
+        cx, cy = self.cell(x, y)
+        r2 = self.radius * self.radius
+        found = set()
+        for ix in range(cx - 1, cx + 2):
+            for iy in range(cy - 1, cy + 2):
+                for i, p in self.cells.get((ix, iy), ()):
+                    if (p.x - x) ** 2 + (p.y - y) ** 2 <= r2:
+                        found.add(i)
+        return found
+
+class PlayerModel:
+    def __init__(self, x, y, dx, dy):
+        self.x = x
+        self.y = y
+        self.dx = dx
+        self.dy = dy
+        self.speed = SPEED_INITIAL
+        self.alive = True
+        self.arena = None
+        self.player_id = None
+
+    def set_arena(self, arena, player_id):
+        self.arena = arena
+        self.player_id = player_id
+
+    def rotate_left(self):
+        self.dx, self.dy = self.dy, -self.dx
+        self.arena.extend_path(self.player_id, self.x, self.y)
+
+    def rotate_right(self):
+        self.dx, self.dy = -self.dy, self.dx
+        self.arena.extend_path(self.player_id, self.x, self.y)
+
+    def accelerate(self):
+        if self.speed < len(SPEED) - 1:
+            self.speed += 1
+
+    def decelerate(self):
+        if self.speed > 0:
+            self.speed -= 1
+
+    def move(self, dt):
+        if not self.alive:
+            return
+
+        self.x += self.dx * SPEED[self.speed] * dt * 60
+        self.y += self.dy * SPEED[self.speed] * dt * 60
@@ -0,0 +1,224 @@
+import collections
+import os
+import signal
+import time
+
+class FrameProfiler:
+
+    # Rolling timings of the stages of a client frame for the profiler
+    # overlay. A frame starts with begin_frame(), mark(stage) books the
+    # time since the previous mark on the stage. The overlay text is only
+    # rebuilt a few times per second so that it stays readable.
+
+    STAGES = ["client", "arena", "hud", "input", "flip"]
+
+    def __init__(self, window=120, refresh=0.25):
+        self.enabled = False
+        self.refresh = refresh
+        self.frames = collections.deque(maxlen=window)
+        self.stages = {s: collections.deque(maxlen=window)
+                       for s in FrameProfiler.STAGES}
+        self.current = dict.fromkeys(FrameProfiler.STAGES, 0.0)
+        self.frame_start = None
+        self.last_mark = None
+        self.received = collections.deque(maxlen=window)
+        self.latency = collections.deque(maxlen=window)
+        self.text = []
+        self.text_time = 0
+
+    def toggle(self):
+        self.enabled = not self.enabled
+
+    def begin_frame(self):
+        now = time.perf_counter()
+        if self.frame_start is not None:
+            self.frames.append(now - self.frame_start)
+            for stage, t in self.current.items():
+                self.stages[stage].append(t)
+                self.current[stage] = 0.0
+        self.frame_start = self.last_mark = now
+
+    def mark(self, stage):
+        now = time.perf_counter()
+        self.current[stage] += now - self.last_mark
+        self.last_mark = now
+
+    def input_latency(self, latency):
+        self.latency.append(latency)
+
+    def message_rate(self, tron_client):
+        conn = tron_client.conn
+        received = conn.received if conn is not None else 0
+        now = time.monotonic()
+        if len(self.received) > 0 and received < self.received[-1][1]:
+            self.received.clear()      # new connection
+        self.received.append((now, received))
+        (t0, n0), (t1, n1) = self.received[0], self.received[-1]
+        return (n1 - n0) / (t1 - t0) if t1 > t0 else 0.0
+
+    def get_text(self, tron_client):
+        rate = self.message_rate(tron_client)
+        now = time.monotonic()
+        if now - self.text_time < self.refresh or len(self.frames) == 0:
+            return self.text
+        self.text_time = now
+
+        def ms(values):
+            return (f"{sum(values) / len(values) * 1000:5.1f} "
+                    f"{max(values) * 1000:5.1f}")
+
+        mean = sum(self.frames) / len(self.frames)
+        text = ["        mean   max",
+                f"frame  {ms(self.frames)} ms  {1 / mean:4.0f} fps"]
+        for stage in FrameProfiler.STAGES:
+            text.append(f"{stage:6s} {ms(self.stages[stage])} ms")
+        age = "-"
+        if tron_client.last_position is not None:
+            age = f"{(now - tron_client.last_position) * 1000:.0f} ms"
+        text.append(f"net    {rate:5.0f} msg/s")
+        text.append(f"P age  {age}")
+        # Time since the server's tick, network and client together. Only
+        # as good as the clock offset: a PING is seen at the next frame,
+        # each estimate is off by up to half a frame, and a slower way
+        # there than back shows up as well.
+        if (tick_age := tron_client.position_age()) is not None:
+            text.append(f"P tick {tick_age * 1000:.0f} ms")
+        conn = tron_client.conn
+        if conn is not None and conn.rtt is not None:
+            text.append(f"rtt    {conn.rtt * 1000:5.1f} "
+                        f"{conn.jitter * 1000:5.1f} ms jitter")
+            text.append(f"clock  {conn.offset * 1000:+.1f} ms")
+        if len(self.latency) > 0:
+            text.append(f"ctrl   {ms(self.latency)} ms")
+        self.text = text
+        return text
+
+class TickWatchdog:
+
+    # Times the phases of a server tick against its budget. Overruns are
+    # collected and logged at most once per log_interval, with the time
+    # per phase of the worst one. With overload overruns among the last
+    # window ticks the server counts as overloaded until a whole window
+    # passes without any.
+
+    PHASES = ["input", "move", "gen", "broadcast", "other"]
+
+    def __init__(self, window=40, overload=10, log_interval=1.0):
+        self.overload = overload
+        self.log_interval = log_interval
+        self.recent = collections.deque(maxlen=window)
+        self.current = dict.fromkeys(TickWatchdog.PHASES, 0.0)
+        self.tick_start = None
+        self.last_mark = None
+        self.overloaded = False
+        self.overruns = 0               # since the last log
+        self.worst = None               # (total, budget, phases)
+        self.last_log = 0
+
+    def begin_tick(self):
+        self.tick_start = self.last_mark = time.perf_counter()
+        for phase in self.current:
+            self.current[phase] = 0.0
+
+    def mark(self, phase):
+        now = time.perf_counter()
+        self.current[phase] += now - self.last_mark
+        self.last_mark = now
+
+    # Returns a line for the log, if there is something to say
+    def end_tick(self, budget):
+        total = time.perf_counter() - self.tick_start
+        overrun = total > budget
+        self.recent.append(overrun)
+        if overrun:
+            self.overruns += 1
+            if self.worst is None or total - budget > \
+                    self.worst[0] - self.worst[1]:
+                self.worst = (total, budget, dict(self.current))
+
+        n = sum(self.recent)
+        if not self.overloaded and n >= self.overload:
+            self.overloaded = True
+            return "Server overloaded"
+        if self.overloaded and n == 0:
+            self.overloaded = False
+            return "Server load back to normal"
+
+        now = time.monotonic()
+        if self.overruns == 0 or now - self.last_log < self.log_interval:
+            return None
+        self.last_log = now
+        total, budget, phases = self.worst
+        breakdown = ", ".join(f"{phase} {t * 1000:.1f}"
+                              for phase, t in phases.items())
+        msg = (f"{self.overruns} tick overruns, worst {total * 1000:.1f} ms "
+               f"of {budget * 1000:.1f} ms: {breakdown} ms")
+        self.overruns = 0
+        self.worst = None
+        return msg
+
+class SamplingProfiler:
+
+    # Statistical profile of the main thread. While it runs, SIGPROF
+    # interrupts the process every interval seconds of CPU time and the
+    # handler counts the stack it interrupted; time spent waiting is not
+    # sampled. After window seconds, or when it is toggled off earlier, the
+    # stacks go to a file in directory in the collapsed format of
+    # flamegraph.pl, one "outer;...;inner count" per line. Unix only.
+
+    def __init__(self, window=10.0, interval=0.005, directory="."):
+        self.window = window
+        self.interval = interval
+        self.directory = directory
+        self.stacks = None
+        self.started = None
+        self.written = 0                # profiles, numbers the files
+
+    # Call from the main thread, e.g. from a signal handler
+    def toggle(self):
+        if self.stacks is not None:
+            self.stop()
+            return
+        print(f"\nProfiling for {self.window:g} s")
+        self.stacks = collections.Counter()
+        self.started = time.monotonic()
+        signal.signal(signal.SIGPROF, self.sample)
+        signal.setitimer(signal.ITIMER_PROF, self.interval, self.interval)
+
+    def sample(self, signum, frame):
+        # A SIGPROF that was already pending when stop() ran
+        if self.stacks is None:
+            return
+        self.stacks[self.collapse(frame)] += 1
+        if time.monotonic() - self.started >= self.window:
+            self.stop()
+
+    def stop(self):
+        signal.setitimer(signal.ITIMER_PROF, 0)
+        signal.signal(signal.SIGPROF, signal.SIG_IGN)
+        stacks, self.stacks = self.stacks, None
+
+        # A profile started within the same second gets its own file
+        self.written += 1
+        name = time.strftime("tron-profile-%Y%m%d-%H%M%S")
+        path = os.path.join(self.directory, f"{name}-{self.written}.folded")
+        try:
+            with open(path, "w") as f:
+                for stack, n in stacks.most_common():
+                    f.write(f"{stack} {n}\n")
+            print(f"\nProfile of {sum(stacks.values())} samples written to "
+                  f"{path}")
+        except OSError as e:
+            print(f"\nCan not write profile {path}: "
+                  f"{type(e).__name__} – {e}")
+
+    @staticmethod
+    def collapse(frame):
+        names = []
+        while frame is not None:
+            code = frame.f_code
+            names.append(f"{code.co_name} "
+                         f"({os.path.basename(code.co_filename)}:"
+                         f"{code.co_firstlineno})")
+            frame = frame.f_back
+        return ";".join(reversed(names))
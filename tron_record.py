@@ -0,0 +1,168 @@
+import struct
+
+from tron_model import Arena
+from tron_model import PlayerModel
+
+# A recording is an append-only sequence of rounds:
+#
+#   MAGIC
+#   'S' width height num_players  { x y dx dy speed name }*num_players
+#   'L' max_trail                                   (bounded trails only)
+#   'T' dt num_inputs  { player move }*num_inputs          (once per tick)
+#   'E' winner
+#
+# All numbers are little endian. Positions and the tick step are stored as
+# doubles so that re-simulating a round gives bit-identical trails.
+
+MAGIC = b"TRONREC1"
+
+ROUND = struct.Struct("<cIIH")
+START = struct.Struct("<ddbbB")
+NAME = struct.Struct("<B")
+TICK = struct.Struct("<cdH")
+INPUT = struct.Struct("<Hc")
+END = struct.Struct("<ch")
+TRAIL = struct.Struct("<cd")
+
+class MatchRecorder:
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.f = open(filename, "ab", buffering=1 << 16)
+        if self.f.tell() == 0:
+            self.f.write(MAGIC)
+        self.in_round = False
+
+    def __del__(self):
+        self.close()
+
+    def close(self):
+        if self.f is not None:
+            self.f.close()
+            self.f = None
+
+    def start_round(self, arena, names):
+        self.f.write(ROUND.pack(b"S", arena.width, arena.height,
+                                len(arena.player)))
+        for p, name in zip(arena.player, names):
+            name = (name or "").encode("utf-8")[:255]
+            self.f.write(START.pack(p.x, p.y, p.dx, p.dy, p.speed))
+            self.f.write(NAME.pack(len(name)) + name)
+        if arena.max_trail is not None:
+            self.f.write(TRAIL.pack(b"L", arena.max_trail))
+        self.in_round = True
+
+    def tick(self, dt, inputs):
+        self.f.write(TICK.pack(b"T", dt, len(inputs)))
+        for player_index, move in inputs:
+            self.f.write(INPUT.pack(player_index, move.encode("ascii")))
+
+    def end_round(self, winner):
+        if not self.in_round:
+            return
+        self.f.write(END.pack(b"E", winner))
+        self.f.flush()
+        self.in_round = False
+
+class RecordedRound:
+
+    def __init__(self, width, height, start, names):
+        self.width = width
+        self.height = height
+        self.start = start              # (x, y, dx, dy, speed) per player
+        self.names = names
+        self.max_trail = None
+        self.ticks = []                 # (dt, [(player_index, move), ...])
+        self.winner = None              # None if the recording was cut off
+
+    def num_players(self):
+        return len(self.start)
+
+    def duration(self):
+        return sum(dt for dt, _ in self.ticks)
+
+    def new_arena(self):
+        player = []
+        for x, y, dx, dy, speed in self.start:
+            p = PlayerModel(x, y, dx, dy)
+            p.speed = speed
+            player.append(p)
+        return Arena(self.width, self.height, player, self.max_trail)
+
+def apply_move(p, move):
+    if move == "L":
+        p.rotate_left()
+    elif move == "R":
+        p.rotate_right()
+    elif move == "U":
+        p.accelerate()
+    elif move == "D":
+        p.decelerate()
+
+def read_rounds(filename):
+    with open(filename, "rb") as f:
+        data = f.read()
+    if not data.startswith(MAGIC):
+        raise ValueError(f"{filename} is not a TRON recording")
+
+    rounds = []
+    rnd = None
+    offset = len(MAGIC)
+    try:
+        while offset < len(data):
+            tag = data[offset:offset + 1]
+            if tag == b"S":
+                _, width, height, n = ROUND.unpack_from(data, offset)
+                offset += ROUND.size
+                start, names = [], []
+                for i in range(n):
+                    start.append(START.unpack_from(data, offset))
+                    offset += START.size
+                    (length,) = NAME.unpack_from(data, offset)
+                    offset += NAME.size
+                    names.append(data[offset:offset + length].decode("utf-8"))
+                    offset += length
+                rnd = RecordedRound(width, height, start, names)
+                rounds.append(rnd)
+            elif tag == b"L" and rnd is not None:
+                _, rnd.max_trail = TRAIL.unpack_from(data, offset)
+                offset += TRAIL.size
+            elif tag == b"T" and rnd is not None:
+                _, dt, n = TICK.unpack_from(data, offset)
+                offset += TICK.size
+                inputs = []
+                for i in range(n):
+                    player_index, move = INPUT.unpack_from(data, offset)
+                    inputs.append((player_index, move.decode("ascii")))
+                    offset += INPUT.size
+                rnd.ticks.append((dt, inputs))
+            elif tag == b"E" and rnd is not None:
+                _, rnd.winner = END.unpack_from(data, offset)
+                offset += END.size
+                rnd = None
+            else:
+                print(f"{filename}: corrupt record at byte {offset}, "
+                      f"ignoring the rest")
+                break
+    except struct.error:
+        # The server was stopped in the middle of writing a record.
+        pass
+    return rounds
+
+# Re-simulates a recorded round at unlimited speed. Yields the arena and
+# the messages the server broadcast after each tick.
+def simulate(rnd):
+    arena = rnd.new_arena()
+    for dt, inputs in rnd.ticks:
+        for player_index, move in inputs:
+            apply_move(arena.player[player_index], move)
+        arena.move_player(dt)
+        msgs = []
+        while True:
+            msg, more = arena.gen_message()
+            msgs.append(msg)
+            if msg[0] == "E" or not more:
+                break
+        yield arena, msgs
+        if msgs[-1][0] == "E":
+            return
@@ -0,0 +1,100 @@
+import queue
+import threading
+import time
+
+SERIAL_PREFIX = "/dev/cu.usbserial"
+BAUDRATE = 9600
+ANALOG_INTERVAL = 1 / 60                # one analog reading per frame
+
+class SerialController:
+
+    # The controller sends one byte per button press. After it received
+    # an "X" it answers with "X" and the analog value as four digits. A
+    # reader thread turns this into (time.monotonic(), event) tuples:
+    #
+    #   "A"  A or R button          "B"  B or L button
+    #   "U"  stick above its start  "D"  stick below its start
+    #
+    # so that the frame loop never has to wait for the controller.
+
+    BUTTONS = {
+        b"A": "A", b"R": "A",
+        b"B": "B", b"L": "B",
+        b"U": "U", b"D": "D",
+    }
+
+    def __init__(self, ser):
+        self.ser = ser
+        self.events = queue.Queue()
+        self.center = None
+        self.running = True
+        self._thread = threading.Thread(target=self._read, daemon=True)
+        self._thread.start()
+
+    def close(self):
+        self.running = False
+        self._thread.join()
+        self.ser.close()
+
+    def get_events(self):
+        events = []
+        while True:
+            try:
+                events.append(self.events.get_nowait())
+            except queue.Empty:
+                return events
+
+    def _read_exactly(self, n):
+        data = b""
+        while self.running and len(data) < n:
+            data += self.ser.read(n - len(data))
+        return data
+
+    def _read_analog(self):
+        digits = self._read_exactly(4)
+        now = time.monotonic()
+        try:
+            val = int(digits.decode("ascii"))
+        except (UnicodeDecodeError, ValueError):
+            return                      # garbled, ask for the next one
+        if self.center is None:
+            self.center = val
+        if val > self.center:
+            self.events.put((now, "U"))
+        elif val < self.center:
+            self.events.put((now, "D"))
+
+    def _read(self):
+        try:
+            self.ser.write(b"X")
+            while self.running:
+                ch = self.ser.read(1)
+                if ch in SerialController.BUTTONS:
+                    self.events.put((time.monotonic(),
+                                     SerialController.BUTTONS[ch]))
+                elif ch == b"X":
+                    self._read_analog()
+                    time.sleep(ANALOG_INTERVAL)
+                    self.ser.write(b"X")
+        except OSError as e:            # includes serial.SerialException
+            print(f"Serial controller lost: {type(e).__name__} – {e}")
+        self.running = False
+
+def open_controller():
+    # pyserial is only imported when a controller is looked for
+    import serial
+    import serial.tools.list_ports
+
+    ser_dev = next(
+        (p.device for p in serial.tools.list_ports.comports()
+            if p.device.startswith(SERIAL_PREFIX)),
+        None
+    )
+    if ser_dev is None:
+        return None
+    try:
+        return SerialController(serial.Serial(ser_dev, BAUDRATE,
+                                              timeout=0.1))
+    except (serial.SerialException, OSError):
+        print(f"can not open serial device {ser_dev}")
+    return None
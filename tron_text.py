@@ -0,0 +1,36 @@
+import collections
+
+class TextCache:
+
+    # Rendering text with pygame is expensive compared to blitting the
+    # result, and HUD strings rarely change from one frame to the next.
+    # Entries are kept per (font, text, color), least recently used first.
+
+    def __init__(self, max_entries=256):
+        self.max_entries = max_entries
+        self.cache = collections.OrderedDict()
+
+    def create(self, font, text, color):
+        return font.render(text, True, color)
+
+    def release(self, entry):
+        pass
+
+    def get(self, font, text, color):
+        key = (font, text, tuple(color))
+        entry = self.cache.get(key)
+        if entry is None:
+            entry = self.create(font, text, color)
+            self.cache[key] = entry
+            if len(self.cache) > self.max_entries:
+                _, old = self.cache.popitem(last=False)
+                self.release(old)
+        else:
+            self.cache.move_to_end(key)
+        return entry
+
+    def clear(self, release=True):
+        if release:
+            for entry in self.cache.values():
+                self.release(entry)
+        self.cache.clear()